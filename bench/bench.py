@@ -0,0 +1,97 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Shared helpers for the benchmark scripts in this directory, run them
+# directly, e.g.:
+#
+#     python bench/bench_pokemon_index.py
+#
+# pogom reads its configuration from the command line when it is imported,
+# so setup() has to run before anything from pogom is imported. Some
+# benchmarks reuse helpers of the tests, setup() makes tests/ importable.
+
+import os
+import sys
+import tempfile
+from timeit import default_timer
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+TESTS = os.path.join(ROOT, 'tests')
+
+
+# Point sys.argv at a throwaway SQLite database and make pogom and the test
+# helpers importable.
+def setup(extra_args=None):
+    for path in (TESTS, ROOT):
+        if path not in sys.path:
+            sys.path.insert(0, path)
+    db_file = os.path.join(tempfile.mkdtemp(prefix='pogom-bench-'),
+                           'bench.db')
+    sys.argv = [sys.argv[0], '-k', 'bench', '-l', '40.0,-73.0',
+                '-u', 'bench', '-p', 'bench', '--db', db_file,
+                '--disable-blacklist']
+    sys.argv += extra_args or []
+    return db_file
+
+
+# Create a Flask app and an empty database with the current schema.
+def init_db():
+    from pogom.app import Pogom
+    from pogom.models import init_database, create_tables
+
+    app = Pogom(__name__)
+    app.set_heartbeat_control([0])
+    app.set_current_location((40.0, -73.0, 0))
+    db = init_database(app)
+    create_tables(db)
+    return app, db
+
+
+# Count the SQL statements executed by a database.
+class QueryCounter(object):
+
+    def __init__(self, db):
+        self.db = db
+        self.count = 0
+        self._execute_sql = db.execute_sql
+
+        def execute_sql(*args, **kwargs):
+            self.count += 1
+            return self._execute_sql(*args, **kwargs)
+
+        db.execute_sql = execute_sql
+
+    def reset(self):
+        count = self.count
+        self.count = 0
+        return count
+
+    def close(self):
+        self.db.execute_sql = self._execute_sql
+
+
+# Run fn `repeat` times, return the best time in seconds and the last result.
+def timed(fn, repeat=3):
+    best = None
+    result = None
+    for _ in range(repeat):
+        start = default_timer()
+        result = fn()
+        elapsed = default_timer() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best, result
+
+
+def report(title, rows, columns):
+    print title
+    widths = [max(len(str(c)), 12) for c in columns]
+    print '  '.join(str(c).rjust(w) for c, w in zip(columns, widths))
+    for row in rows:
+        cells = []
+        for value, width in zip(row, widths):
+            if isinstance(value, float):
+                value = '{:.4f}'.format(value)
+            cells.append(str(value).rjust(width))
+        print '  '.join(cells)
+    print
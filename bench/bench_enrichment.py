@@ -0,0 +1,54 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Per-row cost of adding the translated name, rarity and types to a large
+# /raw_data response, per-row lookups vs. the precomputed table.
+
+import argparse
+import random
+
+import bench
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=50000)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--locale', default='en')
+    options = parser.parse_args()
+
+    bench.setup()
+    from pogom import config
+    from pogom.utils import get_pokemon_data, get_pokemon_info, i8ln
+
+    config['LOCALE'] = options.locale
+    rand = random.Random(1)
+    rows = [{'pokemon_id': rand.randint(1, 251)} for _ in xrange(options.rows)]
+
+    # The lookups as they were done before the table.
+    def per_row():
+        for p in rows:
+            data = get_pokemon_data(p['pokemon_id'])
+            p['pokemon_name'] = i8ln(data['name'])
+            p['pokemon_rarity'] = i8ln(
+                get_pokemon_data(p['pokemon_id'])['rarity'])
+            p['pokemon_types'] = map(
+                lambda x: {"type": i8ln(x['type']), "color": x['color']},
+                get_pokemon_data(p['pokemon_id'])['types'])
+
+    def table():
+        for p in rows:
+            p.update(get_pokemon_info(p['pokemon_id']))
+
+    results = []
+    for name, fn in (('per-row', per_row), ('table', table)):
+        elapsed, _ = bench.timed(fn, options.repeat)
+        results.append((name, options.rows, elapsed,
+                        elapsed / options.rows * 1e6))
+
+    bench.report('Pokemon enrichment, locale {}'.format(options.locale),
+                 results, ('lookup', 'rows', 'total (s)', 'per row (us)'))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,67 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Time to link the spawnpoints of a hive to its scan locations on a location
+# change, the scalar pair loop vs. the grid buckets.
+
+import argparse
+import random
+
+import bench
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--steps', default='10,20')
+    parser.add_argument('--spawnpoints', type=int, default=10000)
+    parser.add_argument('--repeat', type=int, default=1)
+    options = parser.parse_args()
+
+    bench.setup()
+    from pogom.models import ScannedLocation
+    from pogom.schedulers import SpeedScan
+    from pogom.utils import cellid, get_args
+    from test_spatial import link_scalar
+
+    args = get_args()
+    results = []
+    for steps in [int(s) for s in options.steps.split(',')]:
+        args.step_limit = steps
+        scheduler = SpeedScan([[]], [], args)
+        scheduler.scan_location = (40.0, -73.0, 0)
+        scans = {}
+        initial = {}
+        for step, loc, _, _ in scheduler._generate_locations():
+            scans[cellid(loc)] = {'loc': loc, 'step': step}
+            initial[cellid(loc)] = {'done': False}
+
+        # Spread the spawnpoints over the hive.
+        rand = random.Random(steps)
+        radius = steps * 0.0011
+        spawn_points = [{'id': 'sp{}'.format(n),
+                         'latitude': 40.0 + rand.uniform(-radius, radius),
+                         'longitude': -73.0 + rand.uniform(-radius, radius)}
+                        for n in xrange(options.spawnpoints)]
+
+        def scalar():
+            return link_scalar(scans, spawn_points, 0.07)
+
+        def bucketed():
+            links = {}
+            ScannedLocation.link_spawn_points(scans, initial, spawn_points,
+                                              0.07, links, force=True)
+            return links
+
+        scalar_time, expected = bench.timed(scalar, options.repeat)
+        bucketed_time, links = bench.timed(bucketed, options.repeat)
+        assert links == expected
+        results.append((steps, len(scans), options.spawnpoints, len(links),
+                        scalar_time, bucketed_time))
+
+    bench.report('ScannedLocation.link_spawn_points', results,
+                 ('steps', 'scans', 'spawnpoints', 'links', 'scalar (s)',
+                  'bucketed (s)'))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,155 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Replays a scan workload against MySQL with REPLACE INTO, as peewee's
+# upsert() writes it, and with MysqlUpsert's INSERT ... ON DUPLICATE KEY
+# UPDATE. Spawn points, scanned locations and Pokemon are written once, then
+# rescanned in rounds that only move their timing fields, from several
+# threads with overlapping rows like the db updater threads.
+#
+# Reports the server's handler and row lock counters for each, so run it on
+# a MySQL server nothing else is using, e.g.:
+#
+#     python bench/bench_mysql_upsert.py --db-name bench --db-user root
+#
+# The database is emptied and filled by the benchmark.
+
+import argparse
+import random
+import threading
+from datetime import datetime, timedelta
+
+import bench
+
+COUNTERS = ('Handler_write', 'Handler_update', 'Handler_delete',
+            'Innodb_rows_inserted', 'Innodb_rows_updated',
+            'Innodb_rows_deleted', 'Innodb_row_lock_waits',
+            'Innodb_row_lock_time')
+
+
+def make_rows(models, count, rand, now):
+    sls = {}
+    sps = {}
+    pokemon = {}
+    for n in xrange(count):
+        lat = 40.0 + rand.uniform(-0.1, 0.1)
+        lng = -73.0 + rand.uniform(-0.1, 0.1)
+        sl = models.ScannedLocation.new_loc((lat, lng))
+        sl['last_modified'] = now
+        sls[sl['cellid']] = sl
+        sp = models.SpawnPoint.new_sp('sp{}'.format(n), lat, lng)
+        sp.update({'last_scanned': now, 'latest_seen': n % 3600,
+                   'earliest_unseen': (n + 900) % 3600})
+        sps[sp['id']] = sp
+        pokemon['e{}'.format(n)] = {
+            'encounter_id': 'e{}'.format(n), 'spawnpoint_id': sp['id'],
+            'pokemon_id': rand.randint(1, 251), 'latitude': lat,
+            'longitude': lng, 'disappear_time': now + timedelta(minutes=15),
+            'individual_attack': None, 'individual_defense': None,
+            'individual_stamina': None, 'move_1': None, 'move_2': None,
+            'cp': None, 'cp_multiplier': None, 'weight': None,
+            'height': None, 'gender': None, 'form': None}
+    return [(models.ScannedLocation, sls), (models.SpawnPoint, sps),
+            (models.Pokemon, pokemon)]
+
+
+# A rescan of a random share of the rows: new scan times, narrower TTH
+# windows, encounters seen again.
+def rescan(tables, rand, share, now):
+    batches = []
+    for cls, rows in tables:
+        keys = rand.sample(sorted(rows), int(len(rows) * share))
+        batch = {}
+        for key in keys:
+            row = dict(rows[key])
+            if 'last_scanned' in row:
+                row['last_scanned'] = now
+                row['latest_seen'] = (row['latest_seen'] + 1) % 3600
+            elif 'band1' in row:
+                row['last_modified'] = now
+                row['band1'] = rand.randint(0, 3599)
+            else:
+                row['last_modified'] = now
+            batch[key] = row
+        batches.append((cls, batch))
+    return batches
+
+
+def counters(db):
+    cursor = db.execute_sql('SHOW GLOBAL STATUS')
+    status = dict((name, value) for name, value in cursor.fetchall())
+    return dict((name, int(status.get(name, 0))) for name in COUNTERS)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=5000)
+    parser.add_argument('--rounds', type=int, default=20)
+    parser.add_argument('--share', type=float, default=0.3)
+    parser.add_argument('--threads', type=int, default=4)
+    parser.add_argument('--db-name', default='bench')
+    parser.add_argument('--db-user', default='root')
+    parser.add_argument('--db-pass', default='')
+    parser.add_argument('--db-host', default='127.0.0.1')
+    parser.add_argument('--db-port', default='3306')
+    options = parser.parse_args()
+
+    bench.setup(['--db-type', 'mysql', '--db-name', options.db_name,
+                 '--db-user', options.db_user, '--db-pass', options.db_pass,
+                 '--db-host', options.db_host, '--db-port', options.db_port])
+    app, db = bench.init_db()
+    from peewee import InsertQuery
+    from pogom import models
+
+    def replace_into(cls, rows):
+        InsertQuery(cls, rows=rows).upsert().execute()
+
+    def on_duplicate(cls, rows):
+        models.mysql_upsert.write(cls, rows, db, len(rows))
+
+    now = datetime.utcnow()
+    tables = make_rows(models, options.rows, random.Random(1), now)
+    results = []
+    for name, write in (('REPLACE INTO', replace_into),
+                        ('ON DUPLICATE KEY', on_duplicate)):
+        for cls, _ in reversed(tables):
+            cls.delete().execute()
+        for cls, rows in tables:
+            with db.atomic():
+                write(cls, rows.values())
+
+        def replay(seed):
+            rand = random.Random(seed)
+            for n in xrange(options.rounds):
+                for cls, batch in rescan(tables, rand, options.share,
+                                         now + timedelta(seconds=n)):
+                    rows = batch.values()
+                    with db.atomic():
+                        db.execute_sql('SET FOREIGN_KEY_CHECKS=0;')
+                        for i in xrange(0, len(rows), 250):
+                            write(cls, rows[i:i + 250])
+                        db.execute_sql('SET FOREIGN_KEY_CHECKS=1;')
+            db.close()
+
+        def run():
+            threads = [threading.Thread(target=replay, args=(seed,))
+                       for seed in xrange(options.threads)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        before = counters(db)
+        elapsed, _ = bench.timed(run, 1)
+        after = counters(db)
+        delta = dict((c, after[c] - before[c]) for c in COUNTERS)
+        results.append([name, elapsed] + [delta[c] for c in COUNTERS])
+
+    bench.report('MySQL scan replay, {} rows per table, {} rounds of {:.0%} '
+                 'from {} threads'.format(options.rows, options.rounds,
+                                          options.share, options.threads),
+                 results, ('statement', 'seconds') + COUNTERS)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,129 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Simulated SpeedScan.next_item throughput for growing queues and worker
+# counts, the linear scan it used to do vs. the ScanQueue index. Workers
+# move to every item they're given, so the queue drains as it would while
+# scanning. The assigned column counts the scans handed out, next_item also
+# parks items for workers that have to walk there first, the linear
+# reference doesn't.
+
+import argparse
+import copy
+import random
+from datetime import datetime, timedelta
+
+import bench
+
+# Seconds since every worker's last scan. Workers further away than they
+# could walk in that time get parked items instead of scans.
+WAITED = 600
+
+
+def make_queue(rand, locations, size):
+    queue = []
+    for n in xrange(size):
+        step, loc, _, _ = locations[n % len(locations)]
+        start = rand.randint(-600, 1800)
+        queue.append({'loc': loc, 'step': step,
+                      'kind': rand.choice(('band', 'TTH', 'spawn', 'spawn')),
+                      'start': start, 'end': start + rand.randint(600, 900),
+                      'sp': 'sp{}'.format(n)})
+    queue.sort(key=lambda item: item['start'])
+    return queue
+
+
+def make_workers(rand, locations, count):
+    last_scan_date = datetime.utcnow() - timedelta(seconds=WAITED)
+    workers = []
+    for n in xrange(count):
+        loc = rand.choice(locations)[1]
+        workers.append({'username': 'worker{}'.format(n),
+                        'latitude': loc[0], 'longitude': loc[1],
+                        'last_scan_date': last_scan_date})
+    return workers
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', default='1000,5000,20000')
+    parser.add_argument('--workers', default='10,100,2000')
+    parser.add_argument('--calls', type=int, default=1000)
+    options = parser.parse_args()
+
+    bench.setup(['-st', '50'])
+    from pogom.scanqueue import ScanQueue
+    from pogom.schedulers import SpeedScan
+    from pogom.utils import get_args
+    from test_scanqueue import linear_best
+
+    args = get_args()
+    scheduler = SpeedScan([[]], [], args)
+    scheduler.scan_location = (40.0, -73.0, 0)
+    locations = scheduler._generate_locations()
+    # Don't space out bands, every call should be able to get an item.
+    scheduler.band_spacing = 0
+
+    results = []
+    for size in [int(s) for s in options.sizes.split(',')]:
+        base_queue = make_queue(random.Random(size), locations, size)
+        for count in [int(w) for w in options.workers.split(',')]:
+            workers = make_workers(random.Random(count), locations, count)
+
+            # Linear scan, on its own copy of the queue.
+            queue = copy.deepcopy(base_queue)
+            sim_workers = copy.deepcopy(workers)
+
+            def linear():
+                found = 0
+                for n in xrange(options.calls):
+                    status = sim_workers[n % len(sim_workers)]
+                    worker_loc = (status['latitude'], status['longitude'])
+                    best = linear_best(queue, worker_loc, 0, WAITED,
+                                       args.kph)
+                    if best:
+                        item = queue[best['i']]
+                        item['done'] = 'Scanned'
+                        status['latitude'], status['longitude'] = \
+                            item['loc'][:2]
+                        found += 1
+                return found
+
+            linear_time, linear_found = bench.timed(linear, 1)
+
+            # The scheduler with the index.
+            queue = copy.deepcopy(base_queue)
+            sim_workers = copy.deepcopy(workers)
+            scheduler.base_date = datetime.utcnow()
+            scheduler.base_ms = 0
+            scheduler.queue_index = ScanQueue(queue)
+            scheduler.queues[0] = scheduler.queue_index.queue
+            scheduler.ready = True
+
+            def indexed():
+                found = 0
+                for n in xrange(options.calls):
+                    status = sim_workers[n % len(sim_workers)]
+                    step, loc, _, _, _, wait = scheduler.next_item(status)
+                    if step >= 0:
+                        status['latitude'], status['longitude'] = loc[:2]
+                        found += 1
+                    # Keep every worker ready to walk anywhere.
+                    status['last_scan_date'] = (datetime.utcnow() -
+                                                timedelta(seconds=WAITED))
+                return found
+
+            indexed_time, indexed_found = bench.timed(indexed, 1)
+            results.append((size, count,
+                            linear_time / options.calls * 1e6,
+                            indexed_time / options.calls * 1e6,
+                            options.calls / indexed_time,
+                            '{}/{}'.format(linear_found, indexed_found)))
+
+    bench.report('SpeedScan.next_item, {} calls'.format(options.calls),
+                 results, ('queue', 'workers', 'linear (us)',
+                           'indexed (us)', 'calls/s', 'assigned'))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Compare serving /raw_data Pokemon from the database against the in-memory
+# spatial index (-pi/--pokemon-index).
+
+import argparse
+import random
+from datetime import datetime, timedelta
+
+import bench
+
+
+def make_pokemon(count, seed=1):
+    rand = random.Random(seed)
+    disappear_time = datetime.utcnow() + timedelta(hours=1)
+    last_modified = datetime.utcnow()
+    for i in xrange(count):
+        yield {
+            'encounter_id': 'bench{}'.format(i),
+            'spawnpoint_id': 'sp{}'.format(i % 50000),
+            'pokemon_id': rand.randint(1, 251),
+            # Spread the Pokemon over a city sized area.
+            'latitude': 40.0 + rand.random() * 0.5,
+            'longitude': -73.0 + rand.random() * 0.5,
+            'disappear_time': disappear_time,
+            'last_modified': last_modified,
+            'gender': 1
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', type=int, nargs='+',
+                        default=[10000, 100000, 1000000])
+    parser.add_argument('--repeat', type=int, default=3)
+    options = parser.parse_args()
+
+    bench.setup()
+    bench.init_db()
+    from pogom.models import Pokemon, active_pokemon, args, flaskDb
+
+    db = flaskDb.database
+    # A typical phone sized viewport and a fully zoomed out one.
+    viewports = [('viewport', (40.2, -72.8, 40.23, -72.75)),
+                 ('full map', (None, None, None, None))]
+
+    rows = []
+    inserted = 0
+    for size in sorted(options.sizes):
+        new_rows = list(make_pokemon(size))[inserted:]
+        with db.atomic():
+            for i in xrange(0, len(new_rows), 50):
+                Pokemon.insert_many(new_rows[i:i + 50]).execute()
+        active_pokemon.add(new_rows)
+        inserted = size
+
+        for name, viewport in viewports:
+            args.pokemon_index = False
+            sql_time, sql_result = bench.timed(
+                lambda: Pokemon.get_active(*viewport), options.repeat)
+            args.pokemon_index = True
+            index_time, index_result = bench.timed(
+                lambda: Pokemon.get_active(*viewport), options.repeat)
+            assert len(sql_result) == len(index_result)
+            rows.append((size, name, len(sql_result), sql_time, index_time,
+                         sql_time / max(index_time, 1e-9)))
+
+    bench.report('Pokemon.get_active, database vs. in-memory index (s)',
+                 rows, ('rows', 'query', 'results', 'database', 'index',
+                        'speedup'))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,217 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# End-to-end throughput of the parse and storage pipeline: map responses
+# go through parse_map at a given rate, into the db_update_queue and
+# wh_update_queue, which are consumed by the real db_updater and wh_updater
+# threads. Webhooks are posted to a local receiver that answers every
+# request right away. The responses are either a recording made with
+# --record-scans, or generated by a seeded FakeMap, e.g.:
+#
+#     python bench/bench_replay.py --scans 2000
+#     python bench/bench_replay.py --recording scans.json.gz --rate 50
+#     python bench/bench_replay.py --workers 8 --parse-processes 4
+
+import argparse
+import logging
+import threading
+import time
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from SocketServer import ThreadingMixIn
+from queue import Queue
+from timeit import default_timer
+
+import bench
+
+
+class Receiver(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class ReceiverHandler(BaseHTTPRequestHandler):
+    requests = 0
+
+    def do_POST(self):
+        ReceiverHandler.requests += 1
+        self.rfile.read(int(self.headers.getheader('content-length', 0)))
+        self.send_response(200)
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+# A Queue that counts the items and db rows put in it, and records its
+# largest size.
+class CountingQueue(Queue):
+
+    def __init__(self):
+        Queue.__init__(self)
+        self.items = 0
+        self.rows = 0
+        self.max_size = 0
+
+    def put(self, item, *args, **kwargs):
+        self.items += 1
+        # Webhook items are (type, message), db updates (model, rows).
+        if not isinstance(item[0], basestring):
+            self.rows += len(item[1])
+        Queue.put(self, item, *args, **kwargs)
+        self.max_size = max(self.max_size, self.qsize())
+
+
+# Scans of a FakeMap, walking the hive's locations `interval` seconds apart.
+def fake_scans(options):
+    from pogom.fakemap import FakeMap
+    from pogom.schedulers import HexSearch
+    from pogom.utils import get_args
+
+    radius = (options.steps - 1) * 105 + 60
+    fake_map = FakeMap((40.0, -73.0), radius, options.spawnpoints,
+                       seed=options.seed, pokestops=options.pokestops,
+                       gyms=options.gyms)
+    scheduler = HexSearch([Queue()], [], get_args())
+    scheduler.scan_location = (40.0, -73.0, 0)
+    locations = [loc for _, loc, _, _ in scheduler._generate_locations()]
+    start = time.time() - options.scans * options.interval
+    for n in xrange(options.scans):
+        loc = locations[n % len(locations)]
+        response, _ = fake_map.map_objects(loc,
+                                           start + n * options.interval)
+        yield loc, response
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--recording',
+                        help='Replay a file made with --record-scans.')
+    parser.add_argument('--record',
+                        help='Save the generated scans to this file.')
+    parser.add_argument('--scans', type=int, default=2000)
+    parser.add_argument('--steps', type=int, default=5)
+    parser.add_argument('--spawnpoints', type=int, default=400)
+    parser.add_argument('--pokestops', type=int, default=60)
+    parser.add_argument('--gyms', type=int, default=20)
+    parser.add_argument('--interval', type=float, default=1.0,
+                        help='Seconds between generated scans.')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--rate', type=float, default=0,
+                        help='Scans per second, 0 for no limit.')
+    parser.add_argument('--db-threads', type=int, default=1)
+    parser.add_argument('--wh-threads', type=int, default=1)
+    parser.add_argument('--workers', type=int, default=1,
+                        help='Threads handing the scans to parse_map.')
+    parser.add_argument('--parse-processes', type=int, default=0)
+    parser.add_argument('--wh-batch-size', type=int, default=0)
+    options = parser.parse_args()
+
+    receiver = Receiver(('127.0.0.1', 0), ReceiverHandler)
+    t = threading.Thread(target=receiver.serve_forever)
+    t.daemon = True
+    t.start()
+    url = 'http://127.0.0.1:{}/'.format(receiver.server_address[1])
+
+    bench.setup(['-st', str(options.steps), '-wh', url,
+                 '--db-threads', str(options.db_threads),
+                 '--wh-threads', str(options.wh_threads),
+                 '--parse-processes', str(options.parse_processes),
+                 '--wh-batch-size', str(options.wh_batch_size)])
+    app, db = bench.init_db()
+    logging.basicConfig()
+    logging.getLogger('pogom').setLevel(logging.ERROR)
+    from pogom import config
+    from pogom.models import db_updater, parse_map
+    from pogom.parsepool import ParsePool
+    from pogom.scanrecord import ScanRecorder, read_scans
+    from pogom.utils import get_args
+    from pogom.webhook import WebhookBatcher, wh_updater
+
+    args = get_args()
+    config['parse_pokemon'] = True
+    config['parse_pokestops'] = True
+    config['parse_gyms'] = True
+
+    if options.recording:
+        scans = list(read_scans(options.recording))
+        source = options.recording
+    else:
+        scans = list(fake_scans(options))
+        source = 'FakeMap seed {}'.format(options.seed)
+        if options.record:
+            recorder = ScanRecorder(options.record)
+            for loc, response in scans:
+                recorder.write(loc, response)
+            recorder.close()
+
+    # Forked before the updater threads start, as runserver does.
+    parse_pool = None
+    if args.parse_processes:
+        parse_pool = ParsePool(args.parse_processes)
+
+    db_queue = CountingQueue()
+    wh_queue = CountingQueue()
+    for i in range(args.db_threads):
+        t = threading.Thread(target=db_updater, args=(args, db_queue, db))
+        t.daemon = True
+        t.start()
+    key_caches = {}
+    wh_batcher = None
+    if args.wh_batch_size:
+        wh_batcher = WebhookBatcher(args)
+    for i in range(args.wh_threads):
+        t = threading.Thread(target=wh_updater,
+                             args=(args, wh_queue, key_caches, wh_batcher))
+        t.daemon = True
+        t.start()
+
+    todo = Queue()
+    for n, scan in enumerate(scans):
+        todo.put((n, scan))
+
+    def worker():
+        status = {'proxy_url': None}
+        while not todo.empty():
+            n, (loc, response) = todo.get()
+            if options.rate:
+                ahead = start + n / options.rate - default_timer()
+                if ahead > 0:
+                    time.sleep(ahead)
+            if parse_pool:
+                parse_pool.parse(args, response, loc, db_queue, wh_queue,
+                                 None)
+            else:
+                parse_map(args, response, loc, db_queue, wh_queue, None,
+                          None, status, None, None, None)
+
+    workers = [threading.Thread(target=worker)
+               for _ in range(options.workers)]
+    start = default_timer()
+    for t in workers:
+        t.start()
+    for t in workers:
+        t.join()
+    parsed = default_timer() - start
+    db_queue.join()
+    wh_queue.join()
+    if wh_batcher:
+        wh_batcher.join()
+    elapsed = default_timer() - start
+
+    if parse_pool:
+        parse_pool.close()
+
+    bench.report('Replay of {} scans from {}, {} workers, {} parse '
+                 .format(len(scans), source, options.workers,
+                         args.parse_processes) +
+                 'processes, {} db threads, {} wh threads'
+                 .format(args.db_threads, args.wh_threads),
+                 [(len(scans) / parsed, len(scans) / elapsed,
+                   db_queue.rows / elapsed, db_queue.max_size,
+                   wh_queue.max_size, wh_queue.items,
+                   ReceiverHandler.requests)],
+                 ('parsed/s', 'scans/s', 'DB rows/s', 'max DB queue',
+                  'max WH queue', 'WH messages', 'WH requests'))
+
+
+if __name__ == '__main__':
+    main()
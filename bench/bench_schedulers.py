@@ -0,0 +1,69 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Compare the schedulers on the same simulated hive, see
+# tests/simulator.py. Every scheduler starts from an empty database with
+# --history hours of past sightings, which SpawnScan and HexSearchSpawnpoint
+# need to find the spawnpoints. Apart from the timings, the results are the
+# same on every run for the same options.
+
+import argparse
+import logging
+
+import bench
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--schedulers',
+                        default='hexsearch,hexsearchspawnpoint,spawnscan,' +
+                        'speedscan')
+    parser.add_argument('--steps', type=int, default=3)
+    parser.add_argument('--spawnpoints', type=int, default=80)
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--hours', type=float, default=3)
+    parser.add_argument('--warmup', type=float, default=1,
+                        help='Hours of appearances left out of the results.')
+    parser.add_argument('--history', type=int, default=2)
+    parser.add_argument('--scan-delay', type=int, default=10)
+    parser.add_argument('--seed', type=int, default=1)
+    options = parser.parse_args()
+
+    bench.setup(['-st', str(options.steps),
+                 '-sd', str(options.scan_delay)])
+    app, db = bench.init_db()
+    logging.basicConfig()
+    logging.getLogger('pogom').setLevel(logging.ERROR)
+    from pogom.fakemap import FakeMap
+    from pogom.utils import get_args
+    from simulator import Simulation
+
+    args = get_args()
+    # Spawnpoints in the circle the scan circles cover completely: rings
+    # are 105m apart along the hex's sides, the outer circles add ~60m.
+    radius = (options.steps - 1) * 105 + 60
+    fake_map = FakeMap((40.0, -73.0), radius, options.spawnpoints,
+                       seed=options.seed)
+
+    results = []
+    for name in options.schedulers.split(','):
+        simulation = Simulation(name, fake_map, args, db,
+                                workers=options.workers,
+                                history_hours=options.history,
+                                warmup=int(options.warmup * 3600))
+        r = simulation.run(int(options.hours * 3600))
+        results.append((name, r['scans'], r['spawns'], r['reached'],
+                        r['delay'], r['tth'], r['idle'], r['next_item'],
+                        r['schedule']))
+
+    bench.report('Simulated schedulers, {} spawnpoints, {} steps, {} '
+                 .format(options.spawnpoints, options.steps,
+                         options.workers) +
+                 'workers, {} hours'.format(options.hours),
+                 results, ('scheduler', 'scans', 'spawns', 'reached (%)',
+                           'delay (s)', 'TTH (%)', 'idle (%)',
+                           'next_item (ms)', 'schedule (ms)'))
+
+
+if __name__ == '__main__':
+    main()
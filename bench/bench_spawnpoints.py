@@ -0,0 +1,159 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Startup time of the spawnpoint schedulers on a large pokemon table: the
+# queries SpawnScan (-ss) and HexSearchSpawnpoint use to load spawnpoints,
+# grouping the whole Pokemon history vs. reading the SpawnPointTimeCount
+# catalogue, which is filled by the db updater as Pokemon are stored. Then
+# HexSearchSpawnpoint's search for scan locations with a spawnpoint in
+# range, geodesic distances to every spawnpoint vs. the SpatialIndex.
+
+import argparse
+import random
+from datetime import datetime, timedelta
+
+import geopy.distance
+
+import bench
+
+
+# The queries get_spawnpoints() and get_spawnpoints_in_hex() used to run,
+# as spawnpoint ids by location.
+def grouped_spawnpoints(Pokemon, s, w, n, e):
+    from peewee import SQL, fn
+    from pogom.utils import date_secs
+
+    query = (Pokemon
+             .select(Pokemon.latitude, Pokemon.longitude,
+                     Pokemon.spawnpoint_id,
+                     (date_secs(Pokemon.disappear_time)).alias('time'),
+                     fn.Count(Pokemon.spawnpoint_id).alias('count'))
+             .where((Pokemon.latitude <= n) & (Pokemon.latitude >= s) &
+                    (Pokemon.longitude >= w) & (Pokemon.longitude <= e))
+             .group_by(Pokemon.latitude, Pokemon.longitude,
+                       Pokemon.spawnpoint_id, SQL('time'))
+             .dicts())
+    return dict((sp['spawnpoint_id'], (sp['latitude'], sp['longitude']))
+                for sp in query)
+
+
+def grouped_spawnpoints_in_hex(Pokemon, s, w, n, e):
+    from pogom.utils import date_secs
+
+    query = (Pokemon
+             .select(Pokemon.latitude.alias('lat'),
+                     Pokemon.longitude.alias('lng'),
+                     (date_secs(Pokemon.disappear_time)).alias('time'),
+                     Pokemon.spawnpoint_id)
+             .where((Pokemon.latitude <= n) & (Pokemon.latitude >= s) &
+                    (Pokemon.longitude >= w) & (Pokemon.longitude <= e))
+             .group_by(Pokemon.spawnpoint_id)
+             .dicts())
+    return dict((sp['spawnpoint_id'], (sp['lat'], sp['lng']))
+                for sp in query)
+
+
+# HexSearchSpawnpoint._generate_locations() before the SpatialIndex.
+def geodesic_locations(locations, spawnpoints):
+    points = set((sp['latitude'], sp['longitude']) for sp in spawnpoints)
+    return [coords for coords in locations
+            if any(geopy.distance.distance(coords[1], x).meters <= 70
+                   for x in points)]
+
+
+def fill(models, db, rows, spawnpoints, steps):
+    rand = random.Random(1)
+    radius = steps * 0.0011
+    sps = [('sp{}'.format(n), 40.0 + rand.uniform(-radius, radius),
+            -73.0 + rand.uniform(-radius, radius), rand.randint(0, 3599))
+           for n in xrange(spawnpoints)]
+    now = datetime.utcnow()
+    chunk = []
+    for n in xrange(rows):
+        sp_id, lat, lng, secs = sps[n % spawnpoints]
+        hours = n // spawnpoints
+        chunk.append({
+            'encounter_id': 'e{}'.format(n), 'spawnpoint_id': sp_id,
+            'pokemon_id': rand.randint(1, 251), 'latitude': lat,
+            'longitude': lng,
+            'disappear_time': (now - timedelta(hours=hours)).replace(
+                minute=secs // 60, second=secs % 60, microsecond=0)})
+        if len(chunk) == 50000 or n == rows - 1:
+            with db.atomic():
+                models.sqlite_upsert.write(models.Pokemon, chunk, db)
+            chunk = []
+    models.backfill_pokemon_rollups(db)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=2000000)
+    parser.add_argument('--spawnpoints', type=int, default=20000)
+    parser.add_argument('--steps', type=int, default=40)
+    parser.add_argument('--sample', type=int, default=500)
+    parser.add_argument('--repeat', type=int, default=3)
+    options = parser.parse_args()
+
+    bench.setup(['-st', str(options.steps)])
+    app, db = bench.init_db()
+    from pogom import models
+    from pogom.models import Pokemon, hex_bounds
+    from pogom.schedulers import HexSearch, HexSearchSpawnpoint
+    from pogom.spatial import SpatialIndex
+    from pogom.utils import get_args
+
+    args = get_args()
+    fill(models, db, options.rows, options.spawnpoints, options.steps)
+    n, e, s, w = hex_bounds((40.0, -73.0), options.steps)
+
+    def catalogue():
+        return dict((sp['spawnpoint_id'], (sp['latitude'], sp['longitude']))
+                    for sp in Pokemon.get_spawnpoints(s, w, n, e))
+
+    def catalogue_in_hex():
+        return Pokemon.get_spawnpoints_in_hex((40.0, -73.0),
+                                              args.step_limit)
+
+    results = []
+    grouped_time, grouped = bench.timed(
+        lambda: grouped_spawnpoints(Pokemon, s, w, n, e), options.repeat)
+    catalogue_time, found = bench.timed(catalogue, options.repeat)
+    assert sorted(grouped) == sorted(found)
+    results.append(('get_spawnpoints', len(found), grouped_time,
+                    catalogue_time, grouped_time / catalogue_time))
+
+    grouped_time, grouped = bench.timed(
+        lambda: grouped_spawnpoints_in_hex(Pokemon, s, w, n, e),
+        options.repeat)
+    catalogue_time, found = bench.timed(catalogue_in_hex, options.repeat)
+    results.append(('in_hex (-ss)', len(found), grouped_time,
+                    catalogue_time, grouped_time / catalogue_time))
+
+    # Filtering the hex's scan locations, on a sample of them since the
+    # geodesic version takes minutes on large hives.
+    scheduler = HexSearchSpawnpoint([[]], [], args)
+    scheduler.scan_location = (40.0, -73.0, 0)
+    locations = HexSearch._generate_locations(scheduler)[:options.sample]
+    spawnpoints = Pokemon.get_spawnpoints(s, w, n, e)
+
+    def indexed_locations():
+        index = SpatialIndex(spawnpoints)
+        return [coords for coords in locations
+                if scheduler._any_spawnpoints_in_range(coords[1], index)]
+
+    geodesic_time, expected = bench.timed(
+        lambda: geodesic_locations(locations, spawnpoints), 1)
+    indexed_time, found = bench.timed(indexed_locations, options.repeat)
+    assert expected == found
+    results.append(('hexsearchspawnpoint', len(found), geodesic_time,
+                    indexed_time, geodesic_time / indexed_time))
+
+    bench.report('Spawnpoint loading, {} Pokemon at {} spawnpoints, {} steps'
+                 .format(options.rows, options.spawnpoints, options.steps) +
+                 ', {} scan locations'.format(len(locations)),
+                 results, ('query', 'results', 'before (s)', 'after (s)',
+                           'speedup'))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Rows per second written to SQLite by bulk_upsert for each model the
+# scanners write, peewee's query builder with 50 rows per statement vs.
+# SqliteUpsert.
+
+import argparse
+import random
+from datetime import datetime, timedelta
+
+import bench
+
+
+def make_rows(models, count):
+    rand = random.Random(1)
+    now = datetime.utcnow()
+    rows = {}
+
+    def loc():
+        return 40.0 + rand.uniform(-0.1, 0.1), -73.0 + rand.uniform(-0.1, 0.1)
+
+    sls = {}
+    sps = {}
+    for n in xrange(count):
+        lat, lng = loc()
+        sl = models.ScannedLocation.new_loc((lat, lng))
+        sl['last_modified'] = now
+        sls[sl['cellid']] = sl
+        sp = models.SpawnPoint.new_sp('sp{}'.format(n), lat, lng)
+        sp.update({'last_scanned': now, 'latest_seen': n % 3600,
+                   'earliest_unseen': (n + 900) % 3600})
+        sps[sp['id']] = sp
+    rows[models.ScannedLocation] = sls
+    rows[models.SpawnPoint] = sps
+    rows[models.ScanSpawnPoint] = dict(
+        (cell + sp, {'scannedlocation': cell, 'spawnpoint': sp})
+        for cell, sp in zip(sls, sps))
+    rows[models.Pokemon] = dict(
+        ('e{}'.format(n), {
+            'encounter_id': 'e{}'.format(n), 'spawnpoint_id': 'sp{}'.format(n),
+            'pokemon_id': rand.randint(1, 251), 'latitude': loc()[0],
+            'longitude': loc()[1],
+            'disappear_time': now + timedelta(minutes=15),
+            'individual_attack': None, 'individual_defense': None,
+            'individual_stamina': None, 'move_1': None, 'move_2': None,
+            'cp': None, 'cp_multiplier': None, 'weight': None,
+            'height': None, 'gender': None, 'form': None})
+        for n in xrange(count))
+    rows[models.SpawnpointDetectionData] = dict(
+        ('d{}'.format(n), {
+            'id': 'd{}'.format(n), 'encounter_id': 'e{}'.format(n),
+            'spawnpoint_id': 'sp{}'.format(n), 'scan_time': now,
+            'tth_secs': None})
+        for n in xrange(count))
+    rows[models.WorkerStatus] = dict(
+        ('u{}'.format(n), {
+            'username': 'u{}'.format(n), 'worker_name': 'w{}'.format(n),
+            'success': n, 'fail': 0, 'no_items': 0, 'skip': 0, 'captcha': 0,
+            'last_modified': now, 'message': 'Scanning.',
+            'last_scan_date': now, 'latitude': None, 'longitude': None})
+        for n in xrange(count))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=5000)
+    parser.add_argument('--repeat', type=int, default=3)
+    options = parser.parse_args()
+
+    bench.setup()
+    app, db = bench.init_db()
+    from peewee import InsertQuery
+    from pogom import models
+
+    def peewee_upsert(cls, data):
+        rows = data.values()
+        with db.atomic():
+            for i in xrange(0, len(rows), 50):
+                InsertQuery(cls, rows=rows[i:i + 50]).upsert().execute()
+
+    def fast_upsert(cls, data):
+        models.bulk_upsert(cls, data, db)
+
+    results = []
+    for cls, data in sorted(make_rows(models, options.rows).items(),
+                            key=lambda item: item[0].__name__):
+        columns = len(models.sqlite_upsert._fields(cls, data.values()[0]))
+        timings = []
+        for fn in (peewee_upsert, fast_upsert):
+            elapsed, _ = bench.timed(lambda: fn(cls, data), options.repeat)
+            timings.append(len(data) / elapsed)
+        assert cls.select().count() == len(data)
+        results.append((cls.__name__, columns,
+                        models.sqlite_upsert.rows_per_statement(columns),
+                        int(timings[0]), int(timings[1]),
+                        timings[1] / timings[0]))
+
+    bench.report('SQLite upserts, {} rows per model'.format(options.rows),
+                 results, ('model', 'columns', 'rows/stmt', 'peewee rows/s',
+                           'fast rows/s', 'speedup'))
+
+
+if __name__ == '__main__':
+    main()
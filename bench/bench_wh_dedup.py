@@ -0,0 +1,104 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Throughput of the webhook dedup cache for a number of wh_updater threads.
+# The messages are already on the wh_update_queue, and are "sent" to a
+# stand-in for the batcher that only takes --submit-ms, as handing a request
+# to the FuturesSession does. About half of the messages are resends of
+# unchanged objects, which the cache drops.
+
+import argparse
+import random
+import threading
+import time
+from queue import Queue
+from timeit import default_timer
+
+import bench
+
+
+# Counts the messages sent, taking `seconds` to submit each one.
+class Submitter(object):
+
+    def __init__(self, seconds):
+        self.seconds = seconds
+        self.lock = threading.Lock()
+        self.sent = 0
+
+    def send(self, data):
+        if self.seconds:
+            time.sleep(self.seconds)
+        with self.lock:
+            self.sent += 1
+
+
+# Queue items as parse_map makes them, with their digest.
+def messages(count, objects, seed):
+    from pogom.webhook import webhook_item
+
+    rand = random.Random(seed)
+    for n in xrange(count):
+        ident = rand.randrange(objects)
+        kind = rand.random()
+        # One in four messages changes an object, so it's resent.
+        version = rand.randrange(4) == 0 and n or 0
+        if kind < 0.7:
+            yield webhook_item('pokemon', {
+                'encounter_id': ident, 'spawnpoint_id': ident,
+                'pokemon_id': 1 + ident % 251, 'latitude': 40.0,
+                'longitude': -73.0, 'disappear_time': 1496318400 + ident,
+                'cp': version})
+        elif kind < 0.9:
+            yield webhook_item('pokestop', {
+                'pokestop_id': ident, 'enabled': True, 'latitude': 40.0,
+                'longitude': -73.0, 'lure_expiration': version,
+                'active_fort_modifier': None})
+        else:
+            yield webhook_item('gym', {
+                'gym_id': ident, 'team_id': version % 4,
+                'guard_pokemon_id': 1, 'gym_points': version,
+                'enabled': True, 'latitude': 40.0, 'longitude': -73.0})
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--threads', default='1,2,4,8')
+    parser.add_argument('--messages', type=int, default=100000)
+    parser.add_argument('--objects', type=int, default=2000,
+                        help='Distinct objects of each type.')
+    parser.add_argument('--submit-ms', type=float, default=0.05)
+    parser.add_argument('--lfu-size', type=int, default=2500)
+    parser.add_argument('--seed', type=int, default=1)
+    options = parser.parse_args()
+
+    bench.setup(['-wh', 'http://127.0.0.1:1/',
+                 '--wh-lfu-size', str(options.lfu_size)])
+    from pogom.utils import get_args
+    from pogom.webhook import wh_updater
+
+    args = get_args()
+    items = list(messages(options.messages, options.objects, options.seed))
+    results = []
+    for threads in [int(t) for t in options.threads.split(',')]:
+        queue = Queue()
+        for item in items:
+            queue.put(item)
+        submitter = Submitter(options.submit_ms / 1000.0)
+        key_caches = {}
+        start = default_timer()
+        for i in range(threads):
+            t = threading.Thread(target=wh_updater,
+                                 args=(args, queue, key_caches, submitter))
+            t.daemon = True
+            t.start()
+        queue.join()
+        elapsed = default_timer() - start
+        results.append((threads, len(items) / elapsed, submitter.sent))
+
+    bench.report('Webhook dedup of {} messages, {}ms per submit'
+                 .format(len(items), options.submit_ms), results,
+                 ('threads', 'messages/s', 'sent'))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,105 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Throughput of the webhook outbox: appending messages as wh_updater does,
+# reading them back as an endpoint catching up does, and replaying them to
+# a local receiver through WebhookOutbox with no rate limit.
+
+import argparse
+import shutil
+import tempfile
+from timeit import default_timer
+
+import bench
+
+
+def pokemon(n):
+    return {'type': 'pokemon', 'message': {
+        'encounter_id': 'MTIzNDU2Nzg5MDEyMzQ1Njc4OQ==', 'spawnpoint_id':
+        '89c25f4a2f3', 'pokemon_id': 1 + n % 251, 'latitude': 40.0 + n,
+        'longitude': -73.0, 'disappear_time': 1496318400 + n,
+        'time_until_hidden_ms': 1200000, 'last_modified_time': 1496317200000,
+        'seconds_until_despawn': 1200, 'spawn_start': 900, 'spawn_end': 2700,
+        'verified': True, 'individual_attack': None,
+        'individual_defense': None, 'individual_stamina': None,
+        'move_1': None, 'move_2': None, 'weight': None, 'height': None,
+        'gender': None, 'form': None, 'cp': None, 'cp_multiplier': None,
+        'player_level': 30}}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--messages', type=int, default=100000)
+    parser.add_argument('--replay-messages', type=int, default=5000)
+    parser.add_argument('--batch-sizes', default='1,50')
+    options = parser.parse_args()
+
+    bench.setup()
+    from pogom.outbox import Outbox
+    from pogom.webhook import WebhookOutbox
+    from test_webhook import batch_args, receiver
+
+    path = tempfile.mkdtemp()
+    batch_sizes = [int(b) for b in options.batch_sizes.split(',')]
+    messages = [pokemon(n) for n in range(options.messages)]
+    results = []
+    try:
+        outbox = Outbox(path)
+        outbox.register(['reader-{}'.format(b) for b in batch_sizes])
+        start = default_timer()
+        for data in messages:
+            outbox.append(data)
+        elapsed = default_timer() - start
+        megabytes = outbox.end / 1024.0 / 1024.0
+        results.append(('append', len(messages) / elapsed,
+                        megabytes / elapsed))
+
+        for batch_size in batch_sizes:
+            name = 'reader-{}'.format(batch_size)
+            read = 0
+            start = default_timer()
+            while True:
+                records, offset = outbox.read(name, batch_size)
+                if not records:
+                    break
+                outbox.commit(name, offset)
+                read += len(records)
+            elapsed = default_timer() - start
+            results.append(('read, batches of {}'.format(batch_size),
+                            read / elapsed, megabytes / elapsed))
+        outbox.close()
+        shutil.rmtree(path)
+
+        for batch_size in batch_sizes:
+            url, bodies = receiver()
+            path = tempfile.mkdtemp()
+            outbox = Outbox(path)
+            outbox.register([url])
+            for data in messages[:options.replay_messages]:
+                outbox.append(data)
+            megabytes = outbox.end / 1024.0 / 1024.0
+            outbox.close()
+
+            # A restart with a backlog for an endpoint that is back.
+            start = default_timer()
+            wh_outbox = WebhookOutbox(batch_args(
+                [url], wh_outbox=path, wh_outbox_size=1024,
+                wh_outbox_age=24, wh_outbox_rate=0,
+                wh_batch_size=batch_size if batch_size > 1 else 0))
+            wh_outbox.join()
+            elapsed = default_timer() - start
+            wh_outbox.close()
+            shutil.rmtree(path)
+            results.append(('replay over HTTP, batches of {}'.format(
+                batch_size), options.replay_messages / elapsed,
+                megabytes / elapsed))
+    finally:
+        shutil.rmtree(path, ignore_errors=True)
+
+    bench.report('Webhook outbox, {} messages ({} replayed over HTTP)'
+                 .format(len(messages), options.replay_messages), results,
+                 ('operation', 'messages/s', 'MB/s'))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,113 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Memory and CPU of idle search workers, for each --worker-engine. The
+# workers wait for a scheduler that never becomes ready, waking up every
+# second as they do between scans. Each engine runs in its own process,
+# e.g.:
+#
+#     python bench/bench_worker_engine.py --workers 1000 --seconds 20
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+import bench
+
+
+class IdleScheduler(object):
+    ready = False
+
+
+# Size of this process in MB, from /proc.
+def memory():
+    sizes = {}
+    with open('/proc/self/status') as f:
+        for line in f:
+            name, _, value = line.partition(':')
+            if name in ('VmRSS', 'VmSize', 'Threads'):
+                sizes[name] = int(value.split()[0])
+    return (sizes['VmRSS'] / 1024.0, sizes['VmSize'] / 1024.0,
+            sizes['Threads'])
+
+
+def cpu_seconds():
+    times = os.times()
+    return times[0] + times[1]
+
+
+# Start the workers of one engine and measure them, in this process.
+def measure(options):
+    bench.setup(['-w', str(options.workers), '-we', options.engine])
+    bench.init_db()
+    from threading import Event, Thread
+    from queue import Queue
+    from pogom.search import search_worker
+    from pogom.utils import get_args
+    from pogom.workerloop import WorkerLoop, run_in_thread
+
+    args = get_args()
+    rss, vms, threads = memory()
+    worker_loop = None
+    if options.engine == 'loop':
+        worker_loop = WorkerLoop(args.worker_engine_threads)
+        worker_loop.start()
+    # Shared by the workers, as in search_overseer_thread.
+    account_queue, search_items_queue = Queue(), Queue()
+    db_queue, wh_queue = Queue(), Queue()
+    pause_bit = Event()
+    scheduler = IdleScheduler()
+    for i in range(options.workers):
+        worker = search_worker(args, account_queue, None, [], None,
+                               search_items_queue, pause_bit, {}, db_queue,
+                               wh_queue, scheduler, None)
+        if worker_loop:
+            worker_loop.add(worker)
+        else:
+            t = Thread(target=run_in_thread, args=(worker,))
+            t.daemon = True
+            t.start()
+
+    # Let every worker reach its first sleep.
+    time.sleep(2)
+    cpu = cpu_seconds()
+    time.sleep(options.seconds)
+    cpu = cpu_seconds() - cpu
+    after_rss, after_vms, after_threads = memory()
+    per = 1000.0 / options.workers
+    print(json.dumps([options.engine, after_threads - threads,
+                      (after_rss - rss) * per, (after_vms - vms) * per,
+                      cpu * 100 / options.seconds * per]))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--engines', default='threads,loop')
+    parser.add_argument('--engine', help=argparse.SUPPRESS)
+    parser.add_argument('--workers', type=int, default=1000)
+    parser.add_argument('--seconds', type=float, default=20)
+    options = parser.parse_args()
+
+    if options.engine:
+        measure(options)
+        return
+
+    results = []
+    for engine in options.engines.split(','):
+        output = subprocess.check_output(
+            [sys.executable, os.path.abspath(__file__), '--engine', engine,
+             '--workers', str(options.workers),
+             '--seconds', str(options.seconds)])
+        results.append(json.loads(output.strip().splitlines()[-1]))
+
+    bench.report('{} idle search workers for {}s, per 1000 workers'
+                 .format(options.workers, options.seconds), results,
+                 ('engine', 'threads', 'RSS (MB)', 'virtual (MB)',
+                  'CPU (%)'))
+
+
+if __name__ == '__main__':
+    main()
@@ -16,6 +16,9 @@ from .proxy import get_new_proxy
 
 log = logging.getLogger(__name__)
 
+# Seconds an account waits after logging in, before its first request.
+LOGIN_WAIT = 20
+
 
 class TooManyLoginAttempts(Exception):
     pass
@@ -54,7 +57,9 @@ def setup_api(args, status):
 
 
 # Use API to check the login status, and retry the login if possible.
-def check_login(args, account, api, position, proxy_url):
+# Returns True after a new login, which is followed by LOGIN_WAIT seconds of
+# waiting, unless the caller does the waiting (wait=False).
+def check_login(args, account, api, position, proxy_url, wait=True):
 
     # Logged in? Enough time left? Cool!
     if api._auth_provider and api._auth_provider._ticket_expire:
@@ -98,7 +103,9 @@ def check_login(args, account, api, position, proxy_url):
         raise TooManyLoginAttempts('Exceeded login attempts.')
 
     log.debug('Login for account %s successful.', account['username'])
-    time.sleep(20)
+    if wait:
+        time.sleep(LOGIN_WAIT)
+    return True
 
 
 # Check if all important tutorial steps have been completed.
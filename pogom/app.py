@@ -1,14 +1,14 @@
 #!/usr/bin/python
 # -*- coding: utf-8 -*-
 
-import calendar
 import logging
 
 from flask import Flask, abort, jsonify, render_template, request,\
-    make_response
+    make_response, Response, stream_with_context
 from flask.json import JSONEncoder
 from flask_compress import Compress
 from datetime import datetime
+from itertools import chain
 from s2sphere import LatLng
 from pogom.utils import get_args
 from datetime import timedelta
@@ -17,8 +17,11 @@ from bisect import bisect_left
 
 from . import config
 from .models import (Pokemon, Gym, Pokestop, ScannedLocation,
-                     MainWorker, WorkerStatus, Token, HashKeys)
+                     MainWorker, WorkerStatus, Token, HashKeys, change_log)
 from .utils import now, dottedQuadToNum, get_blacklist
+from .changelog import any_in_viewport
+from .jsonstream import (ObjectStream, iter_json, collect, gzip_stream,
+                         epoch_millis)
 log = logging.getLogger(__name__)
 compress = Compress()
 
@@ -203,6 +206,12 @@ class Pogom(Flask):
         else:
             timestamp = 0
 
+        # Rows changed since the previous request, if the change log can
+        # tell. Otherwise fall back to querying by timestamp.
+        changes = None
+        if args.delta_sync and not args.only_server:
+            d['seq'], changes = change_log.since(request.args.get('seq'))
+
         swLat = request.args.get('swLat')
         swLng = request.args.get('swLng')
         neLat = request.args.get('neLat')
@@ -266,68 +275,90 @@ class Pogom(Flask):
             elif lastpokemon != 'true':
                 # If this is first request since switch on, load
                 # all pokemon on screen.
-                d['pokemons'] = Pokemon.get_active(swLat, swLng, neLat, neLng)
+                d['pokemons'] = Pokemon.iter_active(swLat, swLng, neLat,
+                                                    neLng)
             else:
                 # If map is already populated only request modified Pokemon
                 # since last request time.
-                d['pokemons'] = Pokemon.get_active(swLat, swLng, neLat, neLng,
-                                                   timestamp=timestamp)
+                if changes is not None:
+                    d['pokemons'] = Pokemon.get_changed(changes, swLat, swLng,
+                                                        neLat, neLng)
+                else:
+                    d['pokemons'] = Pokemon.iter_active(
+                        swLat, swLng, neLat, neLng, timestamp=timestamp)
                 if newArea:
                     # If screen is moved add newly uncovered Pokemon to the
                     # ones that were modified since last request time.
-                    d['pokemons'] = d['pokemons'] + (
-                        Pokemon.get_active(swLat, swLng, neLat, neLng,
-                                           oSwLat=oSwLat, oSwLng=oSwLng,
-                                           oNeLat=oNeLat, oNeLng=oNeLng))
+                    d['pokemons'] = chain(d['pokemons'], (
+                        Pokemon.iter_active(swLat, swLng, neLat, neLng,
+                                            oSwLat=oSwLat, oSwLng=oSwLng,
+                                            oNeLat=oNeLat, oNeLng=oNeLng)))
 
             if request.args.get('eids'):
                 # Exclude id's of pokemon that are hidden.
                 eids = [int(x) for x in request.args.get('eids').split(',')]
-                d['pokemons'] = [
-                    x for x in d['pokemons'] if x['pokemon_id'] not in eids]
+                d['pokemons'] = (
+                    x for x in d['pokemons'] if x['pokemon_id'] not in eids)
 
             if request.args.get('reids'):
                 reids = [int(x) for x in request.args.get('reids').split(',')]
-                d['pokemons'] = d['pokemons'] + (
+                d['pokemons'] = chain(d['pokemons'], (
                     Pokemon.get_active_by_id(reids, swLat, swLng,
-                                             neLat, neLng))
+                                             neLat, neLng)))
                 d['reids'] = reids
 
         if (request.args.get('pokestops', 'true') == 'true' and
                 not args.no_pokestops):
             if lastpokestops != 'true':
-                d['pokestops'] = Pokestop.get_stops(swLat, swLng, neLat, neLng,
-                                                    lured=luredonly)
+                d['pokestops'] = Pokestop.iter_stops(swLat, swLng, neLat,
+                                                     neLng, lured=luredonly)
             else:
-                d['pokestops'] = Pokestop.get_stops(swLat, swLng, neLat, neLng,
-                                                    timestamp=timestamp)
+                if changes is not None:
+                    d['pokestops'] = Pokestop.get_changed(
+                        changes, swLat, swLng, neLat, neLng)
+                else:
+                    d['pokestops'] = Pokestop.iter_stops(
+                        swLat, swLng, neLat, neLng, timestamp=timestamp)
                 if newArea:
-                    d['pokestops'] = d['pokestops'] + (
-                        Pokestop.get_stops(swLat, swLng, neLat, neLng,
-                                           oSwLat=oSwLat, oSwLng=oSwLng,
-                                           oNeLat=oNeLat, oNeLng=oNeLng,
-                                           lured=luredonly))
+                    d['pokestops'] = chain(d['pokestops'], (
+                        Pokestop.iter_stops(swLat, swLng, neLat, neLng,
+                                            oSwLat=oSwLat, oSwLng=oSwLng,
+                                            oNeLat=oNeLat, oNeLng=oNeLng,
+                                            lured=luredonly)))
 
         if request.args.get('gyms', 'true') == 'true' and not args.no_gyms:
             if lastgyms != 'true':
-                d['gyms'] = Gym.get_gyms(swLat, swLng, neLat, neLng)
+                gyms = Gym.iter_gyms(swLat, swLng, neLat, neLng)
             else:
-                d['gyms'] = Gym.get_gyms(swLat, swLng, neLat, neLng,
+                # Gyms are joined with their members, so only query them
+                # when the change log has any in view.
+                if changes is not None and not any_in_viewport(
+                        changes.get(Gym, {}).itervalues(), swLat, swLng,
+                        neLat, neLng):
+                    gyms = []
+                else:
+                    gyms = Gym.iter_gyms(swLat, swLng, neLat, neLng,
                                          timestamp=timestamp)
                 if newArea:
-                    d['gyms'].update(
-                        Gym.get_gyms(swLat, swLng, neLat, neLng,
-                                     oSwLat=oSwLat, oSwLng=oSwLng,
-                                     oNeLat=oNeLat, oNeLng=oNeLng))
+                    # A Gym in both is written twice, the last one wins
+                    # when parsed like it would with dict.update().
+                    gyms = chain(gyms, (
+                        Gym.iter_gyms(swLat, swLng, neLat, neLng,
+                                      oSwLat=oSwLat, oSwLng=oSwLng,
+                                      oNeLat=oNeLat, oNeLng=oNeLng)))
+            d['gyms'] = ObjectStream(gyms)
 
         if request.args.get('scanned', 'true') == 'true':
             if lastslocs != 'true':
                 d['scanned'] = ScannedLocation.get_recent(swLat, swLng,
                                                           neLat, neLng)
             else:
-                d['scanned'] = ScannedLocation.get_recent(swLat, swLng,
-                                                          neLat, neLng,
-                                                          timestamp=timestamp)
+                if changes is not None:
+                    d['scanned'] = ScannedLocation.get_changed(
+                        changes, swLat, swLng, neLat, neLng)
+                else:
+                    d['scanned'] = ScannedLocation.get_recent(
+                        swLat, swLng, neLat, neLng, timestamp=timestamp)
                 if newArea:
                     d['scanned'] = d['scanned'] + ScannedLocation.get_recent(
                         swLat, swLng, neLat, neLng, oSwLat=oSwLat,
@@ -358,18 +389,25 @@ class Pogom(Flask):
 
         if request.args.get('spawnpoints', 'false') == 'true':
             if lastspawns != 'true':
-                d['spawnpoints'] = Pokemon.get_spawnpoints(
+                d['spawnpoints'] = Pokemon.iter_spawnpoints(
                     swLat=swLat, swLng=swLng, neLat=neLat, neLng=neLng)
             else:
-                d['spawnpoints'] = Pokemon.get_spawnpoints(
-                    swLat=swLat, swLng=swLng, neLat=neLat, neLng=neLng,
-                    timestamp=timestamp)
+                # Spawnpoints are built from Pokemon, so only query them
+                # when the change log has any Pokemon in view.
+                if changes is not None and not any_in_viewport(
+                        changes.get(Pokemon, {}).itervalues(), swLat, swLng,
+                        neLat, neLng):
+                    d['spawnpoints'] = []
+                else:
+                    d['spawnpoints'] = Pokemon.iter_spawnpoints(
+                        swLat=swLat, swLng=swLng, neLat=neLat, neLng=neLng,
+                        timestamp=timestamp)
                 if newArea:
-                    d['spawnpoints'] = d['spawnpoints'] + (
-                        Pokemon.get_spawnpoints(
+                    d['spawnpoints'] = chain(d['spawnpoints'], (
+                        Pokemon.iter_spawnpoints(
                             swLat, swLng, neLat, neLng,
                             oSwLat=oSwLat, oSwLng=oSwLng,
-                            oNeLat=oNeLat, oNeLng=oNeLng))
+                            oNeLat=oNeLat, oNeLng=oNeLng)))
 
         if request.args.get('status', 'false') == 'true':
             args = get_args()
@@ -380,7 +418,25 @@ class Pogom(Flask):
                   args.status_page_password):
                 d['main_workers'] = MainWorker.get_all()
                 d['workers'] = WorkerStatus.get_all()
-        return jsonify(d)
+
+        if args.stream_json:
+            return self.stream_json(d)
+        return jsonify(collect(d))
+
+    # Send a large response as chunked JSON. It's gzipped here as it's
+    # written, flask_compress would buffer the whole response first. The
+    # rows are read from the database as they're written, so the request
+    # context (and its connection) stays until the last chunk.
+    def stream_json(self, d):
+        encoder = self.json_encoder(separators=(',', ':'))
+        chunks = stream_with_context(iter_json(d, encoder))
+        headers = {}
+        if 'gzip' in request.headers.get('Accept-Encoding', '').lower():
+            chunks = gzip_stream(chunks, self.config['COMPRESS_LEVEL'])
+            headers['Content-Encoding'] = 'gzip'
+            headers['Vary'] = 'Accept-Encoding'
+
+        return Response(chunks, mimetype='application/json', headers=headers)
 
     def loc(self):
         d = {}
@@ -595,13 +651,7 @@ class CustomJSONEncoder(JSONEncoder):
     def default(self, obj):
         try:
             if isinstance(obj, datetime):
-                if obj.utcoffset() is not None:
-                    obj = obj - obj.utcoffset()
-                millis = int(
-                    calendar.timegm(obj.timetuple()) * 1000 +
-                    obj.microsecond / 1000
-                )
-                return millis
+                return epoch_millis(obj)
             iterable = iter(obj)
         except TypeError:
             pass
@@ -55,7 +55,8 @@ def captcha_overseer_thread(args, account_queue, account_captchas,
                 t = Thread(target=captcha_solver_thread,
                            name='captcha-solver-{}'.format(solverId),
                            args=(args, account_queue, account_captchas,
-                                 hash_key, wh_queue, tokens[i]))
+                                 key_scheduler, hash_key, wh_queue,
+                                 tokens[i]))
                 t.daemon = True
                 t.start()
 
@@ -89,7 +90,7 @@ def captcha_overseer_thread(args, account_queue, account_captchas,
                         t = Thread(target=captcha_solver_thread,
                                    name='captcha-solver-{}'.format(solverId),
                                    args=(args, account_queue, account_captchas,
-                                         hash_key, wh_queue))
+                                         key_scheduler, hash_key, wh_queue))
                         t.daemon = True
                         t.start()
 
@@ -104,8 +105,19 @@ def captcha_overseer_thread(args, account_queue, account_captchas,
         time.sleep(sleep_timer)
 
 
-def captcha_solver_thread(args, account_queue, account_captchas, hash_key,
-                          wh_queue, token=None):
+# Solve a captcha, then give back the hash key it was handed.
+def captcha_solver_thread(args, account_queue, account_captchas,
+                          key_scheduler, hash_key, wh_queue, token=None):
+    try:
+        solve_captcha(args, account_queue, account_captchas, hash_key,
+                      wh_queue, token)
+    finally:
+        if hash_key:
+            key_scheduler.done(hash_key)
+
+
+def solve_captcha(args, account_queue, account_captchas, hash_key, wh_queue,
+                  token=None):
     status, account, captcha_url = account_captchas.popleft()
 
     status['message'] = 'Waking up account {} to verify captcha token.'.format(
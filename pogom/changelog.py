@@ -0,0 +1,85 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import logging
+import uuid
+from threading import Lock
+
+from .spatial import in_box, parse_box
+
+log = logging.getLogger(__name__)
+
+
+# Return copies of the changed rows inside a map viewport.
+def rows_in_viewport(rows, swLat, swLng, neLat, neLng):
+    box = parse_box(swLat, swLng, neLat, neLng)
+    return [dict(row) for row in rows
+            if box is None or in_box(row['latitude'], row['longitude'], box)]
+
+
+# Check if any of the changed rows is inside a map viewport.
+def any_in_viewport(rows, swLat, swLng, neLat, neLng):
+    box = parse_box(swLat, swLng, neLat, neLng)
+    return any(box is None or in_box(row['latitude'], row['longitude'], box)
+               for row in rows)
+
+
+# Versioned log of the rows written by the db_updater, kept in a fixed size
+# ring buffer. Map clients send back the sequence number of their last poll
+# and only get the rows that changed since, instead of re-querying the
+# database on every poll.
+class ChangeLog(object):
+
+    def __init__(self, size):
+        self.size = size
+        self.lock = Lock()
+        # Sequence numbers restart with the process, so they're prefixed with
+        # a random id to tell a client when its number is from another run.
+        self.log_id = uuid.uuid4().hex[:8]
+        self.seq = 0
+        self.ring = [None] * size
+
+    # Record upserted rows. Takes the same (model, {key: row}) pair that
+    # goes through the db_update_queue.
+    def append(self, model, rows):
+        with self.lock:
+            for key, row in rows.iteritems():
+                self.seq += 1
+                self.ring[self.seq % self.size] = (model, key, dict(row))
+
+    # Current sequence number, in the format sent to clients.
+    def current(self):
+        with self.lock:
+            return self._format(self.seq)
+
+    # Return the current sequence number and the rows changed since the
+    # given one, as {model: {key: row}}. The changes are None if the client
+    # has to fall back to a full query, i.e. if the sequence number is
+    # missing, from an earlier run, or too old for the ring buffer.
+    def since(self, client_seq):
+        seq = self._parse(client_seq)
+
+        with self.lock:
+            current = self._format(self.seq)
+            if seq is None or seq > self.seq or self.seq - seq > self.size:
+                return current, None
+
+            changes = {}
+            for i in xrange(seq + 1, self.seq + 1):
+                model, key, row = self.ring[i % self.size]
+                # Later entries for the same key replace earlier ones.
+                changes.setdefault(model, {})[key] = row
+
+        return current, changes
+
+    def _format(self, seq):
+        return '{}-{}'.format(self.log_id, seq)
+
+    def _parse(self, client_seq):
+        try:
+            log_id, seq = client_seq.split('-')
+            if log_id == self.log_id:
+                return int(seq)
+        except (AttributeError, ValueError):
+            pass
+        return None
@@ -0,0 +1,177 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import logging
+from collections import OrderedDict
+from queue import Empty
+from threading import Lock
+from timeit import default_timer
+
+from peewee import CompositeKey
+
+log = logging.getLogger(__name__)
+
+# Seconds between two logs of the db updater's metrics.
+STATS_INTERVAL = 60
+
+
+# Updates taken off the db_update_queue, merged by model and primary key.
+# Only the last row written for a key is kept, and models are flushed in
+# the order they were first seen, so rows referencing each other are still
+# written in the order they were queued.
+#
+# Rows are merged on the primary key they hold, not on the key they were
+# queued with, which is often just a counter or 0 for a single row. Rows of
+# models without a primary key, like GymMember, are all kept.
+class UpdateBatch(object):
+
+    def __init__(self):
+        # model -> {key: row}.
+        self.models = OrderedDict()
+        # Number of updates merged in.
+        self.updates = 0
+
+    def __len__(self):
+        return sum(len(rows) for rows in self.models.itervalues())
+
+    def add(self, model, data):
+        rows = self.models.setdefault(model, {})
+        names = self._key_names(model)
+        for key, row in data.iteritems():
+            if names is not None and all(name in row for name in names):
+                key = tuple(row[name] for name in names)
+            else:
+                key = (self.updates, key)
+            rows[key] = row
+        self.updates += 1
+
+    # Names of the primary key fields of a model, or None if it has none.
+    def _key_names(self, model):
+        meta = getattr(model, '_meta', None)
+        if meta is None or not meta.primary_key:
+            return None
+        if isinstance(meta.primary_key, CompositeKey):
+            return meta.primary_key.field_names
+        return (meta.primary_key.name,)
+
+    # Yield (model, {key: row}) for each model, split by the set of columns
+    # of the rows, since a multi-row insert takes its columns from the first
+    # row.
+    def items(self):
+        for model, data in self.models.iteritems():
+            shapes = OrderedDict()
+            for key, row in data.iteritems():
+                shapes.setdefault(frozenset(row), {})[key] = row
+            for rows in shapes.itervalues():
+                yield model, rows
+
+
+# Take updates off the queue and merge them into a batch. Blocks until there
+# is at least one, then keeps taking them for up to `window` seconds, or
+# until the batch holds `max_rows` rows.
+def drain(q, window, max_rows):
+    batch = UpdateBatch()
+    model, data = q.get()
+    batch.add(model, data)
+    deadline = default_timer() + window
+    rows = len(data)
+    while rows < max_rows:
+        remaining = deadline - default_timer()
+        if remaining <= 0:
+            break
+        try:
+            model, data = q.get(timeout=remaining)
+        except Empty:
+            break
+        batch.add(model, data)
+        rows += len(data)
+    return batch
+
+
+# Number of rows per insert statement for each model, adjusted to the time
+# statements take: halved when they get slower than `target` seconds, and
+# grown while they're much faster than that and full.
+class AdaptiveStep(object):
+
+    def __init__(self, initial, minimum, maximum, target=0.5):
+        self.initial = initial
+        self.minimum = minimum
+        self.maximum = maximum
+        self.target = target
+        self.lock = Lock()
+        # model -> rows per statement.
+        self.steps = {}
+
+    def get(self, model):
+        with self.lock:
+            return self.steps.get(model, self.initial)
+
+    # Record that `rows` rows of `model` were written in `seconds`.
+    def update(self, model, rows, seconds):
+        with self.lock:
+            step = self.steps.get(model, self.initial)
+            statements = max((rows + step - 1) // step, 1)
+            per_statement = seconds / statements
+            if per_statement > self.target:
+                step = max(step // 2, self.minimum)
+            elif per_statement < self.target / 4 and rows >= step:
+                step = min(step * 2, self.maximum)
+            self.steps[model] = step
+            return step
+
+
+# Metrics of the db updater threads: queue depth, rows per flush and rows
+# per second, logged every STATS_INTERVAL seconds. Warns when the queue keeps
+# growing between two logs.
+class UpdaterStats(object):
+
+    def __init__(self, interval=STATS_INTERVAL):
+        self.interval = interval
+        self.lock = Lock()
+        self.last_log = default_timer()
+        self.last_depth = 0
+        self._reset()
+
+    def _reset(self):
+        self.flushes = 0
+        self.updates = 0
+        self.rows = 0
+        self.seconds = 0.0
+
+    # Record a flush of `batch`, taking `seconds`, with `depth` updates left
+    # in the queue. Returns the metrics when it's time to log them.
+    def record(self, batch, seconds, depth):
+        with self.lock:
+            self.flushes += 1
+            self.updates += batch.updates
+            self.rows += len(batch)
+            self.seconds += seconds
+
+            now = default_timer()
+            elapsed = now - self.last_log
+            if elapsed < self.interval:
+                return None
+
+            metrics = {
+                'depth': depth,
+                'growing': depth > self.last_depth and depth > 0,
+                'flushes': self.flushes,
+                'updates': self.updates,
+                'rows': self.rows,
+                'rows_per_flush': self.rows / float(self.flushes),
+                'rows_per_sec': self.rows / elapsed,
+                'busy': self.seconds / elapsed
+            }
+            self.last_log = now
+            self.last_depth = depth
+            self._reset()
+
+        if metrics['growing']:
+            log.warning('DB queue is growing (%d updates waiting); try ' +
+                        'increasing --db-threads.', depth)
+        log.info('DB updater: %d updates merged into %d rows in %d ' +
+                 'flushes, %.1f rows per flush, %.1f rows/s, %.0f%% busy, ' +
+                 '%d updates queued.', metrics['updates'], metrics['rows'],
+                 metrics['flushes'], metrics['rows_per_flush'],
+                 metrics['rows_per_sec'], metrics['busy'] * 100, depth)
+        return metrics
@@ -0,0 +1,220 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import logging
+import math
+import random
+from base64 import b64encode
+from collections import OrderedDict
+from datetime import datetime
+
+from .spatial import SpatialIndex, within_distance
+from .utils import equi_rect_distance
+
+log = logging.getLogger(__name__)
+
+# Spawnpoint shapes, as the four 15 minute quarters of an hour after the
+# spawn starts: 'h' while hidden, otherwise the number of the encounter
+# that's visible. A new encounter starts at the beginning of every hour.
+SHAPES = OrderedDict([
+    ('1x15', 'hhh1'),
+    ('1x30', 'hh11'),
+    ('1x45', 'h111'),
+    ('1x60', '1111'),
+    ('1x60h2', '1h11'),
+    ('1x60h3', '11h1'),
+    ('1x60h23', '1hh1'),
+    ('2x15', 'h1h2'),
+])
+
+# Meters around a scan location wild and nearby Pokemon, and forts, are
+# returned for.
+WILD_RADIUS = 70
+NEARBY_RADIUS = 200
+FORT_RADIUS = 450
+
+# TTH is only sent in the last 90 seconds before a Pokemon hides.
+TTH_SECONDS = 90
+
+
+# The SpawnPoint kind of a shape, 's' for the quarters a Pokemon is seen.
+def shape_kind(pattern):
+    return ''.join('h' if q == 'h' else 's' for q in pattern)
+
+
+# The SpawnPoint links of a shape: 'h' for hidden quarters, '+' when the
+# next visible quarter shows the same encounter, '-' when it's a new one.
+def shape_links(pattern):
+    links = ''
+    for i, q in enumerate(pattern):
+        if q == 'h':
+            links += 'h'
+            continue
+        for j in range(i + 1, i + 5):
+            if pattern[j % 4] != 'h':
+                links += '+' if j < 4 and pattern[j] == q else '-'
+                break
+    return links
+
+
+# A seeded map of spawnpoints of every shape, pokestops and gyms in a
+# circle around a location, answering GET_MAP_OBJECTS like the game does
+# for a given time, so scheduling and parsing can run without accounts,
+# deterministically. Times are unix timestamps in seconds.
+class FakeMap(object):
+
+    def __init__(self, center, radius, count, seed=1, shapes=None,
+                 pokestops=0, gyms=0):
+        self.center = center
+        self.radius = radius
+        self.rand = random.Random(seed)
+        shapes = shapes or SHAPES.keys()
+        self.spawnpoints = []
+        for n in range(count):
+            loc = self.random_location()
+            pattern = SHAPES[shapes[n % len(shapes)]]
+            self.spawnpoints.append({
+                'id': '{:011x}'.format(self.rand.getrandbits(44)),
+                'number': n,
+                'latitude': loc[0],
+                'longitude': loc[1],
+                'shape': shapes[n % len(shapes)],
+                'kind': shape_kind(pattern),
+                'links': shape_links(pattern),
+                'start': self.rand.randint(0, 3599)})
+        self.index = SpatialIndex(self.spawnpoints)
+
+        # Pokestops are lured for 30 minutes of every hour from `start`,
+        # gyms change teams every hour at `start`.
+        self.forts = []
+        for n in range(pokestops + gyms):
+            loc = self.random_location()
+            self.forts.append({
+                'id': '{:032x}.16'.format(self.rand.getrandbits(128)),
+                'number': n,
+                'latitude': loc[0],
+                'longitude': loc[1],
+                'type': 1 if n < pokestops else None,
+                'start': self.rand.randint(0, 3599)})
+        self.fort_index = SpatialIndex(self.forts)
+
+    # A random location within the radius.
+    def random_location(self):
+        lat_delta = self.radius / 111320.0
+        lng_delta = lat_delta / math.cos(math.radians(self.center[0]))
+        while True:
+            loc = (self.center[0] + self.rand.uniform(-lat_delta, lat_delta),
+                   self.center[1] + self.rand.uniform(-lng_delta, lng_delta))
+            if equi_rect_distance(self.center, loc) * 1000 <= self.radius:
+                return loc
+
+    # The encounter visible at a spawnpoint at a time, or None while it's
+    # hidden. Returns a dict of the encounter id, when it appeared, when it
+    # hides next and when it despawns.
+    def encounter(self, sp, now):
+        pattern = SHAPES[sp['shape']]
+        cycle = int(now - sp['start']) // 3600
+        cycle_start = sp['start'] + cycle * 3600
+        quarter = int(now - cycle_start) // 900
+        number = pattern[quarter]
+        if number == 'h':
+            return None
+        quarters = [i for i, q in enumerate(pattern) if q == number]
+        hides = quarter + 1
+        while hides < 4 and pattern[hides] == number:
+            hides += 1
+        return {'encounter_id': (sp['number'] * 1000000 + cycle) * 10 +
+                int(number),
+                'appears': cycle_start + quarters[0] * 900,
+                'hides': cycle_start + hides * 900,
+                'despawns': cycle_start + (quarters[-1] + 1) * 900}
+
+    # The encounters of every spawnpoint that appear between two times, as
+    # (spawnpoint, encounter) pairs.
+    def appearances(self, start, end):
+        for sp in self.spawnpoints:
+            pattern = SHAPES[sp['shape']]
+            first = int(start - sp['start']) // 3600
+            for cycle in range(first, int(end - sp['start']) // 3600 + 1):
+                cycle_start = sp['start'] + cycle * 3600
+                for i, q in enumerate(pattern):
+                    if q == 'h' or q in pattern[:i]:
+                        continue
+                    appears = cycle_start + i * 900
+                    if start <= appears < end:
+                        yield sp, self.encounter(sp, appears)
+
+    # Pokemon rows for `hours` of past sightings before a time, one per
+    # encounter, as if the hive had been scanned before.
+    def history(self, now, hours):
+        rows = []
+        for sp, e in self.appearances(now - hours * 3600, now):
+            rows.append({'encounter_id': b64encode(str(e['encounter_id'])),
+                         'spawnpoint_id': sp['id'],
+                         'pokemon_id': e['encounter_id'] % 251 + 1,
+                         'latitude': sp['latitude'],
+                         'longitude': sp['longitude'],
+                         'disappear_time': datetime.utcfromtimestamp(
+                             e['despawns'])})
+        return rows
+
+    # The GET_MAP_OBJECTS response for a scan at a location and time, in
+    # the dict format of the API. Also returns the encounters that were
+    # wild, by encounter id.
+    def map_objects(self, loc, now):
+        now_ms = int(now * 1000)
+        wild = []
+        nearby = []
+        seen = {}
+        for sp in self.index.near(loc, NEARBY_RADIUS):
+            e = self.encounter(sp, now)
+            if e is None:
+                continue
+            pokemon_id = e['encounter_id'] % 251 + 1
+            if not within_distance(loc, (sp['latitude'], sp['longitude']),
+                                   WILD_RADIUS):
+                nearby.append({'encounter_id': e['encounter_id'],
+                               'pokemon_id': pokemon_id,
+                               'distance_in_meters': 0.0})
+                continue
+            tth = int((e['hides'] - now) * 1000)
+            wild.append({
+                'encounter_id': e['encounter_id'],
+                'spawn_point_id': sp['id'],
+                'latitude': sp['latitude'],
+                'longitude': sp['longitude'],
+                'last_modified_timestamp_ms': now_ms,
+                'time_till_hidden_ms': (
+                    tth if tth <= TTH_SECONDS * 1000 else 0),
+                'pokemon_data': {
+                    'pokemon_id': pokemon_id,
+                    'pokemon_display': {'gender': 1}}})
+            seen[e['encounter_id']] = (sp, e)
+
+        forts = [self.fort(f, now)
+                 for f in self.fort_index.near(loc, FORT_RADIUS)]
+
+        cell = {'s2_cell_id': 0, 'current_timestamp_ms': now_ms,
+                'wild_pokemons': wild, 'nearby_pokemons': nearby,
+                'forts': forts}
+        return {'responses': {'GET_MAP_OBJECTS': {
+            'status': 1, 'map_cells': [cell]}}}, seen
+
+    # The GET_MAP_OBJECTS fort of a pokestop or gym at a time.
+    def fort(self, f, now):
+        cycle = int(now - f['start']) // 3600
+        changed = f['start'] + cycle * 3600
+        fort = {'id': f['id'],
+                'latitude': f['latitude'],
+                'longitude': f['longitude'],
+                'enabled': True,
+                'last_modified_timestamp_ms': changed * 1000}
+        if f['type'] == 1:
+            fort['type'] = 1
+            if now - changed < 1800:
+                fort['active_fort_modifier'] = [501]
+        else:
+            fort.update({'owned_by_team': (f['number'] + cycle) % 4,
+                         'guard_pokemon_id': (f['number'] + cycle) % 251 + 1,
+                         'gym_points': (cycle % 10) * 1000})
+        return fort
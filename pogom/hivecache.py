@@ -0,0 +1,173 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import logging
+from datetime import datetime
+from threading import Lock
+
+from .models import ScannedLocation, SpawnPoint, ScanSpawnPoint
+from .utils import cellid
+
+log = logging.getLogger(__name__)
+
+
+# In-memory copy of the ScannedLocation, SpawnPoint and ScanSpawnPoint rows
+# of a SpeedScan hive. Loaded once when the hive's location changes, it
+# replaces the per-scan reads in parse_map. Writes are kept here and flushed
+# to the db_update_queue in batches, every `flush_interval` seconds at most,
+# so a crash loses at most that much scanning progress.
+#
+# It's passed to parse_map in place of the db_update_queue for these tables
+# and implements put() for that reason. Rows are copied in and out, so
+# workers can't change each other's rows while parsing.
+class HiveCache(object):
+
+    def __init__(self, flush_interval):
+        self.flush_interval = flush_interval
+        self.lock = Lock()
+        # cellid -> ScannedLocation row.
+        self.scanned_locations = {}
+        # spawnpoint id -> SpawnPoint row.
+        self.spawn_points = {}
+        # cellid -> set of linked spawnpoint ids.
+        self.links = {}
+        self.dirty = {ScannedLocation: {}, SpawnPoint: {}, ScanSpawnPoint: {}}
+        self.last_flush = datetime.utcnow()
+
+    # Replace the contents by the rows of a hive. `scanned_locations` is a
+    # dict of cellid to ScannedLocation rows, `spawn_points` a list of
+    # SpawnPoint rows and `links` a dict of ScanSpawnPoint rows.
+    def load(self, scanned_locations, spawn_points, links):
+        cellids = scanned_locations.keys()
+        linked = []
+        if cellids:
+            # Spawnpoints already linked to the hive's cells.
+            linked = list(SpawnPoint
+                          .select(SpawnPoint, ScanSpawnPoint.scannedlocation)
+                          .join(ScanSpawnPoint)
+                          .where(ScanSpawnPoint.scannedlocation << cellids)
+                          .dicts())
+
+        with self.lock:
+            self.scanned_locations = {}
+            self.spawn_points = {}
+            self.links = {}
+            for cell, scan in scanned_locations.iteritems():
+                self.scanned_locations[cell] = dict(scan)
+            for sp in spawn_points:
+                self.spawn_points[sp['id']] = dict(sp)
+            for sp in linked:
+                cell = sp.pop('scannedlocation')
+                self.spawn_points.setdefault(sp['id'], sp)
+                self.links.setdefault(cell, set()).add(sp['id'])
+            for link in links.itervalues():
+                self.links.setdefault(link['scannedlocation'], set()).add(
+                    link['spawnpoint'])
+
+        log.info('Hive cache loaded with %d scanned locations and %d spawn '
+                 'points.', len(self.scanned_locations),
+                 len(self.spawn_points))
+
+    # Return a copy of the ScannedLocation row of a location, loading it from
+    # the database if it's not part of the hive.
+    def get_scanned_location(self, loc):
+        with self.lock:
+            scan = self.scanned_locations.get(cellid(loc))
+            if scan is not None:
+                return dict(scan)
+
+        return ScannedLocation.get_by_loc(loc)
+
+    # Return copies of the ScannedLocation rows, in the format of
+    # ScannedLocation.get_by_cellids.
+    def get_scanned_locations(self):
+        with self.lock:
+            return {'{}'.format(cell): dict(scan)
+                    for cell, scan in self.scanned_locations.iteritems()}
+
+    # Return copies of the SpawnPoint rows with the given ids, keyed by id.
+    # Spawnpoints outside of the hive are loaded from the database, unknown
+    # ones are left out like SpawnPoint.get_by_ids does.
+    def get_spawn_points(self, ids):
+        found = {}
+        with self.lock:
+            for id in ids:
+                if id in self.spawn_points:
+                    found[id] = dict(self.spawn_points[id])
+
+        missing = [id for id in ids if id not in found]
+        if missing:
+            for id, sp in SpawnPoint.get_by_ids(missing).iteritems():
+                found[id] = sp
+                with self.lock:
+                    self.spawn_points.setdefault(id, dict(sp))
+
+        return found
+
+    # Return copies of the spawnpoints linked to a cell, like
+    # ScannedLocation.linked_spawn_points.
+    def linked_spawn_points(self, cell):
+        with self.lock:
+            if cell not in self.scanned_locations:
+                in_hive = False
+            else:
+                in_hive = True
+                spawn_points = [dict(self.spawn_points[id])
+                                for id in self.links.get(cell, ())
+                                if id in self.spawn_points]
+
+        if not in_hive:
+            return ScannedLocation.linked_spawn_points(cell)
+        return spawn_points
+
+    # Update rows of the SpawnPoint dicts in `rows` in place with the cached
+    # versions, which may be newer than the database.
+    def freshen_spawn_points(self, rows):
+        with self.lock:
+            for sp in rows:
+                cached = self.spawn_points.get(sp['id'])
+                if cached is not None:
+                    sp.update(cached)
+
+    # Take (model, {key: row}) updates, like the db_update_queue.
+    def put(self, update):
+        model, rows = update
+        with self.lock:
+            dirty = self.dirty[model]
+            for row in rows.itervalues():
+                row = dict(row)
+                if model is ScannedLocation:
+                    self.scanned_locations[row['cellid']] = row
+                    dirty[row['cellid']] = row
+                elif model is SpawnPoint:
+                    self.spawn_points[row['id']] = row
+                    dirty[row['id']] = row
+                else:
+                    self.links.setdefault(row['scannedlocation'], set()).add(
+                        row['spawnpoint'])
+                    dirty[row['scannedlocation'] + row['spawnpoint']] = row
+
+    # Send the changed rows to the db_update_queue, one batch per table, if
+    # the flush interval has passed.
+    def flush(self, db_update_queue, force=False):
+        with self.lock:
+            now_date = datetime.utcnow()
+            if (not force and (now_date - self.last_flush).total_seconds() <
+                    self.flush_interval):
+                return 0
+
+            dirty = self.dirty
+            self.dirty = {ScannedLocation: {}, SpawnPoint: {},
+                          ScanSpawnPoint: {}}
+            self.last_flush = now_date
+
+        # Links reference the other two tables, send them last.
+        count = 0
+        for model in (ScannedLocation, SpawnPoint, ScanSpawnPoint):
+            if dirty[model]:
+                db_update_queue.put((model, dirty[model]))
+                count += len(dirty[model])
+
+        if count:
+            log.debug('Hive cache flushed %d rows.', count)
+        return count
@@ -0,0 +1,112 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import logging
+import zlib
+from collections import Iterator
+from datetime import datetime
+
+log = logging.getLogger(__name__)
+
+EPOCH = datetime(1970, 1, 1)
+
+# Number of list items encoded into a single chunk of the response.
+CHUNK_ITEMS = 500
+
+
+# Milliseconds since the epoch of a naive UTC datetime, without going
+# through timetuple() and calendar.timegm().
+def epoch_millis(dt):
+    if dt.tzinfo is not None:
+        dt = dt.replace(tzinfo=None) - dt.utcoffset()
+    delta = dt - EPOCH
+    return ((delta.days * 86400 + delta.seconds) * 1000 +
+            delta.microseconds // 1000)
+
+
+# Replace the datetimes of a row by their epoch millis, in place, so the
+# encoder doesn't have to fall back to default() for every one of them.
+def millis_row(row):
+    for key, value in row.iteritems():
+        if isinstance(value, datetime):
+            row[key] = epoch_millis(value)
+    return row
+
+
+# An iterable of (key, row) pairs written out as a JSON object, for dicts of
+# rows that are only read from the database while the response is written.
+class ObjectStream(object):
+
+    def __init__(self, pairs):
+        self.pairs = pairs
+
+    def iteritems(self):
+        return iter(self.pairs)
+
+
+# Encode a response dict as JSON, one chunk at a time. Lists and dicts of
+# rows (Pokemon, Pokestops, Gyms...) are written out CHUNK_ITEMS rows per
+# chunk, so the full response never has to exist as a single string.
+# Iterators are written as lists and ObjectStreams as dicts, so rows can
+# come straight from a query and never all be in memory at once.
+def iter_json(d, encoder, chunk_items=CHUNK_ITEMS):
+    yield '{'
+    first = True
+    for key, value in d.iteritems():
+        prefix = ('' if first else ',') + encoder.encode(key) + ':'
+        first = False
+
+        if isinstance(value, (list, Iterator)):
+            yield prefix + '['
+            items = (encoder.encode(_row(v)) for v in value)
+            close = ']'
+        elif isinstance(value, (dict, ObjectStream)):
+            yield prefix + '{'
+            items = (encoder.encode(k) + ':' + encoder.encode(_row(v))
+                     for k, v in value.iteritems())
+            close = '}'
+        else:
+            yield prefix + encoder.encode(value)
+            continue
+
+        chunk = []
+        separator = ''
+        for item in items:
+            chunk.append(item)
+            if len(chunk) >= chunk_items:
+                yield separator + ','.join(chunk)
+                separator = ','
+                chunk = []
+        if chunk:
+            yield separator + ','.join(chunk) + close
+        else:
+            yield close
+    yield '}'
+
+
+# Read the iterators and ObjectStreams of a response into lists and dicts,
+# for the responses that aren't streamed.
+def collect(d):
+    for key, value in d.iteritems():
+        if isinstance(value, Iterator):
+            d[key] = list(value)
+        elif isinstance(value, ObjectStream):
+            d[key] = dict(value.iteritems())
+    return d
+
+
+# Gzip a stream of chunks as it goes, for clients accepting gzip. The output
+# of a full response can be decompressed like any other gzip file.
+def gzip_stream(chunks, level=6):
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        if isinstance(chunk, unicode):
+            chunk = chunk.encode('utf-8')
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def _row(value):
+    return millis_row(value) if isinstance(value, dict) else value
@@ -8,12 +8,12 @@ import sys
 import traceback
 import gc
 import time
-import geopy
 import math
+from threading import local
 from peewee import (InsertQuery, Check, CompositeKey, ForeignKeyField,
                     SmallIntegerField, IntegerField, CharField, DoubleField,
                     BooleanField, DateTimeField, fn, DeleteQuery, FloatField,
-                    SQL, TextField, JOIN, OperationalError)
+                    TextField, JOIN, OperationalError)
 from playhouse.flask_utils import FlaskDB
 from playhouse.pool import PooledMySQLDatabase
 from playhouse.shortcuts import RetryOperationalError, case
@@ -26,12 +26,19 @@ from cachetools import cached
 from timeit import default_timer
 
 from . import config
-from .utils import (get_pokemon_name, get_pokemon_rarity, get_pokemon_types,
-                    get_args, cellid, in_radius, date_secs, clock_between,
-                    get_move_name, get_move_damage, get_move_energy,
-                    get_move_type, clear_dict_response, calc_pokemon_level)
+from .utils import (get_pokemon_name, get_pokemon_info, get_args, cellid,
+                    in_radius, date_secs, clock_between, get_move_info,
+                    clear_dict_response, calc_pokemon_level)
 from .transform import transform_from_wgs_to_gcj, get_new_coords
+from .spatial import (ActivePokemonIndex, LINK_CELL_DEGREES, bucket_points,
+                      points_near, within_distance)
+from .changelog import ChangeLog, rows_in_viewport
+from .dbqueue import AdaptiveStep, UpdaterStats, drain
+from .purge import ChunkedPurge
+from .rollups import Rollups, aggregate, merge, latest, hour_start, day_start
+from .upsert import MysqlUpsert, SqliteUpsert
 from .customLog import printPokemon
+from .webhook import webhook_item
 
 from .account import (tutorial_pokestop_spin, get_player_level, check_login,
                       setup_api, encounter_pokemon_request)
@@ -41,11 +48,55 @@ log = logging.getLogger(__name__)
 args = get_args()
 flaskDb = FlaskDB()
 cache = TTLCache(maxsize=100, ttl=60 * 5)
+active_pokemon = ActivePokemonIndex()
+change_log = ChangeLog(args.delta_sync_size)
+
+db_schema_version = 22
+
+
+# Count the queries run by each thread, so a worker can tell how many
+# database round trips a scan took.
+class RoundTripCounter(object):
+    counter = local()
+
+    def execute_sql(self, sql, params=None, require_commit=True):
+        RoundTripCounter.counter.count = RoundTripCounter.count() + 1
+        return super(RoundTripCounter, self).execute_sql(sql, params,
+                                                         require_commit)
+
+    # executemany() for the MySQL upserts, with execute_sql's bookkeeping:
+    # counted as a round trip, wrapped in peewee's exceptions and committed
+    # in autocommit mode.
+    def execute_many(self, sql, param_list, require_commit=True):
+        RoundTripCounter.counter.count = RoundTripCounter.count() + 1
+        with self.exception_wrapper():
+            cursor = self.get_cursor()
+            cursor.executemany(sql, param_list)
+            if require_commit and self.get_autocommit():
+                self.commit()
+        return cursor
 
-db_schema_version = 19
+    @staticmethod
+    def count():
+        return getattr(RoundTripCounter.counter, 'count', 0)
+
+
+class MyRetryDB(RoundTripCounter, RetryOperationalError, PooledMySQLDatabase):
+
+    # Reconnect and retry once, like RetryOperationalError does for
+    # execute_sql.
+    def execute_many(self, sql, param_list, require_commit=True):
+        try:
+            return super(MyRetryDB, self).execute_many(sql, param_list,
+                                                       require_commit)
+        except OperationalError:
+            if not self.is_closed():
+                self.close()
+            return super(MyRetryDB, self).execute_many(sql, param_list,
+                                                       require_commit)
 
 
-class MyRetryDB(RetryOperationalError, PooledMySQLDatabase):
+class MySqliteDB(RoundTripCounter, SqliteExtDatabase):
     pass
 
 
@@ -57,6 +108,14 @@ class Utf8mb4CharField(CharField):
 
 
 def init_database(app):
+    db = create_database()
+    app.config['DATABASE'] = db
+    flaskDb.init_app(app)
+
+    return db
+
+
+def create_database():
     if args.db_type == 'mysql':
         log.info('Connecting to MySQL database on %s:%i...',
                  args.db_host, args.db_port)
@@ -74,15 +133,12 @@ def init_database(app):
             charset='utf8mb4')
     else:
         log.info('Connecting to local SQLite database')
-        db = SqliteExtDatabase(args.db,
-                               pragmas=(
-                                   ('journal_mode', 'WAL'),
-                                   ('mmap_size', 1024 * 1024 * 32),
-                                   ('cache_size', 10000),
-                                   ('journal_size_limit', 1024 * 1024 * 4),))
-
-    app.config['DATABASE'] = db
-    flaskDb.init_app(app)
+        db = MySqliteDB(args.db,
+                        pragmas=(
+                            ('journal_mode', 'WAL'),
+                            ('mmap_size', 1024 * 1024 * 32),
+                            ('cache_size', 10000),
+                            ('journal_size_limit', 1024 * 1024 * 4),))
 
     return db
 
@@ -125,13 +181,42 @@ class Pokemon(BaseModel):
 
     class Meta:
         indexes = ((('latitude', 'longitude'), False),)
+        # Columns updated by bulk upserts on MySQL. An encounter's spawn
+        # point and location don't change.
+        upsert_columns = ('pokemon_id', 'disappear_time',
+                          'individual_attack', 'individual_defense',
+                          'individual_stamina', 'move_1', 'move_2', 'cp',
+                          'cp_multiplier', 'weight', 'height', 'gender',
+                          'form', 'last_modified')
 
     @staticmethod
     def get_active(swLat, swLng, neLat, neLng, timestamp=0, oSwLat=None,
                    oSwLng=None, oNeLat=None, oNeLng=None):
+        # Performance:  disable the garbage collector prior to creating a
+        # (potentially) large dict with append().
+        gc.disable()
+
+        pokemon = list(Pokemon.iter_active(swLat, swLng, neLat, neLng,
+                                           timestamp, oSwLat, oSwLng,
+                                           oNeLat, oNeLng))
+
+        # Re-enable the GC.
+        gc.enable()
+
+        return pokemon
+
+    # Active Pokemon in a viewport, one row at a time.
+    @staticmethod
+    def iter_active(swLat, swLng, neLat, neLng, timestamp=0, oSwLat=None,
+                    oSwLng=None, oNeLat=None, oNeLng=None):
         now_date = datetime.utcnow()
         query = Pokemon.select()
-        if not (swLat and swLng and neLat and neLng):
+        if args.pokemon_index:
+            # Serve from memory, the index applies the same filters.
+            query = active_pokemon.query(swLat, swLng, neLat, neLng,
+                                         timestamp, oSwLat, oSwLng, oNeLat,
+                                         oNeLng, now_date=now_date)
+        elif not (swLat and swLng and neLat and neLng):
             query = (query
                      .where(Pokemon.disappear_time > now_date)
                      .dicts())
@@ -173,29 +258,22 @@ class Pokemon(BaseModel):
                               (Pokemon.longitude <= neLng))))
                      .dicts())
 
-        # Performance:  disable the garbage collector prior to creating a
-        # (potentially) large dict with append().
-        gc.disable()
-
-        pokemon = []
-        for p in list(query):
+        if not args.pokemon_index:
+            # Read the rows without keeping them in the query's cache.
+            query = query.iterator()
 
-            p['pokemon_name'] = get_pokemon_name(p['pokemon_id'])
-            p['pokemon_rarity'] = get_pokemon_rarity(p['pokemon_id'])
-            p['pokemon_types'] = get_pokemon_types(p['pokemon_id'])
+        for p in query:
+            p.update(get_pokemon_info(p['pokemon_id']))
             if args.china:
                 p['latitude'], p['longitude'] = \
                     transform_from_wgs_to_gcj(p['latitude'], p['longitude'])
-            pokemon.append(p)
-
-        # Re-enable the GC.
-        gc.enable()
-
-        return pokemon
+            yield p
 
     @staticmethod
     def get_active_by_id(ids, swLat, swLng, neLat, neLng):
-        if not (swLat and swLng and neLat and neLng):
+        if args.pokemon_index:
+            query = active_pokemon.query(swLat, swLng, neLat, neLng, ids=ids)
+        elif not (swLat and swLng and neLat and neLng):
             query = (Pokemon
                      .select()
                      .where((Pokemon.pokemon_id << ids) &
@@ -218,9 +296,7 @@ class Pokemon(BaseModel):
 
         pokemon = []
         for p in query:
-            p['pokemon_name'] = get_pokemon_name(p['pokemon_id'])
-            p['pokemon_rarity'] = get_pokemon_rarity(p['pokemon_id'])
-            p['pokemon_types'] = get_pokemon_types(p['pokemon_id'])
+            p.update(get_pokemon_info(p['pokemon_id']))
             if args.china:
                 p['latitude'], p['longitude'] = \
                     transform_from_wgs_to_gcj(p['latitude'], p['longitude'])
@@ -231,51 +307,95 @@ class Pokemon(BaseModel):
 
         return pokemon
 
+    # Fill the in-memory index with the active Pokemon in the database, so
+    # a restart doesn't empty the map until the next scans come in.
+    @staticmethod
+    def load_active_index():
+        query = (Pokemon
+                 .select()
+                 .where(Pokemon.disappear_time > datetime.utcnow())
+                 .dicts())
+        active_pokemon.add(query)
+        return len(active_pokemon)
+
+    # Active Pokemon in a viewport from the rows in the change log.
+    @staticmethod
+    def get_changed(changes, swLat, swLng, neLat, neLng):
+        now_date = datetime.utcnow()
+        pokemon = []
+        for p in rows_in_viewport(changes.get(Pokemon, {}).itervalues(),
+                                  swLat, swLng, neLat, neLng):
+            if p['disappear_time'] <= now_date:
+                continue
+            p.update(get_pokemon_info(p['pokemon_id']))
+            if args.china:
+                p['latitude'], p['longitude'] = \
+                    transform_from_wgs_to_gcj(p['latitude'], p['longitude'])
+            pokemon.append(p)
+
+        return pokemon
+
     @classmethod
     @cached(cache)
     def get_seen(cls, timediff):
+        # Whole hours are counted from PokemonHourlyCount, the part of the
+        # first hour after the cutoff from the pokemon table.
+        query = (PokemonHourlyCount
+                 .select(PokemonHourlyCount.pokemon_id,
+                         fn.SUM(PokemonHourlyCount.count).alias('count'),
+                         fn.MAX(PokemonHourlyCount.disappear_time).alias(
+                             'disappear_time'))
+                 .group_by(PokemonHourlyCount.pokemon_id))
+        head = []
         if timediff:
-            timediff = datetime.utcnow() - timediff
-        pokemon_count_query = (Pokemon
-                               .select(Pokemon.pokemon_id,
-                                       fn.COUNT(Pokemon.pokemon_id).alias(
-                                           'count'),
-                                       fn.MAX(Pokemon.disappear_time).alias(
-                                           'lastappeared')
-                                       )
-                               .where(Pokemon.disappear_time > timediff)
-                               .group_by(Pokemon.pokemon_id)
-                               .alias('counttable')
-                               )
-        query = (Pokemon
-                 .select(Pokemon.pokemon_id,
-                         Pokemon.disappear_time,
-                         Pokemon.latitude,
-                         Pokemon.longitude,
-                         pokemon_count_query.c.count)
-                 .join(pokemon_count_query,
-                       on=(Pokemon.pokemon_id ==
-                           pokemon_count_query.c.pokemon_id))
-                 .distinct()
-                 .where(Pokemon.disappear_time ==
-                        pokemon_count_query.c.lastappeared)
-                 .dicts()
-                 )
-
-        # Performance:  disable the garbage collector prior to creating a
-        # (potentially) large dict with append().
-        gc.disable()
+            cutoff = datetime.utcnow() - timediff
+            boundary = hour_start(cutoff) + timedelta(hours=1)
+            query = query.where(PokemonHourlyCount.hour >= boundary)
+            head = (Pokemon
+                    .select(Pokemon.pokemon_id, Pokemon.disappear_time,
+                            Pokemon.latitude, Pokemon.longitude)
+                    .where((Pokemon.disappear_time > cutoff) &
+                           (Pokemon.disappear_time < boundary))
+                    .dicts())
+
+        seen = {}
+        for row in query.dicts():
+            row['count'] = int(row['count'])
+            row['latitude'] = row['longitude'] = None
+            seen[row['pokemon_id']] = row
+
+        # Location of the latest appearance of each species, from the hours
+        # they were last seen in.
+        hours = set(hour_start(row['disappear_time'])
+                    for row in seen.itervalues())
+        if hours:
+            latest_rows = (PokemonHourlyCount
+                           .select(PokemonHourlyCount.pokemon_id,
+                                   PokemonHourlyCount.disappear_time,
+                                   PokemonHourlyCount.latitude,
+                                   PokemonHourlyCount.longitude)
+                           .where(PokemonHourlyCount.hour << list(hours))
+                           .dicts())
+            for row in latest_rows:
+                p = seen.get(row['pokemon_id'])
+                if p and p['disappear_time'] == row['disappear_time']:
+                    p['latitude'] = row['latitude']
+                    p['longitude'] = row['longitude']
+
+        for row in head:
+            p = seen.get(row['pokemon_id'])
+            if p is None:
+                p = seen[row['pokemon_id']] = dict(row, count=0)
+            p['count'] += 1
+            latest(p, row)
 
         pokemon = []
         total = 0
-        for p in query:
+        for p in seen.itervalues():
             p['pokemon_name'] = get_pokemon_name(p['pokemon_id'])
             pokemon.append(p)
             total += p['count']
 
-        # Re-enable the GC.
-        gc.enable()
-
         return {'pokemon': pokemon, 'total': total}
 
     @classmethod
@@ -285,22 +405,48 @@ class Pokemon(BaseModel):
         :param timediff: limiting period of the selection
         :return: list of Pokemon appearances over a selected period
         '''
+        # Whole days are counted from SpawnPointDailyCount, the part of the
+        # first day after the cutoff from the pokemon table.
+        query = (SpawnPointDailyCount
+                 .select(SpawnPointDailyCount.latitude,
+                         SpawnPointDailyCount.longitude,
+                         SpawnPointDailyCount.pokemon_id,
+                         fn.SUM(SpawnPointDailyCount.count).alias('count'),
+                         SpawnPointDailyCount.spawnpoint_id)
+                 .where(SpawnPointDailyCount.pokemon_id == pokemon_id)
+                 .group_by(SpawnPointDailyCount.latitude,
+                           SpawnPointDailyCount.longitude,
+                           SpawnPointDailyCount.pokemon_id,
+                           SpawnPointDailyCount.spawnpoint_id)
+                 .dicts())
+        head = []
         if timediff:
-            timediff = datetime.utcnow() - timediff
-        query = (Pokemon
-                 .select(Pokemon.latitude, Pokemon.longitude,
-                         Pokemon.pokemon_id,
-                         fn.Count(Pokemon.spawnpoint_id).alias('count'),
-                         Pokemon.spawnpoint_id)
-                 .where((Pokemon.pokemon_id == pokemon_id) &
-                        (Pokemon.disappear_time > timediff)
-                        )
-                 .group_by(Pokemon.latitude, Pokemon.longitude,
-                           Pokemon.pokemon_id, Pokemon.spawnpoint_id)
-                 .dicts()
-                 )
+            cutoff = datetime.utcnow() - timediff
+            boundary = day_start(cutoff) + timedelta(days=1)
+            query = query.where(SpawnPointDailyCount.day >= boundary)
+            head = (Pokemon
+                    .select(Pokemon.latitude, Pokemon.longitude,
+                            Pokemon.pokemon_id,
+                            fn.Count(Pokemon.spawnpoint_id).alias('count'),
+                            Pokemon.spawnpoint_id)
+                    .where((Pokemon.pokemon_id == pokemon_id) &
+                           (Pokemon.disappear_time > cutoff) &
+                           (Pokemon.disappear_time < boundary))
+                    .group_by(Pokemon.latitude, Pokemon.longitude,
+                              Pokemon.pokemon_id, Pokemon.spawnpoint_id)
+                    .dicts())
+
+        appearances = {}
+        for row in itertools.chain(query, head):
+            key = (row['latitude'], row['longitude'], row['spawnpoint_id'])
+            count = int(row['count'])
+            if key in appearances:
+                appearances[key]['count'] += count
+            else:
+                row['count'] = count
+                appearances[key] = row
 
-        return list(query)
+        return appearances.values()
 
     @classmethod
     def get_appearances_times_by_spawnpoint(cls, pokemon_id,
@@ -332,68 +478,75 @@ class Pokemon(BaseModel):
     @classmethod
     def get_spawnpoints(cls, swLat, swLng, neLat, neLng, timestamp=0,
                         oSwLat=None, oSwLng=None, oNeLat=None, oNeLng=None):
-        query = (Pokemon
-                 .select(Pokemon.latitude, Pokemon.longitude,
-                         Pokemon.spawnpoint_id,
-                         (date_secs(Pokemon.disappear_time)).alias('time'),
-                         fn.Count(Pokemon.spawnpoint_id).alias('count')))
+        return list(cls.iter_spawnpoints(swLat, swLng, neLat, neLng,
+                                         timestamp, oSwLat, oSwLng, oNeLat,
+                                         oNeLng))
+
+    # Spawnpoints in a viewport, one row at a time.
+    @classmethod
+    def iter_spawnpoints(cls, swLat, swLng, neLat, neLng, timestamp=0,
+                         oSwLat=None, oSwLng=None, oNeLat=None, oNeLng=None):
+        # Spawnpoints come from the despawn times counted per location in
+        # SpawnPointTimeCount, not from the whole Pokemon history.
+        sp_time = SpawnPointTimeCount
+        query = (sp_time
+                 .select(sp_time.latitude, sp_time.longitude,
+                         sp_time.spawnpoint_id, sp_time.time,
+                         sp_time.count))
 
         if timestamp > 0:
             query = (query
-                     .where(((Pokemon.last_modified >
+                     .where(((sp_time.last_modified >
                               datetime.utcfromtimestamp(timestamp / 1000))) &
-                            ((Pokemon.latitude >= swLat) &
-                             (Pokemon.longitude >= swLng) &
-                             (Pokemon.latitude <= neLat) &
-                             (Pokemon.longitude <= neLng)))
-                     .dicts())
+                            ((sp_time.latitude >= swLat) &
+                             (sp_time.longitude >= swLng) &
+                             (sp_time.latitude <= neLat) &
+                             (sp_time.longitude <= neLng))))
         elif oSwLat and oSwLng and oNeLat and oNeLng:
             # Send spawnpoints in view but exclude those within old boundaries.
             # Only send newly uncovered spawnpoints.
             query = (query
-                     .where((((Pokemon.latitude >= swLat) &
-                              (Pokemon.longitude >= swLng) &
-                              (Pokemon.latitude <= neLat) &
-                              (Pokemon.longitude <= neLng))) &
-                            ~((Pokemon.latitude >= oSwLat) &
-                              (Pokemon.longitude >= oSwLng) &
-                              (Pokemon.latitude <= oNeLat) &
-                              (Pokemon.longitude <= oNeLng)))
-                     .dicts())
-        elif swLat and swLng and neLat and neLng:
+                     .where((((sp_time.latitude >= swLat) &
+                              (sp_time.longitude >= swLng) &
+                              (sp_time.latitude <= neLat) &
+                              (sp_time.longitude <= neLng))) &
+                            ~((sp_time.latitude >= oSwLat) &
+                              (sp_time.longitude >= oSwLng) &
+                              (sp_time.latitude <= oNeLat) &
+                              (sp_time.longitude <= oNeLng))))
+        elif (swLat is not None and swLng is not None and
+              neLat is not None and neLng is not None):
+            # A bound can be 0 on the equator or the prime meridian.
             query = (query
-                     .where((Pokemon.latitude <= neLat) &
-                            (Pokemon.latitude >= swLat) &
-                            (Pokemon.longitude >= swLng) &
-                            (Pokemon.longitude <= neLng)
+                     .where((sp_time.latitude <= neLat) &
+                            (sp_time.latitude >= swLat) &
+                            (sp_time.longitude >= swLng) &
+                            (sp_time.longitude <= neLng)
                             ))
 
-        query = query.group_by(Pokemon.latitude, Pokemon.longitude,
-                               Pokemon.spawnpoint_id, SQL('time'))
+        # Ordered by spawnpoint, the rows of a spawnpoint come one after
+        # the other and each is done once the next one starts.
+        queryDict = query.order_by(sp_time.spawnpoint_id).dicts()
 
-        queryDict = query.dicts()
-        spawnpoints = {}
-
-        for sp in queryDict:
-            key = sp['spawnpoint_id']
-            disappear_time = cls.get_spawn_time(sp.pop('time'))
-            count = int(sp['count'])
-
-            if key not in spawnpoints:
-                spawnpoints[key] = sp
-            else:
-                spawnpoints[key]['special'] = True
+        for key, rows in itertools.groupby(
+                queryDict.iterator(), lambda sp: sp['spawnpoint_id']):
+            spawnpoint = None
+            for sp in rows:
+                disappear_time = cls.get_spawn_time(sp.pop('time'))
+                count = int(sp['count'])
 
-            if ('time' not in spawnpoints[key] or
-                    count >= spawnpoints[key]['count']):
-                spawnpoints[key]['time'] = disappear_time
-                spawnpoints[key]['count'] = count
+                if spawnpoint is None:
+                    spawnpoint = sp
+                else:
+                    spawnpoint['special'] = True
 
-        # Helping out the GC.
-        for sp in spawnpoints.values():
-            del sp['count']
+                if ('time' not in spawnpoint or
+                        count >= spawnpoint['count']):
+                    spawnpoint['time'] = disappear_time
+                    spawnpoint['count'] = count
 
-        return list(spawnpoints.values())
+            del spawnpoint['count']
+            yield spawnpoint
 
     @classmethod
     def get_spawnpoints_in_hex(cls, center, steps):
@@ -401,48 +554,78 @@ class Pokemon(BaseModel):
 
         n, e, s, w = hex_bounds(center, steps)
 
-        query = (Pokemon
-                 .select(Pokemon.latitude.alias('lat'),
-                         Pokemon.longitude.alias('lng'),
-                         (date_secs(Pokemon.disappear_time)).alias('time'),
-                         Pokemon.spawnpoint_id
-                         ))
-        query = (query.where((Pokemon.latitude <= n) &
-                             (Pokemon.latitude >= s) &
-                             (Pokemon.longitude >= w) &
-                             (Pokemon.longitude <= e)
-                             ))
-        # Sqlite doesn't support distinct on columns.
-        if args.db_type == 'mysql':
-            query = query.distinct(Pokemon.spawnpoint_id)
-        else:
-            query = query.group_by(Pokemon.spawnpoint_id)
-
-        s = list(query.dicts())
+        # One location per spawnpoint, with the appearance time of its most
+        # seen despawn time.
+        # todo: this DOES NOT ACCOUNT for Pokemon that appear sooner and
+        # live longer, but you'll _always_ have at least 15 minutes, so it
+        # works well enough.
+        s = [{'lat': sp['latitude'], 'lng': sp['longitude'],
+              'time': sp['time'], 'spawnpoint_id': sp['spawnpoint_id']}
+             for sp in cls.get_spawnpoints(s, w, n, e)]
 
         # The distance between scan circles of radius 70 in a hex is 121.2436
         # steps - 1 to account for the center circle then add 70 for the edge.
         step_distance = ((steps - 1) * 121.2436) + 70
         # Compare spawnpoint list to a circle with radius steps * 120.
-        # Uses the direct geopy distance between the center and the spawnpoint.
-        filtered = []
-
-        for idx, sp in enumerate(s):
-            if geopy.distance.distance(
-                    center, (sp['lat'], sp['lng'])).meters <= step_distance:
-                filtered.append(s[idx])
-
-        # At this point, 'time' is DISAPPEARANCE time, we're going to morph it
-        # to APPEARANCE time accounting for hour wraparound.
-        for location in filtered:
-            # todo: this DOES NOT ACCOUNT for Pokemon that appear sooner and
-            # live longer, but you'll _always_ have at least 15 minutes, so it
-            # works well enough.
-            location['time'] = cls.get_spawn_time(location['time'])
+        # Uses the direct geopy distance between the center and the spawnpoint
+        # for the ones close to the edge.
+        filtered = [sp for sp in s
+                    if within_distance(center, (sp['lat'], sp['lng']),
+                                       step_distance)]
 
         return filtered
 
 
+# Number of Pokemon of a species that disappeared in an hour, and where
+# the last of them was, for the statistics page.
+class PokemonHourlyCount(BaseModel):
+    hour = DateTimeField()
+    pokemon_id = SmallIntegerField()
+    count = IntegerField(default=0)
+    disappear_time = DateTimeField()
+    latitude = DoubleField()
+    longitude = DoubleField()
+
+    class Meta:
+        primary_key = CompositeKey('hour', 'pokemon_id')
+        # Rows hold the counts of a batch, added to the stored ones.
+        upsert_merge = {'count': 'add', 'disappear_time': 'max',
+                        'latitude': 'latest', 'longitude': 'latest'}
+        upsert_latest_by = 'disappear_time'
+
+
+# Number of Pokemon of a species that disappeared at a spawnpoint in a day.
+class SpawnPointDailyCount(BaseModel):
+    day = DateTimeField()
+    pokemon_id = SmallIntegerField()
+    spawnpoint_id = Utf8mb4CharField(max_length=50)
+    latitude = DoubleField()
+    longitude = DoubleField()
+    count = IntegerField(default=0)
+
+    class Meta:
+        primary_key = CompositeKey('day', 'pokemon_id', 'spawnpoint_id')
+        indexes = ((('pokemon_id', 'day'), False),)
+        upsert_merge = {'count': 'add'}
+
+
+# Number of Pokemon seen at a spawnpoint per despawn second, the spawnpoint
+# catalogue behind get_spawnpoints().
+class SpawnPointTimeCount(BaseModel):
+    spawnpoint_id = Utf8mb4CharField(max_length=50)
+    latitude = DoubleField()
+    longitude = DoubleField()
+    time = SmallIntegerField()
+    count = IntegerField(default=0)
+    last_modified = DateTimeField(index=True, default=datetime.utcnow)
+
+    class Meta:
+        primary_key = CompositeKey('spawnpoint_id', 'latitude', 'longitude',
+                                   'time')
+        indexes = ((('latitude', 'longitude'), False),)
+        upsert_merge = {'count': 'add', 'last_modified': 'max'}
+
+
 class Pokestop(BaseModel):
     pokestop_id = Utf8mb4CharField(primary_key=True, max_length=50)
     enabled = BooleanField()
@@ -461,6 +644,23 @@ class Pokestop(BaseModel):
     @staticmethod
     def get_stops(swLat, swLng, neLat, neLng, timestamp=0, oSwLat=None,
                   oSwLng=None, oNeLat=None, oNeLng=None, lured=False):
+        # Performance:  disable the garbage collector prior to creating a
+        # (potentially) large dict with append().
+        gc.disable()
+
+        pokestops = list(Pokestop.iter_stops(swLat, swLng, neLat, neLng,
+                                             timestamp, oSwLat, oSwLng,
+                                             oNeLat, oNeLng, lured))
+
+        # Re-enable the GC.
+        gc.enable()
+
+        return pokestops
+
+    # Pokestops in a viewport, one row at a time.
+    @staticmethod
+    def iter_stops(swLat, swLng, neLat, neLng, timestamp=0, oSwLat=None,
+                   oSwLng=None, oNeLat=None, oNeLng=None, lured=False):
 
         query = Pokestop.select(Pokestop.active_fort_modifier,
                                 Pokestop.enabled, Pokestop.latitude,
@@ -524,23 +724,30 @@ class Pokestop(BaseModel):
                             (Pokestop.longitude <= neLng))
                      .dicts())
 
-        # Performance:  disable the garbage collector prior to creating a
-        # (potentially) large dict with append().
-        gc.disable()
-
-        pokestops = []
-        for p in query:
+        for p in query.iterator():
             if args.china:
                 p['latitude'], p['longitude'] = \
                     transform_from_wgs_to_gcj(p['latitude'], p['longitude'])
-            pokestops.append(p)
+            yield p
 
-        # Re-enable the GC.
-        gc.enable()
+    # Pokestops in a viewport from the rows in the change log.
+    @staticmethod
+    def get_changed(changes, swLat, swLng, neLat, neLng):
+        pokestops = rows_in_viewport(
+            changes.get(Pokestop, {}).itervalues(), swLat, swLng, neLat,
+            neLng)
+        if args.china:
+            for p in pokestops:
+                p['latitude'], p['longitude'] = \
+                    transform_from_wgs_to_gcj(p['latitude'], p['longitude'])
 
         return pokestops
 
 
+# Gyms whose members are queried together by Gym.iter_gyms().
+GYM_CHUNK = 500
+
+
 class Gym(BaseModel):
 
     gym_id = Utf8mb4CharField(primary_key=True, max_length=50)
@@ -559,6 +766,23 @@ class Gym(BaseModel):
     @staticmethod
     def get_gyms(swLat, swLng, neLat, neLng, timestamp=0, oSwLat=None,
                  oSwLng=None, oNeLat=None, oNeLng=None):
+        # Performance:  disable the garbage collector prior to creating a
+        # (potentially) large dict with append().
+        gc.disable()
+
+        gyms = dict(Gym.iter_gyms(swLat, swLng, neLat, neLng, timestamp,
+                                  oSwLat, oSwLng, oNeLat, oNeLng))
+
+        # Re-enable the GC.
+        gc.enable()
+
+        return gyms
+
+    # (gym_id, gym) pairs of the Gyms in a viewport. Their members and names
+    # are queried GYM_CHUNK Gyms at a time.
+    @staticmethod
+    def iter_gyms(swLat, swLng, neLat, neLng, timestamp=0, oSwLat=None,
+                  oSwLng=None, oNeLat=None, oNeLng=None):
         if not (swLat and swLng and neLat and neLng):
             results = (Gym
                        .select()
@@ -598,18 +822,24 @@ class Gym(BaseModel):
                               (Gym.longitude <= neLng))
                        .dicts())
 
-        # Performance:  disable the garbage collector prior to creating a
-        # (potentially) large dict with append().
-        gc.disable()
-
-        gyms = {}
-        gym_ids = []
-        for g in results:
-            g['name'] = None
-            g['pokemon'] = []
-            gyms[g['gym_id']] = g
-            gym_ids.append(g['gym_id'])
-
+        results = results.iterator()
+        while True:
+            gyms = {}
+            for g in itertools.islice(results, GYM_CHUNK):
+                g['name'] = None
+                g['pokemon'] = []
+                gyms[g['gym_id']] = g
+            if not gyms:
+                return
+
+            Gym.add_members(gyms)
+            for gym_id, g in gyms.iteritems():
+                yield gym_id, g
+
+    # Add the members and names of a dict of Gyms by gym_id.
+    @staticmethod
+    def add_members(gyms):
+        gym_ids = gyms.keys()
         if len(gym_ids) > 0:
             pokemon = (GymMember
                        .select(
@@ -643,11 +873,6 @@ class Gym(BaseModel):
             for d in details:
                 gyms[d['gym_id']]['name'] = d['name']
 
-        # Re-enable the GC.
-        gc.enable()
-
-        return gyms
-
     @staticmethod
     def get_gym(id):
         result = (Gym
@@ -695,15 +920,17 @@ class Gym(BaseModel):
         for p in pokemon:
             p['pokemon_name'] = get_pokemon_name(p['pokemon_id'])
 
-            p['move_1_name'] = get_move_name(p['move_1'])
-            p['move_1_damage'] = get_move_damage(p['move_1'])
-            p['move_1_energy'] = get_move_energy(p['move_1'])
-            p['move_1_type'] = get_move_type(p['move_1'])
+            move_1 = get_move_info(p['move_1'])
+            p['move_1_name'] = move_1['name']
+            p['move_1_damage'] = move_1['damage']
+            p['move_1_energy'] = move_1['energy']
+            p['move_1_type'] = move_1['type']
 
-            p['move_2_name'] = get_move_name(p['move_2'])
-            p['move_2_damage'] = get_move_damage(p['move_2'])
-            p['move_2_energy'] = get_move_energy(p['move_2'])
-            p['move_2_type'] = get_move_type(p['move_2'])
+            move_2 = get_move_info(p['move_2'])
+            p['move_2_name'] = move_2['name']
+            p['move_2_damage'] = move_2['damage']
+            p['move_2_energy'] = move_2['energy']
+            p['move_2_type'] = move_2['type']
 
             result['pokemon'].append(p)
 
@@ -795,6 +1022,8 @@ class ScannedLocation(BaseModel):
                        Check('band5 >= -1'), Check('band5 < 3600'),
                        Check('midpoint >= -130'), Check('midpoint <= 130'),
                        Check('width >= 0'), Check('width <= 130')]
+        upsert_columns = ('last_modified', 'done', 'band1', 'band2', 'band3',
+                          'band4', 'band5', 'midpoint', 'width')
 
     @staticmethod
     def get_recent(swLat, swLng, neLat, neLng, timestamp=0, oSwLat=None,
@@ -839,6 +1068,13 @@ class ScannedLocation(BaseModel):
 
         return list(query)
 
+    # Scanned locations in a viewport from the rows in the change log.
+    @staticmethod
+    def get_changed(changes, swLat, swLng, neLat, neLng):
+        return rows_in_viewport(
+            changes.get(ScannedLocation, {}).itervalues(), swLat, swLng,
+            neLat, neLng)
+
     # DB format of a new location.
     @staticmethod
     def new_loc(loc):
@@ -904,16 +1140,17 @@ class ScannedLocation(BaseModel):
     @classmethod
     def link_spawn_points(cls, scans, initial, spawn_points, distance,
                           scan_spawn_point, force=False):
+        # Bucket the spawnpoints by grid cell, so each scan location only
+        # looks at the spawnpoints around it.
+        cells = bucket_points(spawn_points, LINK_CELL_DEGREES)
         for cell, scan in scans.iteritems():
             if initial[cell]['done'] and not force:
                 continue
             # Difference in degrees at the equator for 70m is actually 0.00063
             # degrees and gets smaller the further north or south you go
             deg_at_lat = 0.0007 / math.cos(math.radians(scan['loc'][0]))
-            for sp in spawn_points:
-                if (abs(sp['latitude'] - scan['loc'][0]) > 0.0008 or
-                        abs(sp['longitude'] - scan['loc'][1]) > deg_at_lat):
-                    continue
+            for sp in points_near(cells, scan['loc'][0], scan['loc'][1],
+                                  0.0008, deg_at_lat, LINK_CELL_DEGREES):
                 if in_radius((sp['latitude'], sp['longitude']),
                              scan['loc'], distance):
                     scan_spawn_point[cell + sp['id']] = {
@@ -1234,6 +1471,9 @@ class SpawnPoint(BaseModel):
         constraints = [Check('earliest_unseen >= 0'),
                        Check('earliest_unseen < 3600'),
                        Check('latest_seen >= 0'), Check('latest_seen < 3600')]
+        # Only the timing fields change once a spawn point is known.
+        upsert_columns = ('last_scanned', 'kind', 'links', 'missed_count',
+                          'latest_seen', 'earliest_unseen')
 
     # Returns the spawnpoint dict from ID, or a new dict if not found.
     @classmethod
@@ -1243,7 +1483,25 @@ class SpawnPoint(BaseModel):
                  .where(cls.id == id)
                  .dicts())
 
-        return query[0] if query else {
+        return query[0] if query else cls.new_sp(id, latitude, longitude)
+
+    # Return a dict of the spawnpoints with the given ids, keyed by id.
+    # Spawnpoints not in the database are left out.
+    @classmethod
+    def get_by_ids(cls, ids):
+        if not ids:
+            return {}
+
+        query = (cls
+                 .select()
+                 .where(cls.id << list(ids))
+                 .dicts())
+
+        return {sp['id']: sp for sp in query}
+
+    @staticmethod
+    def new_sp(id, latitude=0, longitude=0):
+        return {
             'id': id,
             'latitude': latitude,
             'longitude': longitude,
@@ -1436,21 +1694,44 @@ class SpawnpointDetectionData(BaseModel):
     encounter_id = Utf8mb4CharField(max_length=54)
     # Removed ForeignKeyField since it caused MySQL issues.
     spawnpoint_id = Utf8mb4CharField(max_length=54, index=True)
-    scan_time = DateTimeField()
+    scan_time = DateTimeField(index=True)
     tth_secs = SmallIntegerField(null=True)
 
     @staticmethod
     def set_default_earliest_unseen(sp):
         sp['earliest_unseen'] = (sp['latest_seen'] + 15 * 60) % 3600
 
+    # Return the past sightings of the given spawnpoints as a dict of lists,
+    # keyed by spawnpoint id and ordered by scan time.
     @classmethod
-    def classify(cls, sp, scan_loc, now_secs, sighting=None):
+    def get_by_spawnpoint_ids(cls, ids):
+        sightings = {}
+        if not ids:
+            return sightings
+
+        query = (cls
+                 .select()
+                 .where(cls.spawnpoint_id << list(ids))
+                 .order_by(cls.scan_time.asc())
+                 .dicts())
+
+        for s in query:
+            sightings.setdefault(s['spawnpoint_id'], []).append(s)
 
-        # Get past sightings.
-        query = list(cls.select()
-                        .where(cls.spawnpoint_id == sp['id'])
-                        .order_by(cls.scan_time.asc())
-                        .dicts())
+        return sightings
+
+    @classmethod
+    def classify(cls, sp, scan_loc, now_secs, sighting=None,
+                 past_sightings=None):
+
+        # Get past sightings, unless they were already loaded for the scan.
+        if past_sightings is None:
+            query = list(cls.select()
+                            .where(cls.spawnpoint_id == sp['id'])
+                            .order_by(cls.scan_time.asc())
+                            .dicts())
+        else:
+            query = list(past_sightings.get(sp['id'], []))
 
         if sighting:
             query.append(sighting)
@@ -1769,7 +2050,8 @@ def hex_bounds(center, steps=None, radius=None):
 
 # todo: this probably shouldn't _really_ be in "models" anymore, but w/e.
 def parse_map(args, map_dict, step_location, db_update_queue, wh_update_queue,
-              key_scheduler, api, status, now_date, account, account_sets):
+              key_scheduler, api, status, now_date, account, account_sets,
+              hive_cache=None):
     pokemon = {}
     pokestops = {}
     gyms = {}
@@ -1841,7 +2123,12 @@ def parse_map(args, map_dict, step_location, db_update_queue, wh_update_queue,
             log.warning('No nearby or wild Pokemon but there are visible gyms '
                         'or pokestops. Possible speed violation.')
 
-    scan_loc = ScannedLocation.get_by_loc(step_location)
+    # With a hive cache, scanned locations and spawnpoints are read from and
+    # written to memory instead of the database.
+    if hive_cache:
+        scan_loc = hive_cache.get_scanned_location(step_location)
+    else:
+        scan_loc = ScannedLocation.get_by_loc(step_location)
     done_already = scan_loc['done']
     ScannedLocation.update_band(scan_loc, now_date)
     just_completed = not done_already and scan_loc['done']
@@ -1862,10 +2149,30 @@ def parse_map(args, map_dict, step_location, db_update_queue, wh_update_queue,
         encountered_pokemon = [
             (p['encounter_id'], p['spawnpoint_id']) for p in query]
 
+        # Load the spawnpoints of the scan at once, and the past sightings of
+        # the ones that will have to be classified.
+        spawn_point_ids = set(p['spawn_point_id'] for p in wild_pokemon)
+        if hive_cache:
+            known_spawn_points = hive_cache.get_spawn_points(spawn_point_ids)
+        else:
+            known_spawn_points = SpawnPoint.get_by_ids(spawn_point_ids)
+        classify_ids = set(
+            p['spawn_point_id'] for p in wild_pokemon
+            if (not scan_loc['done'] or just_completed or
+                p['spawn_point_id'] not in known_spawn_points or
+                not SpawnPoint.tth_found(
+                    known_spawn_points[p['spawn_point_id']])))
+        past_sightings = SpawnpointDetectionData.get_by_spawnpoint_ids(
+            classify_ids)
+
         for p in wild_pokemon:
 
-            sp = SpawnPoint.get_by_id(p['spawn_point_id'], p[
-                                      'latitude'], p['longitude'])
+            if p['spawn_point_id'] in known_spawn_points:
+                # Copy, each Pokemon starts from the database version.
+                sp = dict(known_spawn_points[p['spawn_point_id']])
+            else:
+                sp = SpawnPoint.new_sp(p['spawn_point_id'], p['latitude'],
+                                       p['longitude'])
             spawn_points[p['spawn_point_id']] = sp
             sp['missed_count'] = 0
 
@@ -1917,8 +2224,9 @@ def parse_map(args, map_dict, step_location, db_update_queue, wh_update_queue,
 
             if (not SpawnPoint.tth_found(sp) or sighting['tth_secs'] or
                     not scan_loc['done'] or just_completed):
-                SpawnpointDetectionData.classify(sp, scan_loc, now_secs,
-                                                 sighting)
+                SpawnpointDetectionData.classify(
+                    sp, scan_loc, now_secs, sighting,
+                    past_sightings if sp['id'] in classify_ids else None)
                 sightings[p['encounter_id']] = sighting
 
             sp['last_scanned'] = datetime.utcfromtimestamp(
@@ -1981,6 +2289,7 @@ def parse_map(args, map_dict, step_location, db_update_queue, wh_update_queue,
 
                     # Make new API for this account if we're not using an
                     # API that's already logged in.
+                    key = None
                     if not hlvl_api:
                         hlvl_api = setup_api(args, status)
 
@@ -2001,16 +2310,21 @@ def parse_map(args, map_dict, step_location, db_update_queue, wh_update_queue,
                     # Set location.
                     hlvl_api.set_position(*scan_location)
 
-                    # Log in.
-                    check_login(args, hlvl_account, hlvl_api, scan_location,
-                                status['proxy_url'])
-
-                    # Encounter Pokémon.
-                    encounter_result = encounter_pokemon_request(
-                        hlvl_api,
-                        p['encounter_id'],
-                        p['spawn_point_id'],
-                        scan_location)
+                    try:
+                        # Log in.
+                        check_login(args, hlvl_account, hlvl_api,
+                                    scan_location, status['proxy_url'])
+
+                        # Encounter Pokémon.
+                        encounter_result = encounter_pokemon_request(
+                            hlvl_api,
+                            p['encounter_id'],
+                            p['spawn_point_id'],
+                            scan_location)
+                    finally:
+                        # Give back the key handed out for the new API.
+                        if key:
+                            key_scheduler.done(key)
 
                     # Handle errors.
                     if encounter_result:
@@ -2147,7 +2461,7 @@ def parse_map(args, map_dict, step_location, db_update_queue, wh_update_queue,
                             'pokemon_level': calc_pokemon_level(
                                 wh_poke['cp_multiplier'])
                         })
-                    wh_update_queue.put(('pokemon', wh_poke))
+                    wh_update_queue.put(webhook_item('pokemon', wh_poke))
 
     if forts and (config['parse_pokestops'] or config['parse_gyms']):
         if config['parse_pokestops']:
@@ -2179,7 +2493,7 @@ def parse_map(args, map_dict, step_location, db_update_queue, wh_update_queue,
                         timedelta(minutes=args.lure_duration))
                     active_fort_modifier = f['active_fort_modifier']
                     if args.webhooks and args.webhook_updates_only:
-                        wh_update_queue.put(('pokestop', {
+                        wh_update_queue.put(webhook_item('pokestop', {
                             'pokestop_id': b64encode(str(f['id'])),
                             'enabled': f['enabled'],
                             'latitude': f['latitude'],
@@ -2203,7 +2517,7 @@ def parse_map(args, map_dict, step_location, db_update_queue, wh_update_queue,
                     if lure_expiration is not None:
                         l_e = calendar.timegm(lure_expiration.timetuple())
 
-                    wh_update_queue.put(('pokestop', {
+                    wh_update_queue.put(webhook_item('pokestop', {
                         'pokestop_id': b64encode(str(f['id'])),
                         'enabled': f['enabled'],
                         'latitude': f['latitude'],
@@ -2238,7 +2552,7 @@ def parse_map(args, map_dict, step_location, db_update_queue, wh_update_queue,
                     # Explicitly set 'webhook_data', in case we want to change
                     # the information pushed to webhooks.  Similar to above
                     # and previous commits.
-                    wh_update_queue.put(('gym', {
+                    wh_update_queue.put(webhook_item('gym', {
                         'gym_id': b64encode(str(f['id'])),
                         'team_id': f.get('owned_by_team', 0),
                         'guard_pokemon_id': f.get('guard_pokemon_id', 0),
@@ -2274,7 +2588,21 @@ def parse_map(args, map_dict, step_location, db_update_queue, wh_update_queue,
 
     # Look for spawnpoints within scan_loc that are not here to see if we
     # can narrow down tth window.
-    for sp in ScannedLocation.linked_spawn_points(scan_loc['cellid']):
+    if hive_cache:
+        linked_spawn_points = hive_cache.linked_spawn_points(
+            scan_loc['cellid'])
+    else:
+        linked_spawn_points = ScannedLocation.linked_spawn_points(
+            scan_loc['cellid'])
+
+    # A completed cell classifies all of them, load their sightings at once.
+    linked_sightings = None
+    if just_completed:
+        linked_sightings = SpawnpointDetectionData.get_by_spawnpoint_ids(
+            [linked['id'] for linked in linked_spawn_points
+             if linked['id'] not in sp_id_list])
+
+    for sp in linked_spawn_points:
         if sp['id'] in sp_id_list:
             # Don't overwrite changes from this parse with DB version.
             sp = spawn_points[sp['id']]
@@ -2282,7 +2610,8 @@ def parse_map(args, map_dict, step_location, db_update_queue, wh_update_queue,
             # If the cell has completed, we need to classify all
             # the SPs that were not picked up in the scan
             if just_completed:
-                SpawnpointDetectionData.classify(sp, scan_loc, now_secs)
+                SpawnpointDetectionData.classify(
+                    sp, scan_loc, now_secs, past_sightings=linked_sightings)
                 spawn_points[sp['id']] = sp
             if SpawnpointDetectionData.unseen(sp, now_secs):
                 spawn_points[sp['id']] = sp
@@ -2306,23 +2635,27 @@ def parse_map(args, map_dict, step_location, db_update_queue, wh_update_queue,
                         (now_secs - sp['latest_seen']) % 3600)
             log.info('Restarting current 15 minute search for TTH.')
             if sp['id'] not in sp_id_list:
-                SpawnpointDetectionData.classify(sp, scan_loc, now_secs)
+                SpawnpointDetectionData.classify(
+                    sp, scan_loc, now_secs, past_sightings=linked_sightings)
             sp['latest_seen'] = (sp['latest_seen'] - 60) % 3600
             sp['earliest_unseen'] = (
                 sp['earliest_unseen'] + 14 * 60) % 3600
             spawn_points[sp['id']] = sp
 
-    db_update_queue.put((ScannedLocation, {0: scan_loc}))
+    spawn_update_queue = hive_cache or db_update_queue
+    spawn_update_queue.put((ScannedLocation, {0: scan_loc}))
 
     if pokemon:
         db_update_queue.put((Pokemon, pokemon))
+        if args.pokemon_index:
+            active_pokemon.add(pokemon.itervalues())
     if pokestops:
         db_update_queue.put((Pokestop, pokestops))
     if gyms:
         db_update_queue.put((Gym, gyms))
     if spawn_points:
-        db_update_queue.put((SpawnPoint, spawn_points))
-        db_update_queue.put((ScanSpawnPoint, scan_spawn_points))
+        spawn_update_queue.put((SpawnPoint, spawn_points))
+        spawn_update_queue.put((ScanSpawnPoint, scan_spawn_points))
         if sightings:
             db_update_queue.put((SpawnpointDetectionData, sightings))
 
@@ -2442,7 +2775,7 @@ def parse_gyms(args, gym_responses, wh_update_queue, db_update_queue):
 
             i += 1
         if args.webhooks:
-            wh_update_queue.put(('gym_details', webhook_data))
+            wh_update_queue.put(webhook_item('gym_details', webhook_data))
 
     # All this database stuff is synchronous (not using the upsert queue) on
     # purpose.  Since the search workers load the GymDetails model from the
@@ -2479,6 +2812,88 @@ def parse_gyms(args, gym_responses, wh_update_queue, db_update_queue):
              len(gym_members))
 
 
+# Rows per statement of the db updater, per model. For SQLite these are the
+# rows per bulk_upsert chunk, sqlite_upsert splits them into statements.
+if args.db_type == 'mysql':
+    upsert_steps = AdaptiveStep(250, 25, 2000)
+else:
+    upsert_steps = AdaptiveStep(1000, 50, 10000)
+sqlite_upsert = SqliteUpsert()
+mysql_upsert = MysqlUpsert()
+
+
+# Encounter ids of a list that are already in the pokemon table. On MySQL
+# the rows are locked until the transaction ends, so another writer of the
+# same encounters waits for it and then finds them stored.
+def stored_encounters(ids):
+    stored = []
+    for i in range(0, len(ids), 500):
+        query = (Pokemon.select(Pokemon.encounter_id)
+                 .where(Pokemon.encounter_id << ids[i:i + 500]))
+        if args.db_type == 'mysql':
+            query = query.for_update()
+        stored.extend(row[0] for row in query.tuples())
+    return stored
+
+
+# Add the counts of new Pokemon to the rollup tables. The rows hold only
+# the new counts, the upserts add them to the stored ones.
+def write_pokemon_rollups(seen, appearances, spawn_times, db):
+    for model, rows in ((PokemonHourlyCount, seen),
+                        (SpawnPointDailyCount, appearances),
+                        (SpawnPointTimeCount, spawn_times)):
+        if rows:
+            write_rows(model, rows.values(), db)
+
+
+# Count all Pokemon already stored into the rollup tables, replacing what
+# they hold.
+def backfill_pokemon_rollups(db):
+    tables = [PokemonHourlyCount, SpawnPointDailyCount, SpawnPointTimeCount]
+    counts = ({}, {}, {})
+    query = (Pokemon
+             .select(Pokemon.pokemon_id, Pokemon.spawnpoint_id,
+                     Pokemon.latitude, Pokemon.longitude,
+                     Pokemon.disappear_time, Pokemon.last_modified)
+             .dicts()
+             .iterator())
+    total = 0
+    while True:
+        rows = list(itertools.islice(query, 100000))
+        if not rows:
+            break
+        total += len(rows)
+        for new, stored in zip(aggregate(rows), counts):
+            stored.update(merge(new, stored))
+        log.info('Counted %d Pokemon for the rollup tables.', total)
+    db.create_tables(tables, safe=True)
+    for table, rows in zip(tables, counts):
+        table.delete().execute()
+        bulk_upsert(table, rows, db)
+
+
+pokemon_rollups = Rollups(stored_encounters, write_pokemon_rollups)
+updater_stats = UpdaterStats()
+
+
+# Write the rows of a batch, model by model. The rows of a model that can't
+# be written are dropped, the other models are still written.
+def write_batch(args, batch, db):
+    for model, data in batch.items():
+        try:
+            start = default_timer()
+            # New encounters are counted as they're stored.
+            rollups = pokemon_rollups if model is Pokemon else None
+            bulk_upsert(model, data, db, step=upsert_steps.get(model),
+                        rollups=rollups)
+            upsert_steps.update(model, len(data), default_timer() - start)
+            if args.delta_sync:
+                change_log.append(model, data)
+        except Exception as e:
+            log.exception('Dropping %d %s rows that could not be written: %s',
+                          len(data), model.__name__, repr(e))
+
+
 def db_updater(args, q, db):
     # The forever loop.
     while True:
@@ -2494,34 +2909,57 @@ def db_updater(args, q, db):
 
             # Loop the queue.
             while True:
+                # Merge what's queued up over a short window, so each table
+                # gets one large upsert per flush.
+                batch = drain(q, args.db_batch_window, args.db_batch_max)
                 last_upsert = default_timer()
-                model, data = q.get()
-
-                bulk_upsert(model, data, db)
-                q.task_done()
+                try:
+                    write_batch(args, batch, db)
+                finally:
+                    for _ in range(batch.updates):
+                        q.task_done()
 
-                log.debug('Upserted to %s, %d records (upsert queue '
+                elapsed = default_timer() - last_upsert
+                log.debug('Upserted %d updates as %d records (upsert queue '
                           'remaining: %d) in %.2f seconds.',
-                          model.__name__,
-                          len(data),
-                          q.qsize(),
-                          default_timer() - last_upsert)
+                          batch.updates, len(batch), q.qsize(), elapsed)
+                updater_stats.record(batch, elapsed, q.qsize())
 
                 # Helping out the GC.
-                del model
-                del data
-
-                if q.qsize() > 50:
-                    log.warning(
-                        "DB queue is > 50 (@%d); try increasing --db-threads.",
-                        q.qsize())
+                del batch
 
         except Exception as e:
             log.exception('Exception in db_updater: %s', repr(e))
             time.sleep(5)
 
 
+# Seconds a pass of clean_db_loop spends purging each table, so the other
+# cleanups keep running while a large backlog is purged.
+PURGE_MAX_SECONDS = 50
+# Fewest hours of spawnpoint detection data kept by --purge-detection-data,
+# as SpawnpointDetectionData.classify works out spawnpoints from all their
+# sightings.
+DETECTION_DATA_MIN_HOURS = 168
+
+
 def clean_db_loop(args):
+    # Pairs of the purge and the hours its rows are kept.
+    purges = []
+    if args.purge_data > 0:
+        purges.append((ChunkedPurge(Pokemon, Pokemon.disappear_time,
+                                    args.purge_chunk, args.purge_rate),
+                       args.purge_data))
+    if args.purge_detection_data > 0:
+        hours = args.purge_detection_data
+        if hours < DETECTION_DATA_MIN_HOURS:
+            log.warning('Keeping spawnpoint detection data for %d hours ' +
+                        'instead of %d, spawnpoints are classified from it.',
+                        DETECTION_DATA_MIN_HOURS, hours)
+            hours = DETECTION_DATA_MIN_HOURS
+        purges.append((ChunkedPurge(SpawnpointDetectionData,
+                                    SpawnpointDetectionData.scan_time,
+                                    args.purge_chunk, args.purge_rate),
+                       hours))
     while True:
         try:
             query = (MainWorker
@@ -2556,21 +2994,16 @@ def clean_db_loop(args):
                             (datetime.now() - timedelta(days=1))))
             query.execute()
 
-            # If desired, clear old Pokemon spawns.
-            if args.purge_data > 0:
-                log.info("Beginning purge of old Pokemon spawns.")
-                start = datetime.utcnow()
-                query = (Pokemon
-                         .delete()
-                         .where((Pokemon.disappear_time <
-                                 (datetime.utcnow() -
-                                  timedelta(hours=args.purge_data)))))
-                rows = query.execute()
-                end = datetime.utcnow()
-                diff = end - start
-                log.info("Completed purge of old Pokemon spawns. "
-                         "%i deleted in %f seconds.",
-                         rows, diff.total_seconds())
+            # If desired, clear old Pokemon spawns and detection data, a
+            # chunk at a time.
+            for purge, hours in purges:
+                before = datetime.utcnow() - timedelta(hours=hours)
+                start = default_timer()
+                rows, more = purge.run(before, PURGE_MAX_SECONDS)
+                log.info('Purged %d old %s rows in %.2f seconds%s.',
+                         rows, purge.cls.__name__,
+                         default_timer() - start,
+                         ', continuing next pass' if more else '')
 
             log.info('Regular database cleaning complete.')
             time.sleep(60)
@@ -2578,35 +3011,52 @@ def clean_db_loop(args):
             log.exception('Exception in clean_db_loop: %s', repr(e))
 
 
-def bulk_upsert(cls, data, db):
-    num_rows = len(data.values())
-    i = 0
+# Times a chunk of rows is tried before bulk_upsert gives up on it, and
+# seconds between two tries.
+UPSERT_ATTEMPTS = 5
+UPSERT_RETRY_DELAY = 1.0
 
+
+# Write a list of rows of a model in the current transaction.
+def write_rows(cls, rows, db, step=None):
     if args.db_type == 'mysql':
-        step = 250
+        mysql_upsert.write(cls, rows, db, step or 250)
     else:
-        # SQLite has a default max number of parameters of 999,
-        # so we need to limit how many rows we insert for it.
-        step = 50
-
-    with db.atomic():
-        while i < num_rows:
-            log.debug('Inserting items %d to %d.', i, min(i + step, num_rows))
+        sqlite_upsert.write(cls, rows, db)
+
+
+# Write the rows of a model, `step` rows at a time. Each chunk is written in
+# its own transaction, so a retry after a lost connection writes all of it
+# again. Chunks that break a constraint are dropped, other errors are tried
+# UPSERT_ATTEMPTS times and then raised. With `rollups`, the new rows of a
+# chunk are counted in the same transaction.
+def bulk_upsert(cls, data, db, step=None, rollups=None):
+    rows = data.values()
+
+    if step is None:
+        # SQLite rows are packed into statements by sqlite_upsert, within
+        # its limit on parameters.
+        step = 250 if args.db_type == 'mysql' else 1000
+
+    for i in xrange(0, len(rows), step):
+        log.debug('Inserting items %d to %d.', i, min(i + step, len(rows)))
+        chunk = rows[i:i + step]
+        for attempt in itertools.count(1):
             try:
-                # Turn off FOREIGN_KEY_CHECKS on MySQL, because apparently it's
-                # unable to recognize strings to update unicode keys for
-                # foreign key fields, thus giving lots of foreign key
-                # constraint errors.
-                if args.db_type == 'mysql':
-                    db.execute_sql('SET FOREIGN_KEY_CHECKS=0;')
-
-                # Use peewee's own implementation of the insert_many() method.
-                InsertQuery(cls, rows=data.values()[
-                            i:min(i + step, num_rows)]).upsert().execute()
-
-                if args.db_type == 'mysql':
-                    db.execute_sql('SET FOREIGN_KEY_CHECKS=1;')
-
+                with db.atomic():
+                    # Turn off FOREIGN_KEY_CHECKS on MySQL, because
+                    # apparently it's unable to recognize strings to update
+                    # unicode keys for foreign key fields, thus giving lots
+                    # of foreign key constraint errors. It's set again on
+                    # every try, as a new connection starts with it on.
+                    if args.db_type == 'mysql':
+                        db.execute_sql('SET FOREIGN_KEY_CHECKS=0;')
+                    if rollups:
+                        counted = rollups.add(chunk, db)
+                    write_rows(cls, chunk, db, step)
+                if rollups:
+                    rollups.committed(counted)
+                break
             except Exception as e:
                 # If there is a DB table constraint error, dump the data and
                 # don't retry.
@@ -2618,13 +3068,15 @@ def bulk_upsert(cls, data, db):
                     lambda x: x in str(e), unrecoverable)
                 if has_unrecoverable:
                     log.warning('%s. Data is:', repr(e))
-                    log.warning(data.items())
-                else:
-                    log.warning('%s... Retrying...', repr(e))
-                    time.sleep(1)
-                    continue
+                    log.warning(chunk)
+                    break
+                if attempt >= UPSERT_ATTEMPTS:
+                    raise
+                log.warning('%s... Retrying...', repr(e))
+                time.sleep(UPSERT_RETRY_DELAY)
 
-            i += step
+    if args.db_type == 'mysql':
+        db.execute_sql('SET FOREIGN_KEY_CHECKS=1;')
 
 
 def create_tables(db):
@@ -2632,7 +3084,8 @@ def create_tables(db):
     tables = [Pokemon, Pokestop, Gym, ScannedLocation, GymDetails,
               GymMember, GymPokemon, Trainer, MainWorker, WorkerStatus,
               SpawnPoint, ScanSpawnPoint, SpawnpointDetectionData,
-              Token, LocationAltitude, HashKeys]
+              Token, LocationAltitude, HashKeys, PokemonHourlyCount,
+              SpawnPointDailyCount, SpawnPointTimeCount]
     for table in tables:
         if not table.table_exists():
             log.info('Creating table: %s', table.__name__)
@@ -2647,7 +3100,8 @@ def drop_tables(db):
               GymDetails, GymMember, GymPokemon, Trainer, MainWorker,
               WorkerStatus, SpawnPoint, ScanSpawnPoint,
               SpawnpointDetectionData, LocationAltitude,
-              Token, HashKeys]
+              Token, HashKeys, PokemonHourlyCount, SpawnPointDailyCount,
+              SpawnPointTimeCount]
     db.connect()
     db.execute_sql('SET FOREIGN_KEY_CHECKS=0;')
     for table in tables:
@@ -2940,5 +3394,21 @@ def database_migrate(db, old_ver):
                                 FloatField(null=True))
         )
 
+    if old_ver < 20:
+        log.info('This DB schema update can take some time. '
+                 'Please be patient.')
+        # Index used to purge old detection data in chunks.
+        migrate(
+            migrator.add_index('spawnpointdetectiondata', ('scan_time',),
+                               False)
+        )
+
+    if old_ver < 22:
+        log.info('This DB schema update can take some time. '
+                 'Please be patient.')
+        # Statistics (21) and spawnpoint times (22) are counted in rollup
+        # tables, fill them with the Pokemon stored so far.
+        backfill_pokemon_rollups(db)
+
     # Always log that we're done.
     log.info('Schema upgrade complete.')
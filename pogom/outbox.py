@@ -0,0 +1,287 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# On-disk outbox for webhook messages, see --wh-outbox. Messages are
+# appended to a log split into segment files, and every reader (one per
+# webhook endpoint) has a cursor into it that only moves forward once the
+# endpoint took the messages. The cursors are saved next to the segments,
+# so a restart carries on where the endpoints were.
+#
+# A segment is named after the offset of its first byte in the log, and
+# holds records of a 4 byte length, a 4 byte CRC32 and a JSON payload of
+# [append time, message]. Segments every reader is done with are deleted,
+# as are the oldest ones once the outbox is over its size or age limits.
+
+import bisect
+import json
+import logging
+import os
+import struct
+import time
+import zlib
+from threading import Condition, Lock
+
+log = logging.getLogger(__name__)
+
+# Size at which a new segment is started.
+SEGMENT_BYTES = 16 * 1024 * 1024
+# Seconds between two fsyncs of the active segment, and between two writes
+# of the cursors.
+SYNC_INTERVAL = 1.0
+
+HEADER = struct.Struct('>II')
+SEGMENT_SUFFIX = '.seg'
+CURSORS_FILE = 'cursors.json'
+
+
+def crc(payload):
+    return zlib.crc32(payload) & 0xffffffff
+
+
+class Outbox(object):
+
+    def __init__(self, path, max_bytes=None, max_age=None,
+                 segment_bytes=SEGMENT_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.segment_bytes = segment_bytes
+        self.lock = Lock()
+        self.appended = Condition(self.lock)
+        # Messages each reader lost to the retention limits, since asked.
+        self.lost = {}
+
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        self.segments = sorted(int(name[:-len(SEGMENT_SUFFIX)])
+                               for name in os.listdir(path)
+                               if name.endswith(SEGMENT_SUFFIX))
+        if not self.segments:
+            self.segments = [0]
+        self._recover()
+
+        self.file = open(self._segment_path(self.segments[-1]), 'ab')
+        self.end = self.segments[-1] + os.path.getsize(self.file.name)
+        self.last_sync = time.time()
+
+        self.cursors = {}
+        cursors_path = os.path.join(path, CURSORS_FILE)
+        if not os.path.isfile(cursors_path):
+            # Stopped while the cursors were replaced.
+            cursors_path += '.tmp'
+        if os.path.isfile(cursors_path):
+            with open(cursors_path) as f:
+                self.cursors = json.load(f)
+        # Cursors are saved more often than the segments are synced, so
+        # after a crash they can point past the records that made it to
+        # disk. Those readers carry on from the end.
+        for name, cursor in self.cursors.items():
+            if cursor > self.end:
+                log.warning('Webhook outbox cursor of %s is past the end ' +
+                            'of the outbox, %d bytes of messages were ' +
+                            'lost.', name, cursor - self.end)
+                self.cursors[name] = self.end
+        self.last_save = time.time()
+        # Open segment of each reader, as (base, file).
+        self.readers = {}
+
+    def _segment_path(self, base):
+        return os.path.join(self.path, '{:020d}{}'.format(base,
+                                                          SEGMENT_SUFFIX))
+
+    # Cut the last segment after its last complete record, in case the
+    # process died while writing one.
+    def _recover(self):
+        path = self._segment_path(self.segments[-1])
+        if not os.path.isfile(path):
+            open(path, 'ab').close()
+            return
+        good = 0
+        with open(path, 'rb') as f:
+            while True:
+                header = f.read(HEADER.size)
+                if len(header) < HEADER.size:
+                    break
+                length, checksum = HEADER.unpack(header)
+                payload = f.read(length)
+                if len(payload) < length or crc(payload) != checksum:
+                    break
+                good = f.tell()
+        size = os.path.getsize(path)
+        if good < size:
+            log.warning('Dropping %d bytes of an incomplete record at the ' +
+                        'end of webhook outbox segment %s.', size - good,
+                        path)
+            with open(path, 'r+b') as f:
+                f.truncate(good)
+
+    def append(self, message):
+        payload = json.dumps([time.time(), message], separators=(',', ':'))
+        record = HEADER.pack(len(payload), crc(payload)) + payload
+        with self.lock:
+            if (self.end > self.segments[-1] and
+                    self.end - self.segments[-1] + len(record) >
+                    self.segment_bytes):
+                self._roll()
+            self.file.write(record)
+            # Flushed before readers are told, so they can read it.
+            self.file.flush()
+            self.end += len(record)
+            now = time.time()
+            if now - self.last_sync > SYNC_INTERVAL:
+                os.fsync(self.file.fileno())
+                self.last_sync = now
+            self.appended.notify_all()
+
+    def _roll(self):
+        os.fsync(self.file.fileno())
+        self.file.close()
+        self.segments.append(self.end)
+        self.file = open(self._segment_path(self.end), 'ab')
+        self._retain()
+
+    # Delete the segments all readers are done with, then the oldest ones
+    # while the outbox is over its limits. Readers still in a deleted
+    # segment skip to the next one.
+    def _retain(self):
+        now = time.time()
+        oldest = min(self.cursors.values() or [self.end])
+        while len(self.segments) > 1:
+            base, next_base = self.segments[0], self.segments[1]
+            path = self._segment_path(base)
+            if next_base <= oldest:
+                reason = None
+            elif self.max_bytes and self.end - base > self.max_bytes:
+                reason = 'size'
+            elif (self.max_age and
+                  now - os.path.getmtime(path) > self.max_age):
+                reason = 'age'
+            else:
+                break
+
+            for name, cursor in self.cursors.items():
+                if cursor < next_base:
+                    lost = self._count_records(base, cursor, next_base)
+                    self.lost[name] = self.lost.get(name, 0) + lost
+                    self.cursors[name] = next_base
+                    log.warning('Webhook outbox is over its %s limit, %d ' +
+                                'messages for %s are dropped.', reason,
+                                lost, name)
+            # Readers with the segment open can still read it.
+            os.remove(path)
+            self.segments.pop(0)
+
+    def _count_records(self, base, start, end):
+        count = 0
+        with open(self._segment_path(base), 'rb') as f:
+            position = max(start, base)
+            while position < end:
+                f.seek(position - base)
+                header = f.read(HEADER.size)
+                if len(header) < HEADER.size:
+                    break
+                position += HEADER.size + HEADER.unpack(header)[0]
+                count += 1
+        return count
+
+    # Start a reader at the end of the outbox, unless it has a cursor.
+    # Cursors of other readers are forgotten, so they don't hold on to
+    # the segments.
+    def register(self, names):
+        with self.lock:
+            self.cursors = dict((name, self.cursors.get(name, self.end))
+                                for name in names)
+            self._save_cursors()
+
+    # How many bytes a reader is behind.
+    def behind(self, name):
+        with self.lock:
+            return self.end - self.cursors[name]
+
+    def take_lost(self, name):
+        with self.lock:
+            return self.lost.pop(name, 0)
+
+    # Wait for the outbox to have messages past the reader's cursor.
+    def wait(self, name, timeout):
+        with self.lock:
+            if self.cursors[name] >= self.end:
+                self.appended.wait(timeout)
+
+    # The next messages of a reader, as (append time, message), and the
+    # offset to commit once they're taken care of.
+    def read(self, name, max_records):
+        with self.lock:
+            offset = self.cursors[name]
+            end = self.end
+            segments = list(self.segments)
+            reader = self.readers.get(name)
+
+        records = []
+        while len(records) < max_records and offset < end:
+            i = bisect.bisect_right(segments, offset) - 1
+            base = segments[i]
+            limit = segments[i + 1] if i + 1 < len(segments) else end
+            if offset >= limit:
+                offset = limit
+                continue
+            if not reader or reader[0] != base:
+                if reader:
+                    reader[1].close()
+                try:
+                    reader = (base, open(self._segment_path(base), 'rb'))
+                except IOError:
+                    # Deleted by the retention limits since.
+                    break
+            f = reader[1]
+            f.seek(offset - base)
+            while len(records) < max_records and offset < limit:
+                length, checksum = HEADER.unpack(f.read(HEADER.size))
+                payload = f.read(length)
+                offset += HEADER.size + length
+                if crc(payload) != checksum:
+                    log.warning('Skipping a damaged record in webhook ' +
+                                'outbox segment %s.', f.name)
+                    continue
+                records.append(tuple(json.loads(payload)))
+
+        with self.lock:
+            if reader:
+                self.readers[name] = reader
+        return records, offset
+
+    # Move a reader past the messages read up to `offset`.
+    def commit(self, name, offset):
+        with self.lock:
+            self.cursors[name] = max(self.cursors[name], offset)
+            if len(self.segments) > 1:
+                self._retain()
+            if time.time() - self.last_save > SYNC_INTERVAL:
+                self._save_cursors()
+
+    # Write the cursors to a new file and move it over the old one. Windows
+    # can't rename a file over another, there the old one is removed first
+    # and a restart in between reads the new file.
+    def _save_cursors(self):
+        path = os.path.join(self.path, CURSORS_FILE)
+        with open(path + '.tmp', 'w') as f:
+            json.dump(self.cursors, f)
+            f.flush()
+            os.fsync(f.fileno())
+        try:
+            os.rename(path + '.tmp', path)
+        except OSError:
+            if not os.path.isfile(path):
+                raise
+            os.remove(path)
+            os.rename(path + '.tmp', path)
+        self.last_save = time.time()
+
+    def close(self):
+        with self.lock:
+            self._save_cursors()
+            os.fsync(self.file.fileno())
+            self.file.close()
+            for _, f in self.readers.values():
+                f.close()
+            self.readers = {}
@@ -0,0 +1,83 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Parsing of map responses in a pool of processes, see --parse-processes.
+# Search workers hand their responses to the pool and wait for the result,
+# so the CPU time of parse_map is spent outside the search process's GIL.
+# The db and webhook updates a parse process makes come back with its
+# result, and are put on the db_update_queue and wh_update_queue in the
+# order parse_map made them.
+
+import logging
+import signal
+import traceback
+from multiprocessing import Pool
+
+from .models import (Pokemon, active_pokemon, create_database, flaskDb,
+                     parse_map)
+from .utils import get_args
+
+log = logging.getLogger(__name__)
+
+# Seconds a search worker waits for a parse process, so a parse process
+# that died doesn't hang the worker.
+PARSE_TIMEOUT = 60
+
+
+# Stands in for the db and webhook queues in a parse process, keeping what
+# parse_map puts on them to send back with the result.
+class UpdateList(list):
+
+    def put(self, item):
+        self.append(item)
+
+
+def init_parse_process():
+    # Ctrl-C is handled by the search process, which stops the pool.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    # The connections inherited from the search process are still used
+    # there, use new ones.
+    flaskDb.database.initialize(create_database())
+
+
+def parse_in_process(map_dict, step_location, scan_date):
+    db_updates = UpdateList()
+    wh_updates = UpdateList()
+    try:
+        # No API, accounts or status: these are only used for encounters
+        # and tutorials, which aren't parsed in a pool.
+        parsed = parse_map(get_args(), map_dict, step_location, db_updates,
+                           wh_updates, None, None, {}, scan_date, None, None)
+    except Exception:
+        # The traceback doesn't survive the trip back, send it as text.
+        raise Exception('Parse process failed: ' + traceback.format_exc())
+
+    return parsed, db_updates, wh_updates
+
+
+class ParsePool(object):
+
+    def __init__(self, processes):
+        log.info('Starting %d parse processes.', processes)
+        self.pool = Pool(processes, initializer=init_parse_process)
+
+    # Same results as parse_map, which is run by one of the processes.
+    def parse(self, args, map_dict, step_location, db_update_queue,
+              wh_update_queue, scan_date):
+        result = self.pool.apply_async(parse_in_process,
+                                       (map_dict, step_location, scan_date))
+        parsed, db_updates, wh_updates = result.get(PARSE_TIMEOUT)
+
+        for model, data in db_updates:
+            db_update_queue.put((model, data))
+            # The in-memory index lives in this process.
+            if model is Pokemon and args.pokemon_index:
+                active_pokemon.add(data.itervalues())
+        for item in wh_updates:
+            wh_update_queue.put(item)
+
+        return parsed
+
+    def close(self):
+        self.pool.terminate()
+        self.pool.join()
@@ -0,0 +1,57 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import logging
+import time
+from timeit import default_timer
+
+log = logging.getLogger(__name__)
+
+
+# Deletes rows of a model older than a date in small chunks, so each delete
+# only locks a few rows for a moment and the db updater threads keep
+# writing in between. Every chunk selects the keys of up to `chunk` expired
+# rows through the index on `time_field`, then deletes them by primary key,
+# which works the same on MySQL and SQLite. Chunks are paced to at most
+# `rate` rows per second (0 for no limit).
+class ChunkedPurge(object):
+
+    def __init__(self, cls, time_field, chunk=1000, rate=0,
+                 sleep=time.sleep, timer=default_timer):
+        self.cls = cls
+        self.key_field = cls._meta.primary_key
+        self.time_field = time_field
+        self.chunk = max(chunk, 1)
+        self.rate = rate
+        self.sleep = sleep
+        self.timer = timer
+
+    # Delete the rows older than `before`, for up to `max_seconds` seconds
+    # (None for no limit). Returns (rows deleted, whether there are more).
+    def run(self, before, max_seconds=None):
+        start = self.timer()
+        deleted = 0
+        while True:
+            keys = [row[0] for row in
+                    self.cls.select(self.key_field)
+                    .where(self.time_field < before)
+                    .limit(self.chunk)
+                    .tuples()]
+            if not keys:
+                return deleted, False
+            deleted += (self.cls
+                        .delete()
+                        .where(self.key_field << keys)
+                        .execute())
+            if len(keys) < self.chunk:
+                return deleted, False
+
+            elapsed = self.timer() - start
+            if self.rate > 0:
+                # Wait until we're back under the rate.
+                ahead = deleted / float(self.rate) - elapsed
+                if ahead > 0:
+                    self.sleep(ahead)
+                    elapsed += ahead
+            if max_seconds is not None and elapsed >= max_seconds:
+                return deleted, True
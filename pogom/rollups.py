@@ -0,0 +1,141 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import logging
+from datetime import datetime, timedelta
+from threading import Lock
+
+from .utils import date_secs
+
+log = logging.getLogger(__name__)
+
+# Seconds an encounter is remembered as counted after it disappeared.
+COUNTED_SECONDS = 3600
+
+
+def hour_start(d):
+    return d.replace(minute=0, second=0, microsecond=0)
+
+
+def day_start(d):
+    return d.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+# Counts of Pokemon rows: per hour and species for get_seen(), with the
+# latest appearance of the species in that hour, per day, species and
+# spawnpoint for get_appearances(), and per spawnpoint location and
+# despawn second for get_spawnpoints(). Returns three dicts of rows keyed
+# by their primary keys.
+def aggregate(rows, now=None):
+    now = now or datetime.utcnow()
+    seen = {}
+    appearances = {}
+    spawn_times = {}
+    for p in rows:
+        hour = hour_start(p['disappear_time'])
+        key = (hour, p['pokemon_id'])
+        row = seen.get(key)
+        if row is None:
+            row = seen[key] = {'hour': hour, 'pokemon_id': p['pokemon_id'],
+                               'count': 0,
+                               'disappear_time': p['disappear_time'],
+                               'latitude': p['latitude'],
+                               'longitude': p['longitude']}
+        row['count'] += 1
+        latest(row, p)
+
+        day = day_start(p['disappear_time'])
+        key = (day, p['pokemon_id'], p['spawnpoint_id'])
+        row = appearances.get(key)
+        if row is None:
+            row = appearances[key] = {
+                'day': day, 'pokemon_id': p['pokemon_id'],
+                'spawnpoint_id': p['spawnpoint_id'],
+                'latitude': p['latitude'], 'longitude': p['longitude'],
+                'count': 0}
+        row['count'] += 1
+
+        time = date_secs(p['disappear_time'])
+        key = (p['spawnpoint_id'], p['latitude'], p['longitude'], time)
+        last_modified = p.get('last_modified') or now
+        row = spawn_times.get(key)
+        if row is None:
+            row = spawn_times[key] = {
+                'spawnpoint_id': p['spawnpoint_id'],
+                'latitude': p['latitude'], 'longitude': p['longitude'],
+                'time': time, 'count': 0, 'last_modified': last_modified}
+        row['count'] += 1
+        row['last_modified'] = max(row['last_modified'], last_modified)
+    return seen, appearances, spawn_times
+
+
+# Keep the latest appearance of `other` in `row`.
+def latest(row, other):
+    if other['disappear_time'] > row['disappear_time']:
+        row['disappear_time'] = other['disappear_time']
+        row['latitude'] = other['latitude']
+        row['longitude'] = other['longitude']
+
+
+# Add the counts of rows already stored to new rows, in place.
+def merge(rows, stored):
+    for key, old in stored.iteritems():
+        row = rows.get(key)
+        if row is not None:
+            row['count'] += old['count']
+            if 'disappear_time' in row:
+                latest(row, old)
+            if 'last_modified' in row:
+                row['last_modified'] = max(row['last_modified'],
+                                           old['last_modified'])
+    return rows
+
+
+# Keeps the rollup tables up to date as Pokemon are written. Every encounter
+# is only counted once: the ones already in the pokemon table, or counted
+# by this process in the last COUNTED_SECONDS, are skipped. `exists(ids)`
+# returns the encounter ids of a list that are already stored, and
+# `write(seen, appearances, spawn_times, db)` adds counts to the tables.
+# Counts are written in the transaction that stores the Pokemon, so both
+# are committed or neither is, and encounters are only remembered as
+# counted once it's committed.
+class Rollups(object):
+
+    def __init__(self, exists, write):
+        self.exists = exists
+        self.write = write
+        self.lock = Lock()
+        # encounter_id -> disappear_time.
+        self.counted = {}
+        self.last_cleanup = datetime.utcnow()
+
+    # Count the new encounters of a list of Pokemon rows, in the transaction
+    # that writes them, before they're written. Returns the rows to pass to
+    # committed() once the transaction is committed.
+    def add(self, rows, db):
+        with self.lock:
+            rows = [p for p in rows if p['encounter_id'] not in self.counted]
+        if not rows:
+            return rows
+        stored = set(self.exists([p['encounter_id'] for p in rows]))
+        new = [p for p in rows if p['encounter_id'] not in stored]
+        if new:
+            self.write(*(aggregate(new) + (db,)))
+        return rows
+
+    # Remember the encounters of rows that add() took care of.
+    def committed(self, rows):
+        with self.lock:
+            for p in rows:
+                self.counted[p['encounter_id']] = p['disappear_time']
+            self._cleanup()
+
+    def _cleanup(self):
+        now = datetime.utcnow()
+        if now - self.last_cleanup < timedelta(seconds=60):
+            return
+        expired = now - timedelta(seconds=COUNTED_SECONDS)
+        for key, disappear_time in self.counted.items():
+            if disappear_time < expired:
+                del self.counted[key]
+        self.last_cleanup = now
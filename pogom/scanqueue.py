@@ -0,0 +1,359 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import heapq
+import logging
+import math
+from operator import itemgetter
+from timeit import default_timer
+
+from .spatial import grid_cell
+from .utils import equi_rect_distance
+
+log = logging.getLogger(__name__)
+
+# Size of a grid cell in degrees. 0.005 degrees is roughly 550m, so a cell
+# holds a few dozen steps of a 70m hive.
+QUEUE_CELL_DEGREES = 0.005
+
+# Kilometers per degree, as used by equi_rect_distance.
+KM_PER_DEGREE = 6371 * math.pi / 180
+
+# Seconds of start time per bucket of a grid cell.
+BUCKET_SECONDS = 60
+
+# Kinds of queue items, best first. A band always beats a TTH search, which
+# always beats a spawn, no matter how far away they are.
+KINDS = ('band', 'TTH', 'spawn')
+
+# Seconds a parked item is kept for the worker walking to it.
+MAX_PARKING_IDLE_SECONDS = 3 * 60
+
+# Seconds an item is kept after its end, so the worker scanning it can still
+# report back.
+RETIRE_GRACE_SECONDS = 10 * 60
+
+
+# Index over the items of a SpeedScan queue, answering "which item should
+# this worker scan next" without looking at the whole queue.
+#
+# Items wait in a heap ordered by start time until they can be reached in
+# time by some worker. They're then open, and kept in a grid per kind, so
+# the nearest one can be found by searching rings of cells around the
+# worker. Within a cell, items are bucketed by start time, so the ones the
+# worker would be early for are skipped a bucket at a time. Open items leave
+# the grid when they're claimed or their end time passes, at which point
+# unclaimed items are marked as Missed.
+#
+# Every item gets an id that stays the same for as long as the item is in
+# the index, so refreshes can merge new items in without disturbing the
+# workers scanning the current ones. `queue` is a list of the items sorted
+# by start time, kept up to date for the overseer's status and statistics.
+class ScanQueue(object):
+
+    def __init__(self, queue=None, cell_size=QUEUE_CELL_DEGREES):
+        self.queue = []
+        self.cell_size = cell_size
+        # id -> item.
+        self.items = {}
+        self.next_id = 0
+        # Heap of (start, id) of the items not opened yet. May hold entries
+        # of items that have changed or been retired since, like the heaps
+        # and dicts below.
+        self.pending = []
+        # Heap of (end, id) of the open items.
+        self.expiring = []
+        # kind -> {(row, column): {bucket: {id: item}}}.
+        self.cells = dict((kind, {}) for kind in KINDS)
+        # spawnpoint id -> ids of the items of that spawnpoint.
+        self.by_sp = {}
+        # (kind, step, spawnpoint id) -> id of the latest item.
+        self.by_key = {}
+        # Ids of the items whose end has passed and were returned by
+        # retire() already.
+        self.ended = set()
+        # Bounds of the grid cells used, as (min row, min column, max row,
+        # max column).
+        self.bounds = None
+        self.center = None
+        self.diameter = 0.0
+        self.cell_km = 0.0
+        self.cell_side_km = 0.0
+        self.ms = None
+
+        if queue:
+            self.merge(queue)
+
+    def __len__(self):
+        return len(self.items)
+
+    # Return the item with the given id, or None if it has been retired.
+    def get(self, id):
+        return self.items.get(id)
+
+    # Ids of the queue items of a spawnpoint.
+    def items_for_sp(self, sp_id):
+        return self.by_sp.get(sp_id, ())
+
+    # Add new items. An item for the same kind, step and spawnpoint as one
+    # already in the index is the same scan if their times overlap: the old
+    # item keeps its id, and its times are updated unless it's been scanned
+    # already. Returns the number of items added and updated.
+    def merge(self, items):
+        added = updated = 0
+        bounds = self.bounds
+        for item in items:
+            key = (item['kind'], item['step'], item['sp'])
+            id = self.by_key.get(key)
+            old = self.items.get(id)
+            if (old is not None and old['start'] <= item['end'] and
+                    item['start'] <= old['end']):
+                times = (item['start'], item['end'])
+                if times == (old['start'], old['end']):
+                    continue
+                if not old.get('done', False):
+                    self._close(id, old)
+                    old['start'], old['end'] = times
+                    heapq.heappush(self.pending, (old['start'], id))
+                    updated += 1
+                    continue
+
+            id = self.next_id
+            self.next_id += 1
+            self.items[id] = item
+            self.by_key[key] = id
+            if item['sp']:
+                self.by_sp.setdefault(item['sp'], set()).add(id)
+            self._extend_bounds(item['loc'])
+            if not item.get('done', False):
+                heapq.heappush(self.pending, (item['start'], id))
+            added += 1
+
+        if self.bounds != bounds:
+            self._measure()
+        self._sort()
+        return added, updated
+
+    # Mark the unscanned items that ended before `ms` as Missed, and drop
+    # the ones that ended more than `grace` seconds ago, giving the workers
+    # still scanning them time to report back. Returns the items that ended
+    # since the last call.
+    def retire(self, ms, grace=RETIRE_GRACE_SECONDS):
+        ended = []
+        for id, item in self.items.items():
+            if item['end'] >= ms:
+                continue
+            if id not in self.ended:
+                self.ended.add(id)
+                if not item.get('done', False):
+                    item['done'] = 'Missed'
+                ended.append(item)
+            if item['end'] < ms - grace:
+                self._remove(id, item)
+        self._sort()
+        ended.sort(key=itemgetter('start'))
+        return ended
+
+    # Put an item back in the queue after its claim has been dropped.
+    def release(self, id):
+        item = self.items.get(id)
+        if item is not None:
+            item['done'] = None
+            heapq.heappush(self.pending, (item['start'], id))
+
+    # Move the index forward to `ms`: open the items that could be reached
+    # within `horizon` seconds and retire the ones that have ended. Returns
+    # the number of items marked as Missed.
+    def advance(self, ms, horizon):
+        self.ms = ms
+        while self.pending and self.pending[0][0] <= ms + horizon:
+            start, id = heapq.heappop(self.pending)
+            item = self.items.get(id)
+            if (item is None or item['start'] != start or
+                    item.get('done', False)):
+                continue
+            cell = grid_cell(item['loc'][0], item['loc'][1], self.cell_size)
+            buckets = self.cells[item['kind']].setdefault(cell, {})
+            buckets.setdefault(start // BUCKET_SECONDS, {})[id] = item
+            heapq.heappush(self.expiring, (item['end'], id))
+
+        missed = 0
+        while self.expiring and self.expiring[0][0] < ms:
+            end, id = heapq.heappop(self.expiring)
+            item = self.items.get(id)
+            if item is None or item['end'] != end:
+                continue
+            self._close(id, item)
+            if not item.get('done', False):
+                item['done'] = 'Missed'
+                missed += 1
+        return missed
+
+    # Seconds it can take a worker at `worker_loc` to reach any item.
+    def horizon(self, worker_loc, kph):
+        if not self.center or not kph:
+            return 0
+        distance = (self.diameter +
+                    equi_rect_distance(worker_loc, self.center))
+        return distance / kph * 3600
+
+    # Find the best open item for a worker: the nearest one of the best kind
+    # that can be reached between its start and end time, and isn't parked
+    # by another worker. Returns a dict with the item, its id, the distance
+    # and secs_to_arrival, or an empty dict. `stats` counts the items
+    # skipped, for logging.
+    def best(self, worker_loc, secs_waited, kph, parked_name, stats=None):
+        if stats is None:
+            stats = {}
+        for kind in KINDS:
+            cells = self.cells[kind]
+            if not cells:
+                continue
+            best = self._nearest(cells, worker_loc, secs_waited, kph,
+                                 parked_name, stats)
+            if best:
+                return best
+        return {}
+
+    def _nearest(self, cells, worker_loc, secs_waited, kph, parked_name,
+                 stats):
+        ms = self.ms
+        row, col = grid_cell(worker_loc[0], worker_loc[1], self.cell_size)
+        min_row, min_col, max_row, max_col = self.bounds
+        # Number of rings needed to cover all the cells.
+        rings = max(abs(row - min_row), abs(row - max_row),
+                    abs(col - min_col), abs(col - max_col))
+        best = {}
+        for ring in xrange(rings + 1):
+            # Anything in this ring is at least this far away.
+            if best and (ring - 1) * self.cell_km > best['distance']:
+                break
+            # And at most this far, which bounds how long it takes to get
+            # there. Buckets starting after that are all too early.
+            max_distance = (ring + 1) * self.cell_side_km * math.sqrt(2)
+            max_arrival = max(max_distance / kph * 3600 - secs_waited, 0)
+            last_bucket = (ms + max_arrival) // BUCKET_SECONDS
+            for cell in self._ring(row, col, ring):
+                buckets = cells.get(cell)
+                if not buckets:
+                    continue
+                for bucket, items in buckets.items():
+                    if bucket > last_bucket:
+                        stats['early'] = stats.get('early', 0) + len(items)
+                        continue
+                    best = self._check(items, worker_loc, secs_waited, kph,
+                                       parked_name, stats, best)
+                    if not items:
+                        del buckets[bucket]
+                if not buckets:
+                    del cells[cell]
+        return best
+
+    # Check the items of a bucket, return the nearest valid one if it's
+    # nearer than `best`, `best` otherwise.
+    def _check(self, items, worker_loc, secs_waited, kph, parked_name, stats,
+               best):
+        ms = self.ms
+        for id, item in items.items():
+            if item.get('done', False):
+                # Claimed since it was opened.
+                del items[id]
+                stats['claimed'] = stats.get('claimed', 0) + 1
+                continue
+
+            if 'parked_name' in item:
+                now = default_timer()
+                time_passed = now - item.get('parked_last_update', now)
+                if time_passed > MAX_PARKING_IDLE_SECONDS:
+                    item.pop('parked_name', None)
+                    item.pop('parked_last_update', None)
+                elif item['parked_name'] != parked_name:
+                    stats['parked'] = stats.get('parked', 0) + 1
+                    continue
+
+            distance = equi_rect_distance(item['loc'], worker_loc)
+            if best and distance >= best['distance']:
+                continue
+            secs_to_arrival = max(distance / kph * 3600 - secs_waited, 0)
+            if ms + secs_to_arrival < item['start']:
+                stats['early'] = stats.get('early', 0) + 1
+                continue
+            if ms + secs_to_arrival > item['end']:
+                stats['late'] = stats.get('late', 0) + 1
+                continue
+
+            best = {'id': id, 'item': item, 'distance': distance,
+                    'secs_to_arrival': secs_to_arrival}
+        return best
+
+    # Cells of the square ring `ring` cells away from (row, col), clipped to
+    # the bounds.
+    def _ring(self, row, col, ring):
+        min_row, min_col, max_row, max_col = self.bounds
+        if ring == 0:
+            yield (row, col)
+            return
+        first_col = max(col - ring, min_col)
+        last_col = min(col + ring, max_col)
+        for r in (row - ring, row + ring):
+            if min_row <= r <= max_row:
+                for c in xrange(first_col, last_col + 1):
+                    yield (r, c)
+        for r in xrange(max(row - ring + 1, min_row),
+                        min(row + ring - 1, max_row) + 1):
+            for c in (col - ring, col + ring):
+                if min_col <= c <= max_col:
+                    yield (r, c)
+
+    # Take an item out of the grid.
+    def _close(self, id, item):
+        cell = grid_cell(item['loc'][0], item['loc'][1], self.cell_size)
+        cells = self.cells[item['kind']]
+        buckets = cells.get(cell, {})
+        bucket = item['start'] // BUCKET_SECONDS
+        items = buckets.get(bucket)
+        if items is not None:
+            items.pop(id, None)
+            if not items:
+                del buckets[bucket]
+                if not buckets:
+                    del cells[cell]
+
+    # Take an item out of the index.
+    def _remove(self, id, item):
+        self._close(id, item)
+        del self.items[id]
+        self.ended.discard(id)
+        key = (item['kind'], item['step'], item['sp'])
+        if self.by_key.get(key) == id:
+            del self.by_key[key]
+        if item['sp']:
+            ids = self.by_sp[item['sp']]
+            ids.discard(id)
+            if not ids:
+                del self.by_sp[item['sp']]
+
+    def _sort(self):
+        self.queue[:] = sorted(self.items.itervalues(),
+                               key=itemgetter('start'))
+
+    def _extend_bounds(self, loc):
+        row, col = grid_cell(loc[0], loc[1], self.cell_size)
+        if self.bounds is None:
+            self.bounds = (row, col, row, col)
+        else:
+            self.bounds = (min(self.bounds[0], row), min(self.bounds[1], col),
+                           max(self.bounds[2], row), max(self.bounds[3], col))
+
+    # Work out the center and diameter of the bounds, and the smallest and
+    # largest side of a cell in km, used to bound the ring search.
+    def _measure(self):
+        min_row, min_col, max_row, max_col = self.bounds
+        sw = (min_row * self.cell_size, min_col * self.cell_size)
+        ne = ((max_row + 1) * self.cell_size, (max_col + 1) * self.cell_size)
+        self.center = ((sw[0] + ne[0]) / 2, (sw[1] + ne[1]) / 2)
+        self.diameter = equi_rect_distance(sw, ne)
+        max_lat = min(max(abs(sw[0]), abs(ne[0])), 89.0)
+        self.cell_km = (self.cell_size * KM_PER_DEGREE *
+                        math.cos(math.radians(max_lat)))
+        self.cell_side_km = self.cell_size * KM_PER_DEGREE
@@ -0,0 +1,95 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import gzip
+import json
+import logging
+from threading import Lock
+
+log = logging.getLogger(__name__)
+
+# Scans between two flushes of the recording, so a recording cut short by
+# a crash can still be read up to the last flush.
+FLUSH_SCANS = 100
+
+# The fields of a GET_MAP_OBJECTS response parse_map reads. Only these are
+# recorded, which keeps recordings small and free of binary data.
+CELL_FIELDS = ('current_timestamp_ms',)
+WILD_FIELDS = ('encounter_id', 'spawn_point_id', 'latitude', 'longitude',
+               'last_modified_timestamp_ms', 'time_till_hidden_ms')
+NEARBY_FIELDS = ('encounter_id', 'pokemon_id', 'distance_in_meters')
+FORT_FIELDS = ('id', 'type', 'enabled', 'latitude', 'longitude',
+               'last_modified_timestamp_ms', 'active_fort_modifier',
+               'owned_by_team', 'guard_pokemon_id', 'gym_points')
+
+
+def pick(d, fields):
+    return dict((k, d[k]) for k in fields if k in d)
+
+
+# The map cells of a response, with only the fields parse_map reads.
+def compact_cells(response_dict):
+    cells = []
+    for cell in response_dict['responses']['GET_MAP_OBJECTS']['map_cells']:
+        c = pick(cell, CELL_FIELDS)
+        c['wild_pokemons'] = []
+        for p in cell.get('wild_pokemons', []):
+            wild = pick(p, WILD_FIELDS)
+            display = p['pokemon_data'].get('pokemon_display', {})
+            wild['pokemon_data'] = {
+                'pokemon_id': p['pokemon_data']['pokemon_id'],
+                'pokemon_display': pick(display, ('gender', 'form'))}
+            c['wild_pokemons'].append(wild)
+        c['nearby_pokemons'] = [pick(p, NEARBY_FIELDS)
+                                for p in cell.get('nearby_pokemons', [])]
+        c['forts'] = [pick(f, FORT_FIELDS) for f in cell.get('forts', [])]
+        cells.append(c)
+    return cells
+
+
+# Appends the GET_MAP_OBJECTS responses of scans to a gzipped file, one JSON
+# line per scan with the scan location. Shared by the search workers.
+class ScanRecorder(object):
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = Lock()
+        self.file = gzip.open(path, 'ab')
+        self.count = 0
+
+    # Record a response, before parse_map takes it apart.
+    def write(self, step_location, response_dict):
+        try:
+            line = json.dumps({'loc': list(step_location),
+                               'cells': compact_cells(response_dict)},
+                              separators=(',', ':'))
+        except (KeyError, TypeError) as e:
+            log.warning('Not recording a scan at %s: %s', step_location,
+                        repr(e))
+            return
+        with self.lock:
+            self.file.write(line + '\n')
+            self.count += 1
+            if self.count % FLUSH_SCANS == 0:
+                self.file.flush()
+
+    def close(self):
+        with self.lock:
+            self.file.close()
+
+
+# Yield (step_location, response_dict) for the scans of a recording, with
+# the responses in the format parse_map takes.
+def read_scans(path):
+    with gzip.open(path, 'rb') as f:
+        while True:
+            try:
+                line = f.readline()
+            except (IOError, EOFError) as e:
+                log.warning('Recording %s ends early: %s', path, repr(e))
+                return
+            if not line.endswith('\n'):
+                return
+            scan = json.loads(line)
+            yield tuple(scan['loc']), {'responses': {'GET_MAP_OBJECTS': {
+                'status': 1, 'map_cells': scan['cells']}}}
@@ -44,16 +44,13 @@ If implementing a new scheduler, place it before SchedulerFactory, and
 add it to __scheduler_classes
 '''
 
-import itertools
 import logging
 import math
-import geopy
 import json
 import time
 import sys
 from timeit import default_timer
 from threading import Lock
-from copy import deepcopy
 import traceback
 from collections import Counter
 from queue import Empty
@@ -62,8 +59,11 @@ from datetime import datetime, timedelta
 from .transform import get_new_coords
 from .models import (hex_bounds, Pokemon, SpawnPoint, ScannedLocation,
                      ScanSpawnPoint, HashKeys)
-from .utils import now, cur_sec, cellid, equi_rect_distance
+from .utils import now, cur_sec, cellid, date_secs
 from .altitude import get_altitude
+from .hivecache import HiveCache
+from .scanqueue import ScanQueue
+from .spatial import SpatialIndex
 
 log = logging.getLogger(__name__)
 
@@ -304,16 +304,13 @@ class HexSearch(BaseScheduler):
 class HexSearchSpawnpoint(HexSearch):
 
     def _any_spawnpoints_in_range(self, coords, spawnpoints):
-        return any(
-            geopy.distance.distance(coords, x).meters <= 70
-            for x in spawnpoints)
+        return spawnpoints.any_near(coords, 70)
 
     # Extend the generate_locations function to remove locations with no
     # spawnpoints.
     def _generate_locations(self):
         n, e, s, w = hex_bounds(self.scan_location, self.step_limit)
-        spawnpoints = set((d['latitude'], d['longitude'])
-                          for d in Pokemon.get_spawnpoints(s, w, n, e))
+        spawnpoints = SpatialIndex(Pokemon.get_spawnpoints(s, w, n, e))
 
         if len(spawnpoints) == 0:
             log.warning('No spawnpoints found in the specified area!  (Did ' +
@@ -472,7 +469,12 @@ class SpeedScan(HexSearch):
         self.refresh_date = datetime.utcnow() - timedelta(days=1)
         self.next_band_date = self.refresh_date
         self.location_change_date = datetime.utcnow()
-        self.queues = [[]]
+        self.queue_index = ScanQueue()
+        self.queues = [self.queue_index.queue]
+        # Times of the queue items are in seconds since the start of the
+        # hour of base_date.
+        self.base_date = self.refresh_date
+        self.base_ms = 0
         self.queue_version = 0
         self.ready = False
         self.empty_hive = False
@@ -488,6 +490,10 @@ class SpeedScan(HexSearch):
         self.spawn_percent = []
         self.status_message = []
         self.tth_found = 0
+        # Rows of the hive kept in memory, see HiveCache.
+        self.hive_cache = None
+        if args.hive_cache:
+            self.hive_cache = HiveCache(args.hive_cache_flush)
         # Initiate special types.
         self._stat_init()
         self._locks_init()
@@ -504,6 +510,9 @@ class SpeedScan(HexSearch):
     # On location change, empty the current queue and the locations list
     def location_changed(self, scan_location, db_update_queue):
         super(SpeedScan, self).location_changed(scan_location, db_update_queue)
+        if self.hive_cache:
+            # Write out what was scanned at the old location first.
+            self.hive_cache.flush(db_update_queue, force=True)
         self.location_change_date = datetime.utcnow()
         self.locations = self._generate_locations()
         scans = {}
@@ -532,8 +541,8 @@ class SpeedScan(HexSearch):
                      'Doing initial scan.')
         log.info('Found %d spawn points within hex', len(spawnpoints))
 
-        log.info('Doing %s distance calcs to assign spawn points to scans',
-                 "{:,}".format(len(spawnpoints) * len(scans)))
+        log.info('Assigning %d spawn points to %d scans', len(spawnpoints),
+                 len(scans))
         scan_spawn_point = {}
         ScannedLocation.link_spawn_points(scans, initial, spawnpoints,
                                           self.step_distance, scan_spawn_point,
@@ -545,6 +554,9 @@ class SpeedScan(HexSearch):
         else:
             log.info('Spawn points assigned')
 
+        if self.hive_cache:
+            self.hive_cache.load(initial, spawnpoints, scan_spawn_point)
+
     # Generates the list of locations to scan
     # Created a new function, because speed scan requires fixed locations,
     # even when increasing -st. With HexSearch locations, the location of
@@ -583,8 +595,7 @@ class SpeedScan(HexSearch):
 
     def get_overseer_message(self):
         n = 0
-        ms = (datetime.utcnow() - self.refresh_date).total_seconds() + \
-            self.refresh_ms
+        ms = self.queue_secs(datetime.utcnow())
         counter = {
             'TTH': 0,
             'spawn': 0,
@@ -618,9 +629,20 @@ class SpeedScan(HexSearch):
                 self.minutes * 60 or
                 (self.queues == [[]] and not self.empty_hive))
 
+    # Time in the seconds of the queue items.
+    def queue_secs(self, now_date):
+        return (now_date - self.base_date).total_seconds() + self.base_ms
+
+    # Move seconds of an hour to the time of the queue items, in the hour
+    # nearest to now.
+    def queue_time(self, secs, now_date=None):
+        ms = self.queue_secs(now_date or datetime.utcnow())
+        return secs + int(round((ms - secs) / 3600.0)) * 3600
+
     # Function to empty all queues in the queues list
     def empty_queues(self):
-        self.queues = [[]]
+        self.queue_index = ScanQueue()
+        self.queues = [self.queue_index.queue]
 
     # How long to delay since last action
     def delay(self, last_scan_date):
@@ -651,19 +673,35 @@ class SpeedScan(HexSearch):
     # Update the queue, and provide a report on performance of last minutes
     def schedule(self):
         log.info('Refreshing queue')
-        self.ready = False
         now_date = datetime.utcnow()
         self.refresh_date = now_date
-        self.refresh_ms = now_date.minute * 60 + now_date.second
-        self.queue_version += 1
-        old_q = deepcopy(self.queues[0])
+        index = self.queue_index
+        new_queue = not len(index)
+        if new_queue:
+            # New queue, its times are based on the current hour. Workers
+            # have to wait for it.
+            self.ready = False
+            self.base_date = now_date
+            self.base_ms = date_secs(now_date)
+            self.queue_version += 1
+            index = ScanQueue()
+
+        # Times of new items are based on the current hour, move them to
+        # the hour of the queue.
+        ms = self.queue_secs(now_date)
+        now_secs = date_secs(now_date)
+        offset = self.queue_time(now_secs, now_date) - now_secs
         queue = []
 
         # Measure the time it takes to refresh the queue
         start = time.time()
 
         # prefetch all scanned locations
-        scanned_locations = ScannedLocation.get_by_cellids(self.scans.keys())
+        if self.hive_cache:
+            scanned_locations = self.hive_cache.get_scanned_locations()
+        else:
+            scanned_locations = ScannedLocation.get_by_cellids(
+                self.scans.keys())
 
         # extract all spawnpoints into a dict with spawnpoint
         # id -> spawnpoint for easy access later
@@ -672,6 +710,9 @@ class SpeedScan(HexSearch):
                 self.scans.keys(), self.location_change_date))
         sp_by_id = {}
         for sps in cell_to_linked_spawn_points.itervalues():
+            if self.hive_cache:
+                # The database may not have the latest timings yet.
+                self.hive_cache.freshen_spawn_points(sps)
             for sp in sps:
                 sp_by_id[sp['id']] = sp
 
@@ -682,18 +723,34 @@ class SpeedScan(HexSearch):
                                           self.args.spawn_delay,
                                           cell_to_linked_spawn_points,
                                           sp_by_id)
+        for item in queue:
+            item['start'] += offset
+            item['end'] += offset
+
+        if new_queue:
+            added, updated = index.merge(queue)
+            ended = []
+            self.queue_index = index
+            self.queues[0] = index.queue
+        else:
+            # Roll the queue forward: add the items that are new, and retire
+            # the ones that have ended. Items already in the queue keep
+            # their ids, so workers scanning them aren't affected.
+            with self.lock_next_item:
+                added, updated = index.merge(queue)
+                ended = index.retire(ms)
         end = time.time()
-
-        queue.sort(key=itemgetter('start'))
-        self.queues[0] = queue
         self.ready = True
-        log.info('New queue created with %d entries in %f seconds', len(queue),
-                 (end - start))
+        log.info('Queue refreshed with %d new and %d updated entries, %d ' +
+                 'entries in total, in %f seconds', added, updated,
+                 len(self.queue_index), (end - start))
         # Avoiding refreshing the Queue when the initial scan is complete, and
         # there are no spawnpoints in the hive.
-        if len(queue) == 0:
+        if len(self.queue_index) == 0:
             self.empty_hive = True
-        if old_q:
+        # Statistics are based on the items that ended since the last
+        # refresh.
+        if ended:
             # Enclosing in try: to avoid divide by zero exceptions from
             # killing overseer
             try:
@@ -701,7 +758,7 @@ class SpeedScan(HexSearch):
                 # Possible 'done' values are 'Missed', 'Scanned', None, or
                 # number
                 Not_none_list = filter(lambda e: e.get(
-                    'done', None) is not None, old_q)
+                    'done', None) is not None, ended)
                 Missed_list = filter(lambda e: e.get(
                     'done', None) == 'Missed', Not_none_list)
                 Scanned_list = filter(lambda e: e.get(
@@ -839,147 +896,65 @@ class SpeedScan(HexSearch):
     def next_item(self, status):
         # Thread safety: don't let multiple threads get the same "best item".
         with self.lock_next_item:
-            # Score each item in the queue by # of due spawns or scan time
-            # bands can be filled.
+            # Pick the nearest reachable item of the best kind from the
+            # queue index, see ScanQueue.
 
             while not self.ready:
                 time.sleep(1)
 
             now_date = datetime.utcnow()
-            q = self.queues[0]
-            ms = ((now_date - self.refresh_date).total_seconds() +
-                  self.refresh_ms)
-            best = {}
+            index = self.queue_index
+            q = index.queue
+            ms = self.queue_secs(now_date)
             worker_loc = [status['latitude'], status['longitude']]
             last_action = status['last_scan_date']
+            secs_waited = (now_date - last_action).total_seconds()
 
-            # Logging.
-            log.debug('Enumerating %s scan locations in queue.',
-                      len(q))
+            # Open the items this worker could reach in time, and mark the
+            # ones that have timed out as Missed.
+            count_missed = index.advance(
+                ms, index.horizon(worker_loc, self.args.kph))
 
             # Keep some stats for logging purposes. If something goes wrong,
             # we can track what happened.
-            count_claimed = 0
-            count_parked = 0
-            count_missed = 0
-            count_fresh_band = 0
-            count_early = 0
-            count_late = 0
-            min_parked_time_remaining = 0
+            stats = {}
             min_fresh_band_time_remaining = 0
 
-            # Check all scan locations possible in the queue.
-            for i, item in enumerate(q):
-                # If already claimed by another worker or done, pass.
-                if item.get('done', False):
-                    count_claimed += 1
-                    continue
-
-                # If the item is parked by a different thread (or by a
-                # different account, which should be on that one thread),
-                # pass.
-                our_parked_name = status['username']
-                if 'parked_name' in item:
-                    # We use 'parked_last_update' to determine when the
-                    # last time was since the thread passed the item with the
-                    # same thread name & username. If it's been too long, unset
-                    # the park so another worker can pick it up.
-                    now = default_timer()
-                    max_parking_idle_seconds = 3 * 60
-                    time_passed = now - item.get('parked_last_update', now)
-                    time_remaining = (max_parking_idle_seconds - time_passed)
-
-                    # Update logging stats.
-                    if not min_parked_time_remaining:
-                        min_parked_time_remaining = time_remaining
-                    elif time_remaining < min_parked_time_remaining:
-                        min_parked_time_remaining = time_remaining
-
-                    # Check parked status.
-                    if (time_passed > max_parking_idle_seconds):
-                        # Unpark & don't skip it.
-                        item.pop('parked_name', None)
-                        item.pop('parked_last_update', None)
-                    else:
-                        # Still parked and not our item. Skip it.
-                        if item.get('parked_name') != our_parked_name:
-                            count_parked += 1
-                            continue
-
-                # If already timed out, mark it as Missed and check next.
-                if ms > item['end']:
-                    count_missed += 1
-                    item['done'] = 'Missed' if not item.get(
-                        'done', False) else item['done']
-                    continue
-
-                # If we just did a fresh band recently, wait a few seconds to
-                # space out the band scans.
-                if now_date < self.next_band_date:
-                    count_fresh_band += 1
-
-                    # Update logging stats.
-                    band_time_remaining = (self.next_band_date - now_date)
-                    if not min_fresh_band_time_remaining:
-                        min_fresh_band_time_remaining = band_time_remaining
-                    elif band_time_remaining < min_fresh_band_time_remaining:
-                        min_fresh_band_time_remaining = band_time_remaining
-
-                    continue
-
-                # If we are going to get there before it starts then ignore.
-                loc = item['loc']
-                distance = equi_rect_distance(loc, worker_loc)
-                secs_to_arrival = distance / self.args.kph * 3600
-                secs_waited = (now_date - last_action).total_seconds()
-                secs_to_arrival = max(secs_to_arrival - secs_waited, 0)
-                if ms + secs_to_arrival < item['start']:
-                    count_early += 1
-                    continue
-
-                # If we can't make it there before it disappears, don't bother
-                # trying.
-                if ms + secs_to_arrival > item['end']:
-                    count_late += 1
-                    continue
-
-                # Bands are top priority to find new spawns first
-                score = 1e12 if item['kind'] == 'band' else (
-                    1e6 if item['kind'] == 'TTH' else 1)
-
-                # For spawns, score is purely based on how close they are to
-                # last worker position
-                score = score / (distance + .01)
-
-                if score > best.get('score', 0):
-                    best = {'score': score, 'i': i,
-                            'secs_to_arrival': secs_to_arrival}
+            # If we just did a fresh band recently, wait a few seconds to
+            # space out the band scans.
+            if now_date < self.next_band_date:
+                best = {}
+                min_fresh_band_time_remaining = (self.next_band_date -
+                                                 now_date)
+            else:
+                # Nearest reachable item of the best kind: bands are top
+                # priority to find new spawns first, then TTH searches and
+                # spawns.
+                best = index.best(worker_loc, secs_waited, self.args.kph,
+                                  status['username'], stats)
+                if best:
+                    item = best.pop('item')
                     best.update(item)
 
             # If we didn't find one, log it.
             if not best:
-                log.debug('Enumerating queue found no best location, with'
-                          + ' %s claimed, %s parked, %s missed, %s fresh band'
-                          + " skips, %s missed because we're early, %s because"
-                          + " we're too late. Minimum %s time remaining on"
-                          + ' parked item, and %s time remaining for next'
-                          + ' fresh band.',
-                          count_claimed,
-                          count_parked,
+                log.debug('Searching queue found no best location, with'
+                          + ' %s claimed, %s parked, %s missed, %s skipped'
+                          + " because we're early, %s because we're too"
+                          + ' late. %s time remaining for next fresh band.',
+                          stats.get('claimed', 0),
+                          stats.get('parked', 0),
                           count_missed,
-                          count_fresh_band,
-                          count_early,
-                          count_late,
-                          min_parked_time_remaining,
+                          stats.get('early', 0),
+                          stats.get('late', 0),
                           min_fresh_band_time_remaining)
             else:
-                log.debug('Enumerating queue found best location: %s.',
+                log.debug('Searching queue found best location: %s.',
                           repr(best))
 
-            loc = best.get('loc', [])
             step = best.get('step', 0)
             secs_to_arrival = best.get('secs_to_arrival', 0)
-            i = best.get('i', 0)
+            id = best.get('id')
             st = best.get('start', 0)
             end = best.get('end', 0)
 
@@ -1000,23 +975,19 @@ class SpeedScan(HexSearch):
                             'location.').format(step)
             }
 
-            try:
-                item = q[i]
-            except IndexError:
+            if not q:
                 messages['wait'] = ('Search aborting.'
                                     + ' Overseer refreshing queue.')
                 return -1, 0, 0, 0, messages, 0
 
-            if best.get('score', 0) == 0:
-                if count_late > 0:
+            if not best:
+                if stats.get('late', 0) > 0:
                     messages['wait'] = ('Not able to reach any scan'
                                         + ' under the speed limit.')
                 return -1, 0, 0, 0, messages, 0
 
-            distance = equi_rect_distance(loc, worker_loc)
-            if (distance >
-                    (now_date - last_action).total_seconds() *
-                    self.args.kph / 3600):
+            distance = best['distance']
+            if distance > secs_waited * self.args.kph / 3600:
                 # Flag item as "parked" by a specific thread, because
                 # we're waiting for it. This will avoid all threads "walking"
                 # to the same item.
@@ -1058,7 +1029,7 @@ class SpeedScan(HexSearch):
 
             # Mark scanned
             item['done'] = 'Scanned'
-            status['index_of_queue_item'] = i
+            status['queue_item_id'] = id
             status['queue_version'] = self.queue_version
 
             messages['search'] = 'Scanning step {} for a {}.'.format(
@@ -1069,14 +1040,16 @@ class SpeedScan(HexSearch):
         if parsed:
             # Record delay between spawn time and scanning for statistics
             # This now holds the actual time of scan in seconds
-            scan_secs = parsed['scan_secs']
-
-            # It seems that the best solution is not to interfere with the
-            # item if the queue has been refreshed since scanning
-            if status['queue_version'] != self.queue_version:
-                log.info('Step item has changed since queue refresh')
+            scan_secs = self.queue_time(parsed['scan_secs'])
+
+            # Items keep their id across queue refreshes, until they're
+            # retired or the queue is replaced after a location change.
+            item = None
+            if status['queue_version'] == self.queue_version:
+                item = self.queue_index.get(status['queue_item_id'])
+            if item is None:
+                log.info('Step item has been removed from the queue')
                 return
-            item = self.queues[0][status['index_of_queue_item']]
             safety_buffer = item['end'] - scan_secs
             start_secs = item['start']
             if item['kind'] == 'spawn':
@@ -1098,7 +1071,8 @@ class SpeedScan(HexSearch):
                     log.info('Step %d failed scan for %d times! Giving up...',
                              item['step'], self.args.bad_scan_retry + 1)
                 else:
-                    item['done'] = None
+                    with self.lock_next_item:
+                        self.queue_index.release(status['queue_item_id'])
                     log.info('Putting back step %d in queue', item['step'])
             else:
                 # Scan returned data
@@ -1124,8 +1098,9 @@ class SpeedScan(HexSearch):
                 # For existing spawn points, if in any other queue items, mark
                 # 'scanned'
                 for sp_id in parsed['sp_id_list']:
-                    for item in self.queues[0]:
-                        if (sp_id == item.get('sp', None) and
+                    for id in list(self.queue_index.items_for_sp(sp_id)):
+                        item = self.queue_index.get(id)
+                        if (item is not None and
                                 item.get('done', None) is None and
                                 scan_secs > item['start'] and
                                 scan_secs < item['end']):
@@ -1153,11 +1128,23 @@ class SchedulerFactory():
             "The requested scheduler has not been implemented")
 
 
-# The KeyScheduler returns a scheduler that cycles through the given hash
-# server keys.
+# The KeyScheduler hands out the hash server keys by how many requests they
+# have left in their current period, from what the hash server reported
+# after each request (see update). A key's weight is what it has left over
+# the seconds until its period resets, so keys about to reset use up their
+# requests first, and small keys don't run out while big ones sit idle.
+# Expired keys are skipped, and keys only go over their limit once all of
+# them are out of requests. Keys the hash server didn't report on yet are
+# tried one request at a time.
 class KeyScheduler(object):
 
-    def __init__(self, keys, db_updates_queue):
+    # Seconds between two logs of the utilization of the keys.
+    stats_interval = 60
+    # Length of a rate period, for keys whose period reset since they were
+    # last reported on.
+    period_seconds = 60
+
+    def __init__(self, keys, db_updates_queue, clock=time.time):
         self.keys = {}
         for key in keys:
             self.keys[key] = {
@@ -1167,8 +1154,21 @@ class KeyScheduler(object):
                 'expires': None
             }
 
-        self.key_cycle = itertools.cycle(keys)
+        self.key_list = list(keys)
         self.curr_key = ''
+        self.clock = clock
+        self.lock = Lock()
+        # End of the rate period and expiration reported for each key, as
+        # unix timestamps, and how many requests were handed out but not
+        # given back with done() yet.
+        self.usage = dict((key, {
+            'period': None,
+            'expiration': None,
+            'pending': 0,
+            'handed': 0
+        }) for key in keys)
+        self.last_stats = clock()
+        self.last_exhausted = 0
 
         hashkeys = self.keys
         for key in hashkeys:
@@ -1182,5 +1182,138 @@ class KeyScheduler(object):
         return self.curr_key
 
     def next(self):
-        self.curr_key = self.key_cycle.next()
-        return self.curr_key
+        exhausted = False
+        with self.lock:
+            now = self.clock()
+            best = None
+            best_weight = 0
+            for key in self.key_list:
+                weight = self._weight(key, now)
+                if weight > best_weight:
+                    best, best_weight = key, weight
+            if best is None:
+                best = self._least_used(now)
+                if now - self.last_exhausted > self.stats_interval:
+                    self.last_exhausted = now
+                    exhausted = True
+
+            usage = self.usage[best]
+            usage['pending'] += 1
+            usage['handed'] += 1
+            self.curr_key = best
+
+        if exhausted:
+            log.warning('All hash keys are out of requests for this ' +
+                        'period, going over the limit of %s.', best)
+        return best
+
+    # Requests per second a key has left until its period resets, 0 if it
+    # has none left or expired.
+    def _weight(self, key, now):
+        key_instance = self.keys[key]
+        usage = self.usage[key]
+        if usage['expiration'] is not None and usage['expiration'] <= now:
+            return 0
+        if not key_instance['maximum']:
+            return 0 if usage['pending'] else float('inf')
+
+        if usage['period'] is None or usage['period'] <= now:
+            left = key_instance['maximum'] - usage['pending']
+            seconds = self.period_seconds
+        else:
+            left = key_instance['remaining'] - usage['pending']
+            seconds = usage['period'] - now
+        if left <= 0:
+            return 0
+        return left / max(float(seconds), 1.0)
+
+    # The key to use when none has requests left: the first to reset, then
+    # the one with the fewest requests in flight. Expired keys only when
+    # all of them are.
+    def _least_used(self, now):
+        keys = [key for key in self.key_list
+                if self.usage[key]['expiration'] is None or
+                self.usage[key]['expiration'] > now] or self.key_list
+
+        def order(key):
+            usage = self.usage[key]
+            period = usage['period']
+            if period is None or period <= now:
+                period = now
+            return (period, usage['pending'])
+
+        return min(keys, key=order)
+
+    # Give back a key next() handed out, once the requests made with it are
+    # done. Every next() needs a done(), however the requests went.
+    def done(self, key):
+        with self.lock:
+            if key in self.usage:
+                usage = self.usage[key]
+                usage['pending'] = max(0, usage['pending'] - 1)
+
+    # Take in the status the hash server sent back for a request with `key`,
+    # as in HashServer.status. The status is shared by all the threads, it's
+    # only taken in when it was last set by a request with this key.
+    def update(self, key, status):
+        stats = None
+        with self.lock:
+            if key not in self.keys or status.get('token', None) != key:
+                return
+            key_instance = self.keys[key]
+            usage = self.usage[key]
+            period = status.get('period', None)
+            if (period is not None and usage['period'] is not None and
+                    period < usage['period']):
+                # A late report from the previous period.
+                return
+            usage['period'] = period
+
+            key_instance['remaining'] = status.get('remaining', 0)
+            key_instance['maximum'] = status.get('maximum', 0)
+            used = key_instance['maximum'] - key_instance['remaining']
+            if key_instance['peak'] < used:
+                key_instance['peak'] = used
+
+            expires = status.get('expiration', None)
+            if expires is not None:
+                usage['expiration'] = expires
+                if key_instance['expires'] is None:
+                    key_instance['expires'] = datetime.utcfromtimestamp(
+                        expires)
+
+            key_instance['last_updated'] = datetime.utcnow()
+
+            now = self.clock()
+            if now - self.last_stats >= self.stats_interval:
+                self.last_stats = now
+                stats = self._utilization()
+
+        log.debug('Hash key %s has %s/%s RPM left.', key,
+                  key_instance['remaining'], key_instance['maximum'])
+        if stats:
+            log.info('Hash key utilization: %s.', ', '.join(
+                '{} {:.0%} of {} RPM, {} requests'.format(
+                    key, s['utilization'], s['maximum'], s['handed'])
+                for key, s in sorted(stats.items())))
+
+    # Per key: requests used in the current period out of its maximum,
+    # and requests handed out since the start.
+    def utilization(self):
+        with self.lock:
+            return self._utilization()
+
+    def _utilization(self):
+        utilization = {}
+        for key in self.key_list:
+            key_instance = self.keys[key]
+            maximum = key_instance['maximum']
+            used = maximum - key_instance['remaining']
+            utilization[key] = {
+                'used': used,
+                'maximum': maximum,
+                'utilization': used / float(maximum) if maximum else 0.0,
+                'handed': self.usage[key]['handed'],
+                'pending': self.usage[key]['pending']
+            }
+        return utilization
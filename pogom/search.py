@@ -44,17 +44,20 @@ from pgoapi import utilities as util
 from pgoapi.hash_server import (HashServer, BadHashRequestException,
                                 HashingOfflineException)
 from .models import (parse_map, GymDetails, parse_gyms, MainWorker,
-                     WorkerStatus, HashKeys)
+                     WorkerStatus, HashKeys, RoundTripCounter)
 from .utils import now, clear_dict_response
 from .transform import get_new_coords, jitter_location
 from .account import (setup_api, check_login, get_tutorial_state,
-                      complete_tutorial, AccountSet)
+                      complete_tutorial, AccountSet, LOGIN_WAIT)
 from .captcha import captcha_overseer_thread, handle_captcha
 from .proxy import get_new_proxy
+from .scanrecord import ScanRecorder
+from .workerloop import BlockingCall, Call, Sleep, WorkerLoop, run_in_thread
 
 log = logging.getLogger(__name__)
 
 loginDelayLock = Lock()
+next_login = 0
 
 
 # Thread to handle user input.
@@ -190,13 +193,14 @@ def status_printer(threadStatus, search_items_queue_array, db_updates_queue,
 
             # How pretty.
             status = '{:10} | {:5} | {:' + str(userlen) + '} | {:' + str(
-                proxylen) + '} | {:7} | {:6} | {:5} | {:7} | {:8} | {:10}'
+                proxylen) + '} | {:7} | {:6} | {:5} | {:7} | {:8} | {:6} ' + \
+                '| {:10}'
 
             # Print the worker status.
             status_text.append(status.format('Worker ID', 'Start', 'User',
                                              'Proxy', 'Success', 'Failed',
                                              'Empty', 'Skipped', 'Captchas',
-                                             'Message'))
+                                             'DB Ops', 'Message'))
             for item in sorted(threadStatus):
                 if(threadStatus[item]['type'] == 'Worker'):
                     current_line += 1
@@ -219,6 +223,7 @@ def status_printer(threadStatus, search_items_queue_array, db_updates_queue,
                         threadStatus[item]['noitems'],
                         threadStatus[item]['skip'],
                         threadStatus[item]['captcha'],
+                        threadStatus[item]['round_trips'],
                         threadStatus[item]['message']))
 
         elif display_type[0] == 'failedaccounts':
@@ -248,10 +253,11 @@ def status_printer(threadStatus, search_items_queue_array, db_updates_queue,
             status_text.append(
                 '----------------------------------------------------------')
 
-            status = '{:21} | {:9} | {:9} | {:9}'
+            status = '{:21} | {:9} | {:9} | {:9} | {:5}'
             status_text.append(status.format('Key', 'Remaining', 'Maximum',
-                                             'Peak'))
+                                             'Peak', 'Usage'))
             if hash_key is not None:
+                utilization = key_scheduler.utilization()
                 for key in hash_key:
                     key_instance = key_scheduler.keys[key]
                     key_text = key
@@ -263,7 +269,8 @@ def status_printer(threadStatus, search_items_queue_array, db_updates_queue,
                         key_text,
                         key_instance['remaining'],
                         key_instance['maximum'],
-                        key_instance['peak']))
+                        key_instance['peak'],
+                        '{:.0%}'.format(utilization[key]['utilization'])))
 
         # Print the status_text for the current screen.
         status_text.append((
@@ -341,7 +348,7 @@ def worker_status_db_thread(threads_status, name, db_updates_queue):
 
 # The main search loop that keeps an eye on the over all process.
 def search_overseer_thread(args, new_location_queue, pause_bit, heartb,
-                           db_updates_queue, wh_queue):
+                           db_updates_queue, wh_queue, parse_pool=None):
 
     log.info('Search overseer starting...')
 
@@ -396,6 +403,12 @@ def search_overseer_thread(args, new_location_queue, pause_bit, heartb,
         'scheduler_status': {'tth_found': 0}
     }
 
+    # Record the responses of all workers to one file.
+    scan_recorder = None
+    if args.record_scans:
+        log.info('Recording scans to %s.', args.record_scans)
+        scan_recorder = ScanRecorder(args.record_scans)
+
     # Create the key scheduler.
     if args.hash_key:
         log.info('Enabling hashing key scheduler...')
@@ -438,8 +451,15 @@ def search_overseer_thread(args, new_location_queue, pause_bit, heartb,
         t.daemon = True
         t.start()
 
-    # Create specified number of search_worker_thread.
-    log.info('Starting search worker threads...')
+    # Create specified number of search workers.
+    worker_loop = None
+    if args.worker_engine == 'loop':
+        log.info('Starting search worker loop with %d threads...',
+                 args.worker_engine_threads)
+        worker_loop = WorkerLoop(args.worker_engine_threads)
+        worker_loop.start()
+    else:
+        log.info('Starting search worker threads...')
     log.info('Configured scheduler is %s.', args.scheduler)
     for i in range(0, args.workers):
         log.debug('Starting search worker thread %d...', i)
@@ -467,19 +487,25 @@ def search_overseer_thread(args, new_location_queue, pause_bit, heartb,
             'noitems': 0,
             'skip': 0,
             'captcha': 0,
+            'round_trips': 0,
             'username': '',
             'proxy_display': proxy_display,
             'proxy_url': proxy_url,
         }
 
-        t = Thread(target=search_worker_thread,
-                   name='search-worker-{}'.format(i),
-                   args=(args, account_queue, account_sets, account_failures,
-                         account_captchas, search_items_queue, pause_bit,
-                         threadStatus[workerId], db_updates_queue,
-                         wh_queue, scheduler, key_scheduler))
-        t.daemon = True
-        t.start()
+        worker = search_worker(args, account_queue, account_sets,
+                               account_failures, account_captchas,
+                               search_items_queue, pause_bit,
+                               threadStatus[workerId], db_updates_queue,
+                               wh_queue, scheduler, key_scheduler,
+                               scan_recorder, parse_pool)
+        if worker_loop:
+            worker_loop.add(worker)
+        else:
+            t = Thread(target=run_in_thread, name='search-worker-{}'.format(i),
+                       args=(worker,))
+            t.daemon = True
+            t.start()
 
     if not args.no_version_check:
         log.info('Enabling new API force Watchdog.')
@@ -751,18 +777,30 @@ def generate_hive_locations(current_location, step_distance,
     return results
 
 
-def search_worker_thread(args, account_queue, account_sets, account_failures,
-                         account_captchas, search_items_queue, pause_bit,
-                         status, dbq, whq, scheduler, key_scheduler):
+# A search worker, for one of the engines in workerloop.py: what would block
+# is yielded as a Sleep or a Call.
+def search_worker(args, account_queue, account_sets, account_failures,
+                  account_captchas, search_items_queue, pause_bit, status,
+                  dbq, whq, scheduler, key_scheduler, scan_recorder=None,
+                  parse_pool=None):
 
     log.debug('Search worker thread starting...')
 
+    # Hash key handed out for the current scan. It's given back with
+    # key_scheduler.done() once the scan is over, however it ended.
+    key = None
+
     # The outer forever loop restarts only when the inner one is
     # intentionally exited - which should only be done when the worker
     # is failing too often, and probably banned.
     # This reinitializes the API and grabs a new account from the queue.
     while True:
         try:
+            # The last scan ended with an exception or a captcha.
+            if key:
+                key_scheduler.done(key)
+                key = None
+
             # Force storing of previous worker info to keep consistency.
             if 'starttime' in status:
                 dbq.put((WorkerStatus, {0: WorkerStatus.db_format(status)}))
@@ -774,16 +812,22 @@ def search_worker_thread(args, account_queue, account_sets, account_failures,
 
             # Make sure the scheduler is done for valid locations.
             while not scheduler.ready:
-                time.sleep(1)
+                yield Sleep(1)
 
             status['message'] = ('Waiting to get new account from the'
                                  + ' queue...')
             log.info(status['message'])
 
             # Get an account.
-            account = account_queue.get()
-            status.update(WorkerStatus.get_worker(
-                account['username'], scheduler.scan_location))
+            while True:
+                try:
+                    account = account_queue.get_nowait()
+                    break
+                except Empty:
+                    yield Sleep(1)
+            status.update((yield Call(WorkerStatus.get_worker,
+                                      account['username'],
+                                      scheduler.scan_location)))
             status['message'] = 'Switching to account {}.'.format(
                 account['username'])
             log.info(status['message'])
@@ -795,7 +839,7 @@ def search_worker_thread(args, account_queue, account_sets, account_failures,
             status['skip'] = 0
             status['captcha'] = 0
 
-            stagger_thread(args)
+            yield Sleep(login_delay(args))
 
             # Sleep when consecutive_fails reaches max_failures, overall fails
             # for stat purposes.
@@ -805,14 +849,19 @@ def search_worker_thread(args, account_queue, account_sets, account_failures,
             # for stat purposes.
             consecutive_noitems = 0
 
-            api = setup_api(args, status)
+            api = yield Call(setup_api, args, status)
 
             # The forever loop for the searches.
             while True:
 
+                # The last scan ended early, e.g. without a response.
+                if key:
+                    key_scheduler.done(key)
+                    key = None
+
                 while pause_bit.is_set():
                     status['message'] = 'Scanning paused.'
-                    time.sleep(2)
+                    yield Sleep(2)
 
                 # If this account has been messing up too hard, let it rest.
                 if ((args.max_failures > 0) and
@@ -875,17 +924,22 @@ def search_worker_thread(args, account_queue, account_sets, account_failures,
                                                  'reason': 'rest interval'})
                         break
 
-                # Grab the next thing to search (when available).
+                # Grab the next thing to search (when available). The
+                # overseer refills an empty queue, where next_item would
+                # block.
+                while (isinstance(scheduler.queues[0], Queue) and
+                       scheduler.queues[0].empty()):
+                    yield Sleep(1)
                 step, step_location, appears, leaves, messages, wait = (
-                    scheduler.next_item(status))
+                    yield Call(scheduler.next_item, status))
                 status['message'] = messages['wait']
                 # The next_item will return the value telling us how long
                 # to sleep. This way the status can be updated
-                time.sleep(wait)
+                yield Sleep(wait)
 
                 # Using step as a flag for no valid next location returned.
                 if step == -1:
-                    time.sleep(scheduler.delay(status['last_scan_date']))
+                    yield Sleep(scheduler.delay(status['last_scan_date']))
                     continue
 
                 # Too soon?
@@ -901,7 +955,7 @@ def search_worker_thread(args, account_queue, account_sets, account_failures,
                         if first_loop:
                             log.info(status['message'])
                             first_loop = False
-                        time.sleep(1)
+                        yield Sleep(1)
                     if paused:
                         scheduler.task_done(status)
                         continue
@@ -931,8 +985,10 @@ def search_worker_thread(args, account_queue, account_sets, account_failures,
 
                 # Ok, let's get started -- check our login status.
                 status['message'] = 'Logging in...'
-                check_login(args, account, api, step_location,
-                            status['proxy_url'])
+                if (yield Call(check_login, args, account, api,
+                               step_location, status['proxy_url'],
+                               wait=False)):
+                    yield Sleep(LOGIN_WAIT)
 
                 # Only run this when it's the account's first login, after
                 # check_login().
@@ -941,13 +997,15 @@ def search_worker_thread(args, account_queue, account_sets, account_failures,
 
                     # Check tutorial completion.
                     if args.complete_tutorial:
-                        tutorial_state = get_tutorial_state(api, account)
+                        tutorial_state = yield BlockingCall(
+                            get_tutorial_state, api, account)
 
                         if not all(x in tutorial_state
                                    for x in (0, 1, 3, 4, 7)):
                             log.info('Completing tutorial steps for %s.',
                                      account['username'])
-                            complete_tutorial(api, account, tutorial_state)
+                            yield BlockingCall(complete_tutorial, api,
+                                               account, tutorial_state)
                         else:
                             log.info('Account %s already completed tutorial.',
                                      account['username'])
@@ -959,7 +1017,8 @@ def search_worker_thread(args, account_queue, account_sets, account_failures,
 
                 # Make the actual request.
                 scan_date = datetime.utcnow()
-                response_dict = map_request(api, step_location, args.no_jitter)
+                response_dict = yield Call(map_request, api, step_location,
+                                           args.no_jitter)
                 status['last_scan_date'] = datetime.utcnow()
 
                 # Record the time and the place that the worker made the
@@ -974,30 +1033,49 @@ def search_worker_thread(args, account_queue, account_sets, account_failures,
                     consecutive_fails += 1
                     status['message'] = messages['invalid']
                     log.error(status['message'])
-                    time.sleep(scheduler.delay(status['last_scan_date']))
+                    yield Sleep(scheduler.delay(status['last_scan_date']))
                     continue
 
                 # Got the response, check for captcha, parse it out, then send
                 # todo's to db/wh queues.
                 try:
-                    captcha = handle_captcha(args, status, api, account,
-                                             account_failures,
-                                             account_captchas, whq,
-                                             response_dict, step_location)
+                    captcha = yield BlockingCall(
+                        handle_captcha, args, status, api, account,
+                        account_failures, account_captchas, whq,
+                        response_dict, step_location)
                     if captcha is not None and captcha:
                         # Make another request for the same location
                         # since the previous one was captcha'd.
                         scan_date = datetime.utcnow()
-                        response_dict = map_request(api, step_location,
-                                                    args.no_jitter)
+                        response_dict = yield Call(map_request, api,
+                                                   step_location,
+                                                   args.no_jitter)
                     elif captcha is not None:
                         account_queue.task_done()
-                        time.sleep(3)
+                        yield Sleep(3)
                         break
 
-                    parsed = parse_map(args, response_dict, step_location,
-                                       dbq, whq, key_scheduler, api, status,
-                                       scan_date, account, account_sets)
+                    # Before parse_map takes the response apart.
+                    if scan_recorder:
+                        yield Call(scan_recorder.write, step_location,
+                                   response_dict)
+
+                    round_trips = RoundTripCounter.count()
+                    hive_cache = getattr(scheduler, 'hive_cache', None)
+                    if parse_pool:
+                        parsed = yield Call(parse_pool.parse, args,
+                                            response_dict, step_location, dbq,
+                                            whq, scan_date)
+                    else:
+                        parsed = yield Call(parse_map, args, response_dict,
+                                            step_location, dbq, whq,
+                                            key_scheduler, api, status,
+                                            scan_date, account, account_sets,
+                                            hive_cache)
+                    if hive_cache:
+                        hive_cache.flush(dbq)
+                    status['round_trips'] = (RoundTripCounter.count() -
+                                             round_trips)
                     del response_dict
                     scheduler.task_done(status, parsed)
                     if parsed['count'] > 0:
@@ -1040,7 +1118,8 @@ def search_worker_thread(args, account_queue, account_sets, account_failures,
                             # Check if we already have details on this gym.
                             # Get them if not.
                             try:
-                                record = GymDetails.get(gym_id=gym['gym_id'])
+                                record = yield Call(GymDetails.get,
+                                                    gym_id=gym['gym_id'])
                             except GymDetails.DoesNotExist as e:
                                 gyms_to_update[gym['gym_id']] = gym
                                 continue
@@ -1078,8 +1157,9 @@ def search_worker_thread(args, account_queue, account_sets, account_failures,
                                 'location {:6f},{:6f}...').format(
                                     current_gym, len(gyms_to_update),
                                     step_location[0], step_location[1])
-                            time.sleep(random.random() + 2)
-                            response = gym_request(api, step_location, gym)
+                            yield Sleep(random.random() + 2)
+                            response = yield Call(gym_request, api,
+                                                  step_location, gym)
 
                             # Make sure the gym was in range. (Sometimes the
                             # API gets cranky about gyms that are ALMOST 1km
@@ -1106,41 +1186,16 @@ def search_worker_thread(args, account_queue, account_sets, account_failures,
                         log.debug(status['message'])
 
                         if gym_responses:
-                            parse_gyms(args, gym_responses,
+                            yield Call(parse_gyms, args, gym_responses,
                                        whq, dbq)
                             del gym_responses
 
                 # Update hashing key stats in the database based on the values
                 # reported back by the hashing server.
-                if args.hash_key:
-                    key = HashServer.status.get('token', None)
-                    key_instance = key_scheduler.keys[key]
-                    key_instance['remaining'] = HashServer.status.get(
-                        'remaining', 0)
-
-                    key_instance['maximum'] = (
-                        HashServer.status.get('maximum', 0))
-
-                    usage = (
-                        key_instance['maximum'] -
-                        key_instance['remaining'])
-
-                    if key_instance['peak'] < usage:
-                        key_instance['peak'] = usage
-
-                    if key_instance['expires'] is None:
-                        expires = HashServer.status.get(
-                            'expiration', None)
-
-                        if expires is not None:
-                            expires = datetime.utcfromtimestamp(expires)
-                            key_instance['expires'] = expires
-
-                    key_instance['last_updated'] = datetime.utcnow()
-
-                    log.debug('Hash key %s has %s/%s RPM left.', key,
-                              key_instance['remaining'],
-                              key_instance['maximum'])
+                if key:
+                    key_scheduler.update(key, HashServer.status)
+                    key_scheduler.done(key)
+                    key = None
 
                 # Delay the desired amount after "scan" completion.
                 delay = scheduler.delay(status['last_scan_date'])
@@ -1151,7 +1206,7 @@ def search_worker_thread(args, account_queue, account_sets, account_failures,
                         '%H:%M:%S',
                         time.localtime(time.time() + args.scan_delay)))
                 log.info(status['message'])
-                time.sleep(delay)
+                yield Sleep(delay)
 
         # Catch any process exceptions, log them, and continue the thread.
         except Exception as e:
@@ -1166,7 +1221,7 @@ def search_worker_thread(args, account_queue, account_sets, account_failures,
             account_failures.append({'account': account,
                                      'last_fail_time': now(),
                                      'reason': 'exception'})
-            time.sleep(args.scan_delay)
+            yield Sleep(args.scan_delay)
 
 
 def upsertKeys(keys, key_scheduler, db_updates_queue):
@@ -1265,13 +1320,17 @@ def calc_distance(pos1, pos2):
     return d
 
 
-# Delay each thread start time so that logins occur after delay.
-def stagger_thread(args):
-    loginDelayLock.acquire()
-    delay = args.login_delay + ((random.random() - .5) / 2)
-    log.debug('Delaying thread startup for %.2f seconds', delay)
-    time.sleep(delay)
-    loginDelayLock.release()
+# Seconds a worker waits before it logs in, so logins are --login-delay
+# apart.
+def login_delay(args):
+    global next_login
+    with loginDelayLock:
+        start = max(next_login, time.time())
+        delay = args.login_delay + ((random.random() - .5) / 2)
+        next_login = start + delay
+    log.debug('Delaying thread startup for %.2f seconds',
+              next_login - time.time())
+    return next_login - time.time()
 
 
 # The delta from last stat to current stat
@@ -0,0 +1,253 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import heapq
+import logging
+import math
+from datetime import datetime
+from threading import Lock
+
+import geopy.distance
+
+from .utils import equi_rect_distance
+
+log = logging.getLogger(__name__)
+
+# Size of a grid cell in degrees. 0.01 degrees of latitude is roughly 1.1km,
+# which keeps a city sized viewport in the low hundreds of cells.
+GRID_CELL_DEGREES = 0.01
+
+# Size of the grid cells used to link spawnpoints to the scan locations
+# within 70m of them.
+LINK_CELL_DEGREES = 0.001
+
+# Relative difference between the equirectangular approximation and the
+# geodesic distance that's still trusted. Closer calls are left to geopy.
+# The approximation is well within 1% at scanning distances.
+EQUIRECT_MARGIN = 0.01
+
+# Meters per degree of latitude, as used by equi_rect_distance().
+METERS_PER_DEGREE = 6371000 * math.pi / 180
+
+
+# Return the (row, column) of the grid cell containing a lat/lng pair.
+def grid_cell(lat, lng, cell_size=GRID_CELL_DEGREES):
+    return (int(math.floor(lat / cell_size)),
+            int(math.floor(lng / cell_size)))
+
+
+# Return the row and column ranges of the grid cells covering a box.
+def grid_ranges(sw_lat, sw_lng, ne_lat, ne_lng, cell_size=GRID_CELL_DEGREES):
+    sw_row, sw_col = grid_cell(sw_lat, sw_lng, cell_size)
+    ne_row, ne_col = grid_cell(ne_lat, ne_lng, cell_size)
+    return xrange(sw_row, ne_row + 1), xrange(sw_col, ne_col + 1)
+
+
+# Check if a lat/lng pair is inside a (sw_lat, sw_lng, ne_lat, ne_lng) box.
+def in_box(lat, lng, box):
+    return box[0] <= lat <= box[2] and box[1] <= lng <= box[3]
+
+
+# Turn the viewport parameters of a map request into a box of floats, or
+# None if any of them is missing.
+def parse_box(sw_lat, sw_lng, ne_lat, ne_lng):
+    if not (sw_lat and sw_lng and ne_lat and ne_lng):
+        return None
+    return (float(sw_lat), float(sw_lng), float(ne_lat), float(ne_lng))
+
+
+# Bucket rows with 'latitude' and 'longitude' keys by grid cell.
+def bucket_points(points, cell_size=GRID_CELL_DEGREES):
+    cells = {}
+    for point in points:
+        cell = grid_cell(point['latitude'], point['longitude'], cell_size)
+        cells.setdefault(cell, []).append(point)
+    return cells
+
+
+# Yield the rows of bucket_points() cells that are within `lat_delta` and
+# `lng_delta` degrees of a lat/lng pair.
+def points_near(cells, lat, lng, lat_delta, lng_delta,
+                cell_size=GRID_CELL_DEGREES):
+    rows, cols = grid_ranges(lat - lat_delta, lng - lng_delta,
+                             lat + lat_delta, lng + lng_delta, cell_size)
+    for row in rows:
+        for col in cols:
+            for point in cells.get((row, col), ()):
+                if (abs(point['latitude'] - lat) <= lat_delta and
+                        abs(point['longitude'] - lng) <= lng_delta):
+                    yield point
+
+
+# Check if two lat/lng pairs are at most `meters` apart, like comparing
+# geopy's distance but only solving the geodesic for pairs that are close to
+# the limit.
+def within_distance(loc1, loc2, meters):
+    approx = equi_rect_distance(loc1, loc2) * 1000
+    if approx <= meters * (1 - EQUIRECT_MARGIN):
+        return True
+    if approx > meters * (1 + EQUIRECT_MARGIN):
+        return False
+    return geopy.distance.distance(loc1[:2], loc2[:2]).meters <= meters
+
+
+# Rows with 'latitude' and 'longitude' keys bucketed by grid cell, to find
+# the ones within a distance of a location without looking at all of them.
+class SpatialIndex(object):
+
+    def __init__(self, points, cell_size=LINK_CELL_DEGREES):
+        self.cell_size = cell_size
+        self.cells = bucket_points(points, cell_size)
+
+    def __len__(self):
+        return sum(len(cell) for cell in self.cells.itervalues())
+
+    # Yield the rows within `meters` of a lat/lng pair.
+    def near(self, loc, meters):
+        lat_delta = meters * (1 + EQUIRECT_MARGIN) / METERS_PER_DEGREE
+        lng_delta = lat_delta / max(
+            math.cos(math.radians(abs(loc[0]) + lat_delta)), 0.01)
+        for point in points_near(self.cells, loc[0], loc[1], lat_delta,
+                                 lng_delta, self.cell_size):
+            if within_distance(loc, (point['latitude'], point['longitude']),
+                               meters):
+                yield point
+
+    def any_near(self, loc, meters):
+        return any(True for _ in self.near(loc, meters))
+
+
+# In-memory index of active Pokemon, bucketed by grid cell so viewport
+# queries only look at the Pokemon near the viewport. Entries use the same
+# dict format as the Pokemon table and are evicted once their disappear_time
+# has passed.
+class ActivePokemonIndex(object):
+
+    def __init__(self, cell_size=GRID_CELL_DEGREES):
+        self.cell_size = cell_size
+        self.lock = Lock()
+        # encounter_id -> Pokemon dict.
+        self.pokemon = {}
+        # (row, column) -> {encounter_id: Pokemon dict}.
+        self.cells = {}
+        # Heap of (disappear_time, encounter_id) used for eviction. May hold
+        # stale entries for Pokemon that have been replaced since.
+        self.expiry = []
+
+    def __len__(self):
+        return len(self.pokemon)
+
+    # Add or replace Pokemon. Takes an iterable of dicts in the format
+    # parse_map sends to the db_update_queue.
+    def add(self, pokemon, now_date=None):
+        now_date = now_date or datetime.utcnow()
+
+        with self.lock:
+            for p in pokemon:
+                if p['disappear_time'] <= now_date:
+                    continue
+
+                # Copy, so later changes to the dict by the caller (or by the
+                # code serving it) can't change the index.
+                p = dict(p)
+                if not p.get('last_modified'):
+                    p['last_modified'] = now_date
+
+                encounter_id = p['encounter_id']
+                self._remove(encounter_id)
+
+                cell = grid_cell(p['latitude'], p['longitude'],
+                                 self.cell_size)
+                self.pokemon[encounter_id] = p
+                self.cells.setdefault(cell, {})[encounter_id] = p
+                heapq.heappush(self.expiry,
+                               (p['disappear_time'], encounter_id))
+
+            self._expire(now_date)
+
+    # Return copies of the active Pokemon matching a map request. The
+    # arguments follow Pokemon.get_active, with an optional list of
+    # pokemon_ids to filter on.
+    def query(self, swLat, swLng, neLat, neLng, timestamp=0, oSwLat=None,
+              oSwLng=None, oNeLat=None, oNeLng=None, ids=None,
+              now_date=None):
+        now_date = now_date or datetime.utcnow()
+        box = parse_box(swLat, swLng, neLat, neLng)
+        old_box = parse_box(oSwLat, oSwLng, oNeLat, oNeLng)
+        modified_since = None
+        if box and timestamp > 0:
+            modified_since = datetime.utcfromtimestamp(timestamp / 1000)
+            old_box = None
+        if ids is not None:
+            ids = set(ids)
+
+        with self.lock:
+            self._expire(now_date)
+
+            if box is None:
+                candidates = self.pokemon.itervalues()
+            else:
+                candidates = self._in_cells(box)
+
+            results = []
+            for p in candidates:
+                if p['disappear_time'] <= now_date:
+                    continue
+                if ids is not None and p['pokemon_id'] not in ids:
+                    continue
+                if box is not None:
+                    if not in_box(p['latitude'], p['longitude'], box):
+                        continue
+                    if (modified_since is not None and
+                            p['last_modified'] <= modified_since):
+                        continue
+                    if (old_box is not None and
+                            in_box(p['latitude'], p['longitude'], old_box)):
+                        continue
+                results.append(dict(p))
+
+        return results
+
+    # Yield the Pokemon in the grid cells covering a box.
+    def _in_cells(self, box):
+        rows, cols = grid_ranges(box[0], box[1], box[2], box[3],
+                                 self.cell_size)
+
+        # Zoomed far out, walking the occupied cells is cheaper than
+        # walking every cell in the viewport.
+        if len(rows) * len(cols) > len(self.cells):
+            # In Python 2 `in` walks an xrange, compare with its bounds.
+            row_lo, row_hi = rows[0], rows[-1] + 1
+            col_lo, col_hi = cols[0], cols[-1] + 1
+            for (row, col), cell in self.cells.iteritems():
+                if row_lo <= row < row_hi and col_lo <= col < col_hi:
+                    for p in cell.itervalues():
+                        yield p
+            return
+
+        for row in rows:
+            for col in cols:
+                cell = self.cells.get((row, col))
+                if cell:
+                    for p in cell.itervalues():
+                        yield p
+
+    def _remove(self, encounter_id):
+        p = self.pokemon.pop(encounter_id, None)
+        if p is None:
+            return
+
+        cell = grid_cell(p['latitude'], p['longitude'], self.cell_size)
+        bucket = self.cells.get(cell)
+        if bucket is not None:
+            bucket.pop(encounter_id, None)
+            if not bucket:
+                del self.cells[cell]
+
+    def _expire(self, now_date):
+        while self.expiry and self.expiry[0][0] <= now_date:
+            disappear_time, encounter_id = heapq.heappop(self.expiry)
+            p = self.pokemon.get(encounter_id)
+            # Only evict if the entry wasn't replaced with a later one.
+            if p is not None and p['disappear_time'] == disappear_time:
+                self._remove(encounter_id)
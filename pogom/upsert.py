@@ -0,0 +1,265 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import logging
+import operator
+from threading import Lock
+
+from peewee import CompositeKey
+
+log = logging.getLogger(__name__)
+
+# Default max number of parameters of a SQLite statement.
+SQLITE_MAX_VARIABLES = 999
+
+
+# Shared by the upsert engines: rows are turned into parameters the way
+# peewee's InsertQuery does it, with the same defaults and db_value()
+# conversions, and statements are kept per model and shape.
+class BulkUpsert(object):
+
+    def __init__(self):
+        self.lock = Lock()
+        # (model, column names, ...) -> SQL.
+        self.statements = {}
+
+    # The fields written for rows like `row`: its own and the ones with a
+    # default, sorted like peewee does. Keys that aren't fields are left
+    # out.
+    def _fields(self, cls, row):
+        meta = cls._meta
+        fields = set(meta.fields[name] for name in row
+                     if name in meta.fields)
+        fields.update(meta._default_dict)
+        fields.update(meta._default_callables)
+        return sorted(fields, key=operator.attrgetter('_sort_key'))
+
+    # How the stored values of a model's columns are merged with new ones,
+    # from its `upsert_merge` Meta option: 'add' adds them up, 'max' keeps
+    # the larger one, and 'latest' takes the new value only when the row's
+    # `upsert_latest_by` column is newer, e.g. the location of the last
+    # Pokemon seen. Other columns are replaced.
+    def _merge(self, cls):
+        return getattr(cls._meta, 'upsert_merge', None) or {}
+
+    def _latest_by(self, cls):
+        return cls._meta.fields[cls._meta.upsert_latest_by]
+
+    def _key_fields(self, cls):
+        key = cls._meta.primary_key
+        if not key:
+            return []
+        if isinstance(key, CompositeKey):
+            return [cls._meta.fields[name] for name in key.field_names]
+        return [key]
+
+    def _params(self, cls, fields, row):
+        meta = cls._meta
+        params = []
+        for field in fields:
+            if field.name in row:
+                value = row[field.name]
+            elif field in meta._default_callables:
+                value = meta._default_callables[field]()
+            else:
+                value = meta._default_dict[field]
+            params.append(field.db_value(value))
+        return params
+
+
+# Upserts for SQLite that skip peewee's query builder. Rows are written with
+# INSERT OR REPLACE statements of as many rows as fit in the parameter limit
+# for the model's column count. Statements go through db.execute_sql, so
+# they're counted and handled like peewee's own, and are kept per model and
+# number of rows, so sqlite3's statement cache reuses the prepared statement
+# for every full chunk.
+#
+# Rows of models with an `upsert_merge` option are merged with the stored
+# ones by an UPDATE per row, and the rows that weren't there are then added
+# with INSERT OR IGNORE. Both run in the caller's transaction.
+class SqliteUpsert(BulkUpsert):
+
+    def __init__(self, max_variables=SQLITE_MAX_VARIABLES):
+        super(SqliteUpsert, self).__init__()
+        self.max_variables = max_variables
+
+    # Number of rows of `columns` columns that fit in a statement.
+    def rows_per_statement(self, columns):
+        return max(self.max_variables // max(columns, 1), 1)
+
+    # Write a list of row dicts of a model. Returns the number of
+    # statements executed.
+    def write(self, cls, rows, db):
+        if not rows:
+            return 0
+        fields = self._fields(cls, rows[0])
+        params = [self._params(cls, fields, row) for row in rows]
+        per_statement = self.rows_per_statement(len(fields))
+        full = len(params) - len(params) % per_statement
+
+        statements = 0
+        if self._merge(cls):
+            statements += self._update(cls, fields, params, db)
+        if full:
+            sql = self._statement(cls, fields, per_statement)
+            for i in xrange(0, full, per_statement):
+                chunk = []
+                for row in params[i:i + per_statement]:
+                    chunk.extend(row)
+                db.execute_sql(sql, chunk)
+                statements += 1
+        if full < len(params):
+            rest = params[full:]
+            chunk = []
+            for row in rest:
+                chunk.extend(row)
+            db.execute_sql(self._statement(cls, fields, len(rest)), chunk)
+            statements += 1
+        return statements
+
+    # Merge rows into the stored ones, one UPDATE per row. Returns the
+    # number of statements executed.
+    def _update(self, cls, fields, params, db):
+        sql, columns = self._update_statement(cls, fields)
+        for row in params:
+            db.execute_sql(sql, [row[i] for i in columns])
+        return len(params)
+
+    # The UPDATE statement of a model, and the indexes of the row params
+    # that go into it.
+    def _update_statement(self, cls, fields):
+        key = (cls, tuple(field.name for field in fields), 'update')
+        with self.lock:
+            found = self.statements.get(key)
+            if found is None:
+                merge = self._merge(cls)
+                index = dict((field.name, i) for i, field in enumerate(fields))
+                keys = self._key_fields(cls)
+                key_names = set(field.name for field in keys)
+                assignments = []
+                columns = []
+                for field in fields:
+                    if field.name in key_names:
+                        continue
+                    column = '"{}"'.format(field.db_column)
+                    how = merge.get(field.name)
+                    if how == 'add':
+                        assignments.append('{0} = {0} + ?'.format(column))
+                    elif how == 'max':
+                        assignments.append('{0} = MAX({0}, ?)'.format(column))
+                    elif how == 'latest':
+                        latest_by = self._latest_by(cls)
+                        assignments.append(
+                            '{0} = CASE WHEN ? > "{1}" THEN ? ELSE {0} END'
+                            .format(column, latest_by.db_column))
+                        columns.append(index[latest_by.name])
+                    else:
+                        assignments.append('{} = ?'.format(column))
+                    columns.append(index[field.name])
+                where = ' AND '.join('"{}" = ?'.format(field.db_column)
+                                     for field in keys)
+                columns.extend(index[field.name] for field in keys)
+                found = ('UPDATE "{}" SET {} WHERE {}'.format(
+                    cls._meta.db_table, ', '.join(assignments), where),
+                    columns)
+                self.statements[key] = found
+        return found
+
+    def _statement(self, cls, fields, rows):
+        key = (cls, tuple(field.name for field in fields), rows)
+        with self.lock:
+            sql = self.statements.get(key)
+            if sql is None:
+                columns = ', '.join('"{}"'.format(field.db_column)
+                                    for field in fields)
+                values = '(' + ', '.join('?' * len(fields)) + ')'
+                verb = 'IGNORE' if self._merge(cls) else 'REPLACE'
+                sql = 'INSERT OR {} INTO "{}" ({}) VALUES {}'.format(
+                    verb, cls._meta.db_table, columns,
+                    ', '.join([values] * rows))
+                self.statements[key] = sql
+        return sql
+
+
+# Upserts for MySQL with INSERT ... ON DUPLICATE KEY UPDATE. REPLACE INTO
+# deletes the old row and inserts a new one, which rewrites every index of
+# the table and takes gap locks on them, even when only a timestamp changed.
+# An update in place only touches the indexes of the columns that changed.
+#
+# The columns updated on a duplicate key are the model's `upsert_columns`
+# Meta option when it has one, e.g. SpawnPoint's timing fields without its
+# coordinates, otherwise all columns but the primary key. Rows are passed to
+# the database's execute_many() with a single-row statement, which pymysql's
+# executemany() rewrites into multi-row statements. Columns in the
+# `upsert_merge` option are merged with the stored values in the update
+# clause, so concurrent writers add up instead of overwriting each other.
+class MysqlUpsert(BulkUpsert):
+
+    # Write a list of row dicts of a model, `step` rows per statement.
+    # Returns the number of statements executed.
+    def write(self, cls, rows, db, step):
+        if not rows:
+            return 0
+        fields = self._fields(cls, rows[0])
+        params = [self._params(cls, fields, row) for row in rows]
+        sql = self._statement(cls, fields)
+
+        statements = 0
+        for i in xrange(0, len(params), step):
+            db.execute_many(sql, params[i:i + step])
+            statements += 1
+        return statements
+
+    # Fields updated when a row already exists, out of `fields`.
+    def update_fields(self, cls, fields):
+        meta = cls._meta
+        keys = self._key_names(cls)
+        names = getattr(meta, 'upsert_columns', None)
+        if names is None:
+            names = [field.name for field in fields if field.name not in keys]
+        update = [field for field in fields if field.name in names]
+        if not update:
+            # Nothing to update, e.g. a composite key of foreign keys. The
+            # statement still needs an update clause to skip duplicates.
+            update = [field for field in fields if field.name in keys][:1]
+        return update or fields[:1]
+
+    def _key_names(self, cls):
+        return [field.name for field in self._key_fields(cls)]
+
+    # The update clause of a column. MySQL assigns them in order and later
+    # ones see the new values, so 'latest' columns go before the column
+    # they compare.
+    def _assignments(self, cls, fields):
+        merge = self._merge(cls)
+        first = []
+        rest = []
+        for field in self.update_fields(cls, fields):
+            column = '`{}`'.format(field.db_column)
+            how = merge.get(field.name)
+            if how == 'add':
+                rest.append('{0} = {0} + VALUES({0})'.format(column))
+            elif how == 'max':
+                rest.append('{0} = GREATEST({0}, VALUES({0}))'.format(column))
+            elif how == 'latest':
+                latest_by = '`{}`'.format(self._latest_by(cls).db_column)
+                first.append('{0} = IF(VALUES({1}) > {1}, VALUES({0}), {0})'
+                             .format(column, latest_by))
+            else:
+                rest.append('{0} = VALUES({0})'.format(column))
+        return first + rest
+
+    def _statement(self, cls, fields):
+        key = (cls, tuple(field.name for field in fields))
+        with self.lock:
+            sql = self.statements.get(key)
+            if sql is None:
+                columns = ', '.join('`{}`'.format(field.db_column)
+                                    for field in fields)
+                values = '(' + ', '.join(['%s'] * len(fields)) + ')'
+                update = ', '.join(self._assignments(cls, fields))
+                sql = ('INSERT INTO `{}` ({}) VALUES {} ' +
+                       'ON DUPLICATE KEY UPDATE {}').format(
+                           cls._meta.db_table, columns, values, update)
+                self.statements[key] = sql
+        return sql
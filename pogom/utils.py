@@ -301,6 +301,12 @@ def get_args():
                         help=('Clear Pokemon from database this many hours ' +
                               'after they disappear (0 to disable).'),
                         type=int, default=0)
+    parser.add_argument('-pdd', '--purge-detection-data',
+                        help=('Clear spawnpoint detection data from ' +
+                              'database this many hours after the scan, ' +
+                              'at least 168 as spawnpoints are classified ' +
+                              'from it (0 to disable).'),
+                        type=int, default=0)
     parser.add_argument('-px', '--proxy',
                         help='Proxy url (e.g. socks5://127.0.0.1:9050)',
                         action='append')
@@ -342,6 +348,83 @@ def get_args():
                         help=('Number of db threads; increase if the db ' +
                               'queue falls behind.'),
                         type=int, default=1)
+    parser.add_argument('-pi', '--pokemon-index',
+                        help=('Serve active Pokemon from an in-memory ' +
+                              'spatial index instead of the database. Only ' +
+                              'use on an instance that both scans and ' +
+                              'serves the map.'),
+                        action='store_true', default=False)
+    parser.add_argument('-ds', '--delta-sync',
+                        help=('Keep a log of recent database changes and ' +
+                              'only send changed data to map clients. Only ' +
+                              'use on an instance that both scans and ' +
+                              'serves the map.'),
+                        action='store_true', default=False)
+    parser.add_argument('-dss', '--delta-sync-size',
+                        help=('Number of changed rows to keep for ' +
+                              '--delta-sync. Clients falling further ' +
+                              'behind are sent a full update.'),
+                        type=int, default=20000)
+    parser.add_argument('-sj', '--stream-json',
+                        help=('Stream map data to clients as chunked JSON ' +
+                              'instead of building the whole response in ' +
+                              'memory first.'),
+                        action='store_true', default=False)
+    parser.add_argument('-hc', '--hive-cache',
+                        help=('Keep the scanned locations and spawnpoints ' +
+                              'of each speed scan hive in memory, and write ' +
+                              'them to the database in batches.'),
+                        action='store_true', default=False)
+    parser.add_argument('-hcf', '--hive-cache-flush',
+                        help=('Seconds between writes of the --hive-cache ' +
+                              'to the database. This much scanning progress ' +
+                              'can be lost if the process is killed.'),
+                        type=int, default=15)
+    parser.add_argument('-dbw', '--db-batch-window',
+                        help=('Seconds the db threads wait for more ' +
+                              'updates to merge into a single write.'),
+                        type=float, default=0.5)
+    parser.add_argument('-dbm', '--db-batch-max',
+                        help=('Max number of rows the db threads merge ' +
+                              'into a single write.'),
+                        type=int, default=5000)
+    parser.add_argument('-pdc', '--purge-chunk',
+                        help=('Number of rows deleted per statement by ' +
+                              '--purge-data and --purge-detection-data.'),
+                        type=int, default=1000)
+    parser.add_argument('-pdr', '--purge-rate',
+                        help=('Max number of rows deleted per second by ' +
+                              '--purge-data and --purge-detection-data ' +
+                              '(0 for no limit).'),
+                        type=int, default=5000)
+    parser.add_argument('-rs', '--record-scans',
+                        help=('Append the map responses of all scans to ' +
+                              'this file, to replay them with ' +
+                              'bench/bench_replay.py.'),
+                        default=None)
+    parser.add_argument('-pp', '--parse-processes',
+                        help=('Parse the map responses of the search ' +
+                              'workers in this many processes (0 to parse ' +
+                              'in the search workers). Not used with ' +
+                              '--encounter, --complete-tutorial or ' +
+                              '--hive-cache.'),
+                        type=int, default=0)
+    parser.add_argument('-we', '--worker-engine',
+                        help=('How to run the search workers: threads (a ' +
+                              'thread per worker) or loop (all workers in ' +
+                              'one event loop thread, with a pool of ' +
+                              '--worker-engine-threads for the API ' +
+                              'requests and database lookups).'),
+                        choices=['threads', 'loop'], default='threads')
+    parser.add_argument('-wet', '--worker-engine-threads',
+                        help=('Threads the loop --worker-engine makes ' +
+                              'API requests and database lookups with. ' +
+                              'Tutorial steps and captcha solving get ' +
+                              'as many threads of their own. Encounters ' +
+                              'log in their accounts in the pool, so ' +
+                              'with --encounter allow 20 seconds of ' +
+                              'a thread per login on top of the requests.'),
+                        type=int, default=20)
     parser.add_argument('-wh', '--webhook',
                         help='Define URL(s) to POST webhook information to.',
                         default=None, dest='webhooks', action='append')
@@ -375,6 +458,39 @@ def get_args():
     parser.add_argument('-whlfu', '--wh-lfu-size',
                         help='Webhook LFU cache max size.', type=int,
                         default=2500)
+    parser.add_argument('-whbs', '--wh-batch-size',
+                        help=('Post webhook messages to each endpoint in ' +
+                              'JSON arrays of up to this many messages (0 ' +
+                              'to post them one by one).'),
+                        type=int, default=0)
+    parser.add_argument('-whbt', '--wh-batch-time',
+                        help=('Max seconds a webhook message waits for ' +
+                              'its --wh-batch-size batch to fill up.'),
+                        type=float, default=1.0)
+    parser.add_argument('-whbq', '--wh-batch-queue',
+                        help=('Max number of messages waiting for each ' +
+                              'webhook endpoint with --wh-batch-size. ' +
+                              'Messages for an endpoint that falls this far ' +
+                              'behind are dropped.'),
+                        type=int, default=10000)
+    parser.add_argument('-who', '--wh-outbox', default=None,
+                        help=('Keep webhook messages in an outbox in this ' +
+                              'directory until each endpoint took them, ' +
+                              'so endpoints that were down and restarts ' +
+                              'don\'t lose any.'))
+    parser.add_argument('-whos', '--wh-outbox-size',
+                        help=('Max size of the --wh-outbox in MB. The ' +
+                              'oldest messages are dropped past it.'),
+                        type=int, default=1024)
+    parser.add_argument('-whoa', '--wh-outbox-age',
+                        help=('Max age of the messages in the ' +
+                              '--wh-outbox in hours.'),
+                        type=float, default=24)
+    parser.add_argument('-whor', '--wh-outbox-rate',
+                        help=('Max number of messages per second posted to ' +
+                              'each endpoint from the --wh-outbox, 0 for ' +
+                              'no limit.'),
+                        type=int, default=200)
     parser.add_argument('-whsu', '--webhook-scheduler-updates',
                         help=('Send webhook updates with scheduler status ' +
                               '(use with -wh).'),
@@ -810,18 +926,41 @@ def get_pokemon_id(pokemon_name):
     return get_pokemon_id.ids.get(pokemon_name, -1)
 
 
+# Translated name, rarity and types of a Pokemon, as sent to the map. The
+# table is built once per locale and its entries are shared between all
+# callers, so they must not be modified.
+def get_pokemon_info(pokemon_id):
+    if not hasattr(get_pokemon_info, 'tables'):
+        get_pokemon_info.tables = {}
+    table = get_pokemon_info.tables.get(config['LOCALE'])
+    if table is None:
+        if not hasattr(get_pokemon_data, 'pokemon'):
+            # initialize from file
+            get_pokemon_data(1)
+
+        table = {}
+        for key, data in get_pokemon_data.pokemon.iteritems():
+            table[int(key)] = {
+                'pokemon_name': i8ln(data['name']),
+                'pokemon_rarity': i8ln(data['rarity']),
+                'pokemon_types': tuple(
+                    {"type": i8ln(x['type']), "color": x['color']}
+                    for x in data['types'])
+            }
+        get_pokemon_info.tables[config['LOCALE']] = table
+    return table[int(pokemon_id)]
+
+
 def get_pokemon_name(pokemon_id):
-    return i8ln(get_pokemon_data(pokemon_id)['name'])
+    return get_pokemon_info(pokemon_id)['pokemon_name']
 
 
 def get_pokemon_rarity(pokemon_id):
-    return i8ln(get_pokemon_data(pokemon_id)['rarity'])
+    return get_pokemon_info(pokemon_id)['pokemon_rarity']
 
 
 def get_pokemon_types(pokemon_id):
-    pokemon_types = get_pokemon_data(pokemon_id)['types']
-    return map(lambda x: {"type": i8ln(x['type']), "color": x['color']},
-               pokemon_types)
+    return list(get_pokemon_info(pokemon_id)['pokemon_types'])
 
 
 def get_moves_data(move_id):
@@ -836,21 +975,44 @@ def get_moves_data(move_id):
     return get_moves_data.moves[str(move_id)]
 
 
+# Translated name, damage, energy and type of a move. Like
+# get_pokemon_info, entries are shared and must not be modified.
+def get_move_info(move_id):
+    if not hasattr(get_move_info, 'tables'):
+        get_move_info.tables = {}
+    table = get_move_info.tables.get(config['LOCALE'])
+    if table is None:
+        if not hasattr(get_moves_data, 'moves'):
+            # initialize from file
+            get_moves_data(1)
+
+        table = {}
+        for key, data in get_moves_data.moves.iteritems():
+            table[int(key)] = {
+                'name': i8ln(data['name']),
+                'damage': i8ln(data['damage']),
+                'energy': i8ln(data['energy']),
+                'type': {"type": i8ln(data['type']),
+                         "type_en": data['type']}
+            }
+        get_move_info.tables[config['LOCALE']] = table
+    return table[int(move_id)]
+
+
 def get_move_name(move_id):
-    return i8ln(get_moves_data(move_id)['name'])
+    return get_move_info(move_id)['name']
 
 
 def get_move_damage(move_id):
-    return i8ln(get_moves_data(move_id)['damage'])
+    return get_move_info(move_id)['damage']
 
 
 def get_move_energy(move_id):
-    return i8ln(get_moves_data(move_id)['energy'])
+    return get_move_info(move_id)['energy']
 
 
 def get_move_type(move_id):
-    move_type = get_moves_data(move_id)['type']
-    return {"type": i8ln(move_type), "type_en": move_type}
+    return dict(get_move_info(move_id)['type'])
 
 
 def dottedQuadToNum(ip):
@@ -1,12 +1,18 @@
 #!/usr/bin/python
 # -*- coding: utf-8 -*-
 
+import json
 import logging
 import requests
+import xxhash
 from datetime import datetime
 from cachetools import LFUCache
+from queue import Queue, Empty, Full
 from requests_futures.sessions import FuturesSession
+from timeit import default_timer
 import threading
+import time
+from .outbox import Outbox
 from .utils import get_args
 from requests.packages.urllib3.util.retry import Retry
 from requests.adapters import HTTPAdapter
@@ -18,12 +24,33 @@ wh_warning_threshold = 100
 # How long can it be over the threshold, in seconds?
 # Default: 5 seconds per 100 in threshold.
 wh_threshold_lifetime = int(5 * (wh_warning_threshold / 100.0))
-wh_lock = threading.Lock()
+# Number of shards of each webhook dedup cache.
+wh_cache_shards = 16
+# Seconds between two logs of the metrics of a batched webhook endpoint.
+wh_stats_interval = 60
 
 args = get_args()
 
 
-def send_to_webhook(session, message_type, message):
+# A wh_update_queue item for a message, with the digest of its key fields
+# so wh_updater doesn't need to look at them again.
+def webhook_item(message_type, message):
+    return (message_type, message, wh_digest(message_type, message))
+
+
+# A 64-bit digest of the fields of a message that make it worth resending
+# when they change, or None for types without such fields.
+def wh_digest(message_type, message):
+    fields = __get_key_fields(message_type)
+    if not fields:
+        return None
+
+    values = json.dumps([message.get(k) for k in fields], sort_keys=True,
+                        separators=(',', ':'), default=str)
+    return xxhash.xxh64(values).intdigest()
+
+
+def send_to_webhook(session, message_type, message, batcher=None):
     if not args.webhooks:
         # What are you even doing here...
         log.warning('Called send_to_webhook() without webhooks.')
@@ -36,6 +63,10 @@ def send_to_webhook(session, message_type, message):
         'message': message
     }
 
+    if batcher:
+        batcher.send(data)
+        return
+
     for w in args.webhooks:
         try:
             session.post(w, json=data, timeout=(None, req_timeout),
@@ -46,14 +77,16 @@ def send_to_webhook(session, message_type, message):
             log.exception(repr(e))
 
 
-def wh_updater(args, queue, key_caches):
+def wh_updater(args, queue, key_caches, batcher=None):
     wh_threshold_timer = datetime.now()
     wh_over_threshold = False
 
     # Set up one session to use for all requests.
     # Requests to the same host will reuse the underlying TCP
-    # connection, giving a performance increase.
-    session = __get_requests_session(args)
+    # connection, giving a performance increase. The batcher has its own.
+    session = None
+    if not batcher:
+        session = get_requests_session(args)
 
     # Extract the proper identifier. This list also controls which message
     # types are getting cached.
@@ -66,15 +99,18 @@ def wh_updater(args, queue, key_caches):
 
     # Instantiate WH LFU caches for all cached types. We separate the caches
     # by ident_field types, because different ident_field (message) types can
-    # use the same name for their ident field.
+    # use the same name for their ident field. The wh_updater threads share
+    # them, the first thread to start creates them.
     for key in ident_fields:
-        key_caches[key] = LFUCache(maxsize=args.wh_lfu_size)
+        key_caches.setdefault(key, ShardedLFUCache(args.wh_lfu_size))
 
     # The forever loop.
     while True:
         try:
-            # Loop the queue.
-            whtype, message = queue.get()
+            # Loop the queue. Messages from parse_map and parse_gyms come
+            # with their digest.
+            item = queue.get()
+            whtype, message = item[:2]
 
             # Get the proper cache if this type has one.
             key_cache = None
@@ -85,35 +121,36 @@ def wh_updater(args, queue, key_caches):
             # Get the unique identifier to check our cache, if it has one.
             ident = message.get(ident_fields.get(whtype), None)
 
-            # cachetools in Python2.7 isn't thread safe, so we add a lock.
-            with wh_lock:
-                # Only send if identifier isn't already in cache.
-                if ident is None or key_cache is None:
-                    # We don't know what it is, or it doesn't have a cache,
-                    # so let's just log and send as-is.
-                    log.debug(
-                        'Sending webhook item of uncached type: %s.', whtype)
-                    send_to_webhook(session, whtype, message)
-                elif ident not in key_cache:
-                    key_cache[ident] = message
+            # Only send if identifier isn't already in cache. The cache only
+            # locks the shard of the identifier while it's checked, sending
+            # happens outside of it.
+            if ident is None or key_cache is None:
+                # We don't know what it is, or it doesn't have a cache,
+                # so let's just log and send as-is.
+                log.debug(
+                    'Sending webhook item of uncached type: %s.', whtype)
+                send_to_webhook(session, whtype, message, batcher)
+            else:
+                # If the object has changed in an important way, send new
+                # data to webhooks.
+                if len(item) > 2:
+                    digest = item[2]
+                else:
+                    digest = wh_digest(whtype, message)
+                update = key_cache.update(ident, digest)
+                if update == 'new':
                     log.debug('Sending %s to webhook: %s.', whtype, ident)
-                    send_to_webhook(session, whtype, message)
+                    send_to_webhook(session, whtype, message, batcher)
+                elif update == 'changed':
+                    send_to_webhook(session, whtype, message, batcher)
+                    log.debug('Sending updated %s to webhook: %s.',
+                              whtype, ident)
                 else:
-                    # Make sure to call key_cache[ident] in all branches so it
-                    # updates the LFU usage count.
-
-                    # If the object has changed in an important way, send new
-                    # data to webhooks.
-                    if __wh_object_changed(whtype, key_cache[ident], message):
-                        key_cache[ident] = message
-                        send_to_webhook(session, whtype, message)
-                        log.debug('Sending updated %s to webhook: %s.',
-                                  whtype, ident)
-                    else:
-                        log.debug('Not resending %s to webhook: %s.',
-                                  whtype, ident)
+                    log.debug('Not resending %s to webhook: %s.',
+                              whtype, ident)
 
             # Helping out the GC.
+            del item
             del whtype
             del message
             del ident
@@ -143,6 +180,344 @@ def wh_updater(args, queue, key_caches):
             log.exception('Exception in wh_updater: %s.', repr(e))
 
 
+# An LFU cache of webhook message digests by identifier, split into shards
+# with a lock each, so wh_updater threads only wait for each other when
+# their messages land in the same shard. Each shard holds an equal part of
+# the maxsize digests, cachetools evicts the least used of a full shard.
+class ShardedLFUCache(object):
+
+    def __init__(self, maxsize, shards=None):
+        shards = max(min(shards or wh_cache_shards, maxsize), 1)
+        self.shards = [(threading.Lock(), LFUCache(maxsize=maxsize // shards))
+                       for _ in range(shards)]
+
+    def __len__(self):
+        return sum(len(cache) for _, cache in self.shards)
+
+    def __contains__(self, ident):
+        lock, cache = self.shards[hash(ident) % len(self.shards)]
+        with lock:
+            return ident in cache
+
+    # Cache the digest of a message, see wh_digest. Returns 'new',
+    # 'changed' or None when the message doesn't need to be sent. A None
+    # digest is always a change.
+    def update(self, ident, digest):
+        lock, cache = self.shards[hash(ident) % len(self.shards)]
+        with lock:
+            if ident not in cache:
+                cache[ident] = digest
+                return 'new'
+            # Reading cache[ident] updates the LFU usage count.
+            if digest is None or cache[ident] != digest:
+                cache[ident] = digest
+                return 'changed'
+            return None
+
+
+# Batched webhooks, with --wh-batch-size: the messages for each endpoint are
+# posted as JSON arrays of up to --wh-batch-size messages, sent when full or
+# when the oldest has waited --wh-batch-time seconds. Every endpoint has its
+# own queue of --wh-batch-queue messages and --wh-concurrency threads
+# posting to it, so a slow endpoint only holds up itself: when its queue is
+# full, new messages for it are dropped.
+class WebhookBatcher(object):
+
+    def __init__(self, args):
+        self.endpoints = [WebhookEndpoint(args, url, n)
+                          for n, url in enumerate(args.webhooks)]
+
+    def send(self, data):
+        for endpoint in self.endpoints:
+            endpoint.put(data)
+
+    # Wait until every queued message has been posted or given up on.
+    def join(self):
+        for endpoint in self.endpoints:
+            endpoint.queue.join()
+
+    def stats(self):
+        return dict((e.url, e.stats.current()) for e in self.endpoints)
+
+
+class WebhookEndpoint(object):
+
+    def __init__(self, args, url, number=0):
+        self.url = url
+        self.batch_size = args.wh_batch_size
+        self.batch_time = args.wh_batch_time
+        self.timeout = args.wh_timeout
+        self.queue = Queue(maxsize=args.wh_batch_queue)
+        self.stats = WebhookStats(url)
+        self.session = get_requests_session(args, requests.Session())
+
+        for i in range(args.wh_concurrency):
+            t = threading.Thread(target=self.sender,
+                                 name='wh-batch-{}-{}'.format(number, i))
+            t.daemon = True
+            t.start()
+
+    def put(self, data):
+        try:
+            self.queue.put_nowait((default_timer(), data))
+        except Full:
+            self.stats.dropped()
+
+    # Take up to batch_size messages off the queue. Blocks until there is
+    # one, then waits for more until it's batch_time seconds old. Messages
+    # already in the queue are always taken.
+    def next_batch(self):
+        batch = [self.queue.get()]
+        deadline = batch[0][0] + self.batch_time
+        while len(batch) < self.batch_size:
+            remaining = deadline - default_timer()
+            try:
+                if remaining > 0:
+                    batch.append(self.queue.get(timeout=remaining))
+                else:
+                    batch.append(self.queue.get_nowait())
+            except Empty:
+                break
+        return batch
+
+    def sender(self):
+        while True:
+            batch = self.next_batch()
+            started = default_timer()
+            sent = False
+            try:
+                response = self.session.post(
+                    self.url, json=[data for _, data in batch],
+                    timeout=(None, self.timeout))
+                sent = response.ok
+                if not sent:
+                    log.warning('Webhook endpoint %s answered %d to a ' +
+                                'batch of %d messages.', self.url,
+                                response.status_code, len(batch))
+            except requests.exceptions.RequestException as e:
+                log.warning('Sending a batch of %d messages to webhook ' +
+                            'endpoint %s failed: %s', len(batch), self.url,
+                            repr(e))
+            except Exception as e:
+                log.exception('Exception in webhook sender for %s: %s.',
+                              self.url, repr(e))
+
+            self.stats.record(batch, started, default_timer(), sent,
+                              self.queue.qsize())
+            for _ in batch:
+                self.queue.task_done()
+
+
+# Webhooks through an on-disk outbox, see pogom/outbox.py. Messages are
+# appended to the outbox, and each endpoint has a thread posting them from
+# its cursor at up to wh_outbox_rate messages per second. An endpoint that
+# is down gets its messages once it's back, however long it was down for,
+# unless they're past the outbox's retention limits. Messages it keeps
+# rejecting are dropped.
+class WebhookOutbox(object):
+
+    def __init__(self, args):
+        self.outbox = Outbox(args.wh_outbox,
+                             max_bytes=args.wh_outbox_size * 1024 * 1024,
+                             max_age=args.wh_outbox_age * 3600)
+        self.outbox.register(args.webhooks)
+        self.endpoints = [OutboxEndpoint(args, self.outbox, url, n)
+                          for n, url in enumerate(args.webhooks)]
+
+    def send(self, data):
+        self.outbox.append(data)
+
+    # Wait until every endpoint has been sent everything in the outbox.
+    def join(self):
+        while any(self.outbox.behind(e.url) for e in self.endpoints):
+            time.sleep(0.05)
+
+    def stats(self):
+        return dict((e.url, e.stats.current()) for e in self.endpoints)
+
+    def close(self):
+        self.outbox.close()
+
+
+class OutboxEndpoint(object):
+
+    # Seconds to wait before retrying after a failed post, doubling up to
+    # the max while the endpoint keeps failing.
+    min_backoff = 1.0
+    max_backoff = 60.0
+    # Times in a row the endpoint can reject messages (a 4xx answer other
+    # than a timeout or throttling) before they're dropped, so one it can't
+    # take doesn't hold up the rest.
+    max_rejections = 3
+
+    def __init__(self, args, outbox, url, number=0):
+        self.outbox = outbox
+        self.url = url
+        self.batch_size = args.wh_batch_size
+        self.rate = args.wh_outbox_rate
+        self.timeout = args.wh_timeout
+        self.stats = WebhookStats(url, unit='KB')
+        self.session = get_requests_session(args, requests.Session())
+
+        t = threading.Thread(target=self.sender,
+                             name='wh-outbox-{}'.format(number))
+        t.daemon = True
+        t.start()
+
+    def sender(self):
+        self.backoff = self.min_backoff
+        self.rejections = 0
+        self.next_post = time.time()
+        while True:
+            try:
+                self.send_next()
+            except Exception as e:
+                log.exception('Exception in webhook outbox sender for %s: ' +
+                              '%s.', self.url, repr(e))
+                time.sleep(self.backoff)
+                self.backoff = min(self.backoff * 2, self.max_backoff)
+
+    # Post the next messages of the outbox, and move past them once the
+    # endpoint took them.
+    def send_next(self):
+        batch, offset = self.outbox.read(self.url, max(1, self.batch_size))
+        lost = self.outbox.take_lost(self.url)
+        if lost:
+            self.stats.dropped(lost)
+        if not batch:
+            self.outbox.wait(self.url, 1.0)
+            return
+
+        # Spread the posts out so they stay under the rate, which is what a
+        # recovering endpoint sees while the backlog replays.
+        if self.rate:
+            delay = self.next_post - time.time()
+            if delay > 0:
+                time.sleep(delay)
+            self.next_post = (max(self.next_post, time.time()) +
+                              len(batch) / float(self.rate))
+
+        started = time.time()
+        sent = False
+        rejected = False
+        try:
+            if self.batch_size:
+                body = [data for _, data in batch]
+            else:
+                body = batch[0][1]
+            response = self.session.post(self.url, json=body,
+                                         timeout=(None, self.timeout))
+            sent = response.ok
+            if not sent:
+                rejected = (400 <= response.status_code < 500 and
+                            response.status_code not in (408, 429))
+                log.warning('Webhook endpoint %s answered %d to %d ' +
+                            'messages from the outbox.', self.url,
+                            response.status_code, len(batch))
+        except requests.exceptions.RequestException as e:
+            log.warning('Sending %d messages from the outbox to webhook ' +
+                        'endpoint %s failed: %s', len(batch), self.url,
+                        repr(e))
+
+        self.stats.record(batch, started, time.time(), sent,
+                          self.outbox.behind(self.url) / 1024)
+        self.rejections = self.rejections + 1 if rejected else 0
+        if self.rejections >= self.max_rejections:
+            log.error('Webhook endpoint %s rejected %d messages from the ' +
+                      'outbox %d times, dropping them.', self.url,
+                      len(batch), self.rejections)
+            self.stats.dropped(len(batch))
+            sent = True
+        if sent:
+            self.outbox.commit(self.url, offset)
+            self.backoff = self.min_backoff
+            self.rejections = 0
+        else:
+            # The messages stay in the outbox until the endpoint is back.
+            time.sleep(self.backoff)
+            self.backoff = min(self.backoff * 2, self.max_backoff)
+
+
+# Metrics of a batched or outbox webhook endpoint: messages and batches
+# sent, request latency, failed batches and dropped messages, logged every
+# wh_stats_interval seconds.
+class WebhookStats(object):
+
+    def __init__(self, url, interval=None, unit='messages'):
+        self.url = url
+        # Unit of the depth: how much is waiting for the endpoint.
+        self.unit = unit
+        self.interval = interval or wh_stats_interval
+        self.lock = threading.Lock()
+        self.last_log = default_timer()
+        self.depth = 0
+        self._reset()
+
+    def _reset(self):
+        self.messages = 0
+        self.batches = 0
+        self.failed = 0
+        self.drops = 0
+        self.latency = 0.0
+        self.max_latency = 0.0
+        self.wait = 0.0
+
+    def dropped(self, count=1):
+        with self.lock:
+            self.drops += count
+
+    # Record a batch posted from `started` to `done`, with `depth` left
+    # waiting. Logs the metrics when it's time to.
+    def record(self, batch, started, done, sent, depth):
+        with self.lock:
+            self.batches += 1
+            if sent:
+                self.messages += len(batch)
+            else:
+                self.failed += 1
+            latency = done - started
+            self.latency += latency
+            self.max_latency = max(self.max_latency, latency)
+            # How long the oldest message waited before it was posted.
+            self.wait += started - batch[0][0]
+            self.depth = depth
+
+            if done - self.last_log < self.interval:
+                return
+            metrics = self._metrics(done)
+            self.last_log = done
+            self._reset()
+
+        log.info('Webhook %s: %d messages in %d batches (%.1f per batch), ' +
+                 'latency %.3fs (max %.3fs), oldest message waited %.3fs, ' +
+                 '%d failed batches, %d dropped messages, %d %s waiting.',
+                 self.url, metrics['messages'], metrics['batches'],
+                 metrics['batch_size'], metrics['latency'],
+                 metrics['max_latency'], metrics['wait'], metrics['failed'],
+                 metrics['drops'], metrics['depth'], self.unit)
+
+    # The metrics since the last log.
+    def current(self):
+        with self.lock:
+            return self._metrics(default_timer())
+
+    def _metrics(self, now):
+        batches = self.batches or 1
+        return {
+            'messages': self.messages,
+            'batches': self.batches,
+            'batch_size': self.messages / float(
+                (self.batches - self.failed) or 1),
+            'latency': self.latency / batches,
+            'max_latency': self.max_latency,
+            'wait': self.wait / batches,
+            'failed': self.failed,
+            'drops': self.drops,
+            'depth': self.depth,
+            'seconds': now - self.last_log
+        }
+
+
 # Helpers
 
 # Background handler for completed webhook requests.
@@ -151,7 +526,8 @@ def __wh_completed():
     pass
 
 
-def __get_requests_session(args):
+# A session retrying failed requests, a FuturesSession unless one is given.
+def get_requests_session(args, session=None):
     # Config / arg parser
     num_retries = args.wh_retries
     backoff_factor = args.wh_backoff_factor
@@ -161,7 +537,8 @@ def __get_requests_session(args):
     # If the backoff_factor is 0.1, then sleep() will sleep for [0.1s, 0.2s,
     # 0.4s, ...] between retries. It will also force a retry if the status
     # code returned is 500, 502, 503 or 504.
-    session = FuturesSession(max_workers=pool_size)
+    if session is None:
+        session = FuturesSession(max_workers=pool_size)
 
     # If any regular response is generated, no retry is done. Without using
     # the status_forcelist, even a response with status 500 will not be
@@ -180,6 +557,8 @@ def __get_requests_session(args):
     return session
 
 
+# The fields of each message type worth a resend when they change. Not the
+# last_modified fields, they can't be trusted.
 def __get_key_fields(whtype):
     key_fields = {
         # lure_expiration is a UTC timestamp so it's good (Y).
@@ -195,25 +574,3 @@ def __get_key_fields(whtype):
     }
 
     return key_fields.get(whtype, [])
-
-
-# Determine if a webhook object has changed in any important way (and
-# requires a resend).
-def __wh_object_changed(whtype, old, new):
-    # Only test for important fields: don't trust last_modified fields.
-    fields = __get_key_fields(whtype)
-
-    if not fields:
-        log.debug('Received an object of unknown type %s.', whtype)
-        return True
-
-    return not __dict_fields_equal(fields, old, new)
-
-
-# Determine if two dicts have equal values for all keys in a list.
-def __dict_fields_equal(keys, a, b):
-    for k in keys:
-        if a.get(k) != b.get(k):
-            return False
-
-    return True
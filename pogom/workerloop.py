@@ -0,0 +1,158 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Engines for the search workers, see --worker-engine. A search worker is a
+# generator that yields what it waits for instead of blocking: Sleep(seconds)
+# or Call(fn, *args), which is answered with the result of fn (or raises its
+# exception in the worker).
+#
+# The threads engine runs every worker in its own thread, where a Sleep is a
+# time.sleep and a Call a plain call. The loop engine runs all workers in a
+# single thread, with a heap of sleeping workers, and the Calls (API
+# requests, logins, database lookups) in a bounded pool of threads. Calls
+# that mostly wait, like the tutorial steps and captcha solving, are a
+# BlockingCall and run in a pool of their own, so they don't hold up the
+# API requests of the other workers.
+
+import heapq
+import logging
+import sys
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from threading import Event, Lock, Thread
+from timeit import default_timer
+
+log = logging.getLogger(__name__)
+
+
+class Sleep(object):
+    __slots__ = ('seconds',)
+
+    def __init__(self, seconds):
+        self.seconds = seconds
+
+
+class Call(object):
+    __slots__ = ('fn', 'args', 'kwargs')
+
+    def __init__(self, fn, *args, **kwargs):
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+
+
+class BlockingCall(Call):
+    __slots__ = ()
+
+
+# Run a worker on the current thread, until it returns.
+def run_in_thread(worker):
+    result = error = None
+    while True:
+        try:
+            if error:
+                step = worker.throw(*error)
+            else:
+                step = worker.send(result)
+        except StopIteration:
+            return
+        result = error = None
+        if isinstance(step, Sleep):
+            time.sleep(max(step.seconds, 0))
+        else:
+            try:
+                result = step.fn(*step.args, **step.kwargs)
+            except Exception:
+                error = sys.exc_info()
+
+
+class WorkerLoop(object):
+
+    def __init__(self, call_threads, blocking_threads=None):
+        self.executor = ThreadPoolExecutor(call_threads)
+        self.blocking_executor = ThreadPoolExecutor(
+            blocking_threads or call_threads)
+        # Sleeping workers, as (wake up time, order, worker).
+        self.sleeping = []
+        self.order = 0
+        # Workers to resume, as (worker, result, exc_info). Calls finish on
+        # the executor's threads, deque appends are thread safe.
+        self.ready = deque()
+        self.wakeup = Event()
+        self.lock = Lock()
+        self.added = []
+        self.workers = 0
+        self.thread = None
+
+    def add(self, worker):
+        with self.lock:
+            self.added.append(worker)
+        self.wakeup.set()
+
+    def start(self):
+        self.thread = Thread(target=self.run, name='search-worker-loop')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def run(self):
+        while True:
+            # Cleared before looking for work, so a Call finishing from now
+            # on wakes the loop up again.
+            self.wakeup.clear()
+            with self.lock:
+                added, self.added = self.added, []
+            for worker in added:
+                self.workers += 1
+                self.ready.append((worker, None, None))
+
+            now = default_timer()
+            while self.sleeping and self.sleeping[0][0] <= now:
+                worker = heapq.heappop(self.sleeping)[2]
+                self.ready.append((worker, None, None))
+
+            while self.ready:
+                self.resume(*self.ready.popleft())
+
+            timeout = 1
+            if self.sleeping:
+                timeout = min(self.sleeping[0][0] - default_timer(), timeout)
+            if timeout > 0:
+                self.wakeup.wait(timeout)
+
+    # Run a worker up to the next thing it waits for.
+    def resume(self, worker, result, error):
+        try:
+            if error:
+                step = worker.throw(*error)
+            else:
+                step = worker.send(result)
+        except StopIteration:
+            self.workers -= 1
+            return
+        except Exception as e:
+            self.workers -= 1
+            log.exception('Search worker stopped: %s', repr(e))
+            return
+
+        if isinstance(step, Sleep):
+            self.order += 1
+            heapq.heappush(self.sleeping, (default_timer() + step.seconds,
+                                           self.order, worker))
+        else:
+            if isinstance(step, BlockingCall):
+                executor = self.blocking_executor
+            else:
+                executor = self.executor
+            future = executor.submit(step.fn, *step.args, **step.kwargs)
+            future.add_done_callback(
+                lambda f: self.call_done(worker, f))
+
+    def call_done(self, worker, future):
+        exception, tb = future.exception_info()
+        if exception is None:
+            self.ready.append((worker, future.result(), None))
+        else:
+            self.ready.append((worker, None,
+                               (type(exception), exception, tb)))
+        self.wakeup.set()
@@ -18,14 +18,16 @@ from flask_cache_bust import init_cache_busting
 
 from pogom import config
 from pogom.app import Pogom
-from pogom.utils import get_args, now, extract_sprites
+from pogom.utils import (get_args, now, extract_sprites, get_pokemon_info,
+                         get_move_info)
 from pogom.altitude import get_gmaps_altitude
 
 from pogom.search import search_overseer_thread
 from pogom.models import (init_database, create_tables, drop_tables,
                           Pokemon, db_updater, clean_db_loop,
                           verify_table_encoding, verify_database_schema)
-from pogom.webhook import wh_updater
+from pogom.webhook import wh_updater, WebhookBatcher, WebhookOutbox
+from pogom.parsepool import ParsePool
 
 from pogom.proxy import check_proxies, proxies_refresher
 
@@ -218,6 +220,10 @@ def main():
     config['LOCALE'] = args.locale
     config['CHINA'] = args.china
 
+    # Build the translated Pokemon and move tables for this locale.
+    get_pokemon_info(1)
+    get_move_info(1)
+
     # if we're clearing the db, do not bother with the blacklist
     if args.clear_db:
         args.disable_blacklist = True
@@ -243,6 +249,10 @@ def main():
         log.info("Drop and recreate is complete. Now remove -cd and restart.")
         sys.exit()
 
+    if args.pokemon_index:
+        log.info('Loaded %d active Pokemon into the in-memory index.',
+                 Pokemon.load_active_index())
+
     app.set_current_location(position)
 
     # Control the search status (running or not) across threads.
@@ -257,6 +267,16 @@ def main():
     new_location_queue = Queue()
     new_location_queue.put(position)
 
+    # Parse processes, forked before any thread is started.
+    parse_pool = None
+    if args.parse_processes > 0 and not args.only_server:
+        if args.encounter or args.complete_tutorial or args.hive_cache:
+            log.warning('Parsing in the search workers: --parse-processes ' +
+                        "can't be used with --encounter, " +
+                        '--complete-tutorial or --hive-cache.')
+        else:
+            parse_pool = ParsePool(args.parse_processes)
+
     # DB Updates
     db_updates_queue = Queue()
 
@@ -281,11 +301,23 @@ def main():
     wh_updates_queue = Queue()
     wh_key_cache = {}
 
+    # Batched webhooks: one queue and set of threads per endpoint.
+    # With an outbox, through the disk and one thread per endpoint.
+    wh_batcher = None
+    if args.webhooks and args.wh_outbox:
+        log.info('Sending webhooks through the outbox in %s.',
+                 args.wh_outbox)
+        wh_batcher = WebhookOutbox(args)
+    elif args.webhooks and args.wh_batch_size > 0:
+        log.info('Posting webhooks in batches of up to %d messages.',
+                 args.wh_batch_size)
+        wh_batcher = WebhookBatcher(args)
+
     # Thread to process webhook updates.
     for i in range(args.wh_threads):
         log.debug('Starting wh-updater worker thread %d', i)
         t = Thread(target=wh_updater, name='wh-updater-{}'.format(i),
-                   args=(args, wh_updates_queue, wh_key_cache))
+                   args=(args, wh_updates_queue, wh_key_cache, wh_batcher))
         t.daemon = True
         t.start()
 
@@ -327,7 +359,7 @@ def main():
                 log.info('Finished exporting spawn points')
 
         argset = (args, new_location_queue, pause_bit,
-                  heartbeat, db_updates_queue, wh_updates_queue)
+                  heartbeat, db_updates_queue, wh_updates_queue, parse_pool)
 
         log.debug('Starting a %s search thread', args.scheduler)
         search_thread = Thread(target=search_overseer_thread,
@@ -28,6 +28,7 @@ var languageLookupThreshold = 3
 var searchMarkerStyles
 
 var timestamp
+var seq
 var excludedPokemon = []
 var notifiedPokemon = []
 var notifiedRarity = []
@@ -1187,6 +1188,7 @@ function loadRawData() {
         type: 'GET',
         data: {
             'timestamp': timestamp,
+            'seq': seq,
             'pokemon': loadPokemon,
             'lastpokemon': lastpokemon,
             'pokestops': loadPokestops,
@@ -1518,6 +1520,7 @@ function updateMap() {
             }, reincludedPokemon)
         }
         timestamp = result.timestamp
+        seq = result.seq
         lastUpdateTime = Date.now()
     })
 }
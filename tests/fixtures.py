@@ -0,0 +1,39 @@
+# Configuration and database shared by the test modules.
+#
+# pogom parses the command line the first time get_args() is called and
+# keeps the result, so every module that needs it must set up the same
+# arguments: whichever of them nose runs first decides for the rest. Call
+# setup() before importing anything from pogom that reads its configuration
+# (models, webhook, search, schedulers, ...), e.g. in setUpModule. Tests that
+# need other options copy get_args() and change the copy.
+
+import os
+import sys
+import tempfile
+
+DB_FILE = os.path.join(tempfile.mkdtemp(prefix='pogom-test-'), 'test.db')
+ARGS = ['-k', 'test', '-l', '40.0,-73.0', '-u', 'test', '-p', 'test',
+        '--db', DB_FILE, '--disable-blacklist', '-st', '2', '-sd', '10']
+
+_app_db = None
+
+
+def setup():
+    sys.argv = [sys.argv[0]] + ARGS
+
+
+# The Flask app and database, created once with the current schema.
+def init_db():
+    global _app_db
+    if _app_db is None:
+        setup()
+        from pogom.app import Pogom
+        from pogom.models import init_database, create_tables
+
+        app = Pogom(__name__)
+        app.set_heartbeat_control([0])
+        app.set_current_location((40.0, -73.0, 0))
+        db = init_database(app)
+        create_tables(db)
+        _app_db = (app, db)
+    return _app_db
@@ -0,0 +1,310 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Offline, deterministic scheduler simulation. A scheduler is driven through
+# schedule/next_item/task_done by simulated workers that follow the loops of
+# search_overseer_thread and search_worker, on a virtual clock. Scans
+# are answered by a FakeMap and go through parse_map into the SQLite
+# database, so the scheduler learns about spawnpoints as it would live.
+#
+# pogom reads its configuration when it's imported, set up the arguments
+# and the database (fixtures.init_db() or bench.setup() and bench.init_db())
+# before using this module.
+
+import copy
+import heapq
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from queue import Queue, Empty
+from timeit import default_timer
+
+# Modules whose clock is replaced during a simulation.
+CLOCK_MODULES = ('pogom.schedulers', 'pogom.models', 'pogom.hivecache',
+                 'pogom.scanqueue', 'pogom.rollups')
+
+
+# Clock that only moves when the simulation sleeps.
+class VirtualClock(object):
+
+    def __init__(self, start):
+        self.now = float(start)
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += max(seconds, 0)
+
+    def utcnow(self):
+        return datetime.utcfromtimestamp(self.now)
+
+    # Replace datetime, time, now(), cur_sec() and default_timer in the
+    # given modules while the context is active.
+    @contextmanager
+    def patch(self, module_names=CLOCK_MODULES):
+        import importlib
+        clock = self
+
+        class VirtualDatetime(datetime):
+            # Dates are made by the real class, which sqlite3 can store.
+            def __new__(cls, *args, **kwargs):
+                return datetime(*args, **kwargs)
+
+            @classmethod
+            def utcnow(cls):
+                return clock.utcnow()
+
+            @classmethod
+            def now(cls, tz=None):
+                return clock.utcnow()
+
+            @classmethod
+            def utcfromtimestamp(cls, timestamp):
+                return datetime.utcfromtimestamp(timestamp)
+
+        replacements = {
+            'datetime': VirtualDatetime,
+            'time': VirtualTime(self),
+            'now': lambda: int(clock.now),
+            'cur_sec': lambda: int(clock.now) % 3600,
+            'default_timer': self.time,
+        }
+        saved = []
+        for name in module_names:
+            module = importlib.import_module(name)
+            for attr, value in replacements.iteritems():
+                if hasattr(module, attr):
+                    saved.append((module, attr, getattr(module, attr)))
+                    setattr(module, attr, value)
+        try:
+            yield self
+        finally:
+            for module, attr, value in saved:
+                setattr(module, attr, value)
+
+
+# Stand-in for the time module, on a VirtualClock.
+class VirtualTime(object):
+
+    def __init__(self, clock):
+        self.clock = clock
+
+    def __getattr__(self, name):
+        return getattr(time, name)
+
+    def time(self):
+        return self.clock.time()
+
+    def sleep(self, seconds):
+        self.clock.sleep(seconds)
+
+    def gmtime(self, seconds=None):
+        return time.gmtime(self.clock.now if seconds is None else seconds)
+
+
+# Runs one scheduler over a FakeMap with `workers` simulated workers, from
+# `start` (a unix timestamp) for `duration` seconds. Appearances in the
+# first `warmup` seconds aren't counted in the results.
+class Simulation(object):
+
+    def __init__(self, name, fake_map, args, db, workers=1, start=None,
+                 history_hours=0, warmup=0):
+        self.name = name
+        self.fake_map = fake_map
+        self.args = copy.copy(args)
+        self.args.workers = workers
+        self.args.spawnpoint_scanning = 'nofile'
+        self.args.use_altitude_cache = False
+        self.args.webhooks = []
+        self.args.encounter = False
+        self.db = db
+        self.workers = workers
+        self.start = start or 1496318400  # 2017-06-01 12:00 UTC.
+        self.history_hours = history_hours
+        self.warmup = warmup
+        self.clock = VirtualClock(self.start)
+        self.db_queue = Queue()
+        self.wh_queue = Queue()
+
+    # Empty the scanning tables, then store the past sightings of the map.
+    def reset_db(self):
+        from pogom import altitude, models
+
+        # Offline: no altitude lookups, use --altitude.
+        altitude.fallback_altitude = -1
+        with self.db.atomic():
+            for model in (models.ScanSpawnPoint, models.SpawnPoint,
+                          models.ScannedLocation,
+                          models.SpawnpointDetectionData, models.Pokemon,
+                          models.PokemonHourlyCount,
+                          models.SpawnPointDailyCount,
+                          models.SpawnPointTimeCount):
+                model.delete().execute()
+        models.pokemon_rollups.counted = {}
+        rows = self.fake_map.history(self.start, self.history_hours)
+        for i in range(0, len(rows), 10000):
+            with self.db.atomic():
+                models.sqlite_upsert.write(models.Pokemon,
+                                           rows[i:i + 10000], self.db)
+        if rows:
+            models.backfill_pokemon_rollups(self.db)
+
+    # Write what's on the db_update_queue, as db_updater does.
+    def flush(self):
+        from pogom.dbqueue import UpdateBatch
+        from pogom.models import Pokemon, bulk_upsert, pokemon_rollups
+
+        batch = UpdateBatch()
+        while True:
+            try:
+                batch.add(*self.db_queue.get_nowait())
+            except Empty:
+                break
+        for model, data in batch.items():
+            rollups = pokemon_rollups if model is Pokemon else None
+            bulk_upsert(model, data, self.db, rollups=rollups)
+
+    def run(self, duration):
+        from pogom import config
+
+        # As runserver sets them.
+        config['parse_pokemon'] = not self.args.no_pokemon
+        config['parse_pokestops'] = not self.args.no_pokestops
+        config['parse_gyms'] = not self.args.no_gyms
+        self.reset_db()
+        with self.clock.patch():
+            return self._run(duration)
+
+    def _run(self, duration):
+        from pogom.models import SpawnPoint, parse_map
+        from pogom.schedulers import SchedulerFactory
+
+        clock = self.clock
+        end = self.start + duration
+        center = (self.fake_map.center[0], self.fake_map.center[1], 0)
+        statuses = [{'username': 'worker{}'.format(n),
+                     'latitude': center[0], 'longitude': center[1],
+                     'last_scan_date': clock.utcnow(),
+                     'proxy_url': None} for n in range(self.workers)]
+        scheduler = SchedulerFactory.get_scheduler(
+            self.name, [Queue()], statuses, self.args)
+        hive_cache = getattr(scheduler, 'hive_cache', None)
+        scheduler.location_changed(center, self.db_queue)
+        self.flush()
+
+        stats = {'scans': 0, 'decisions': 0, 'next_item': 0.0,
+                 'schedules': 0, 'schedule': 0.0, 'busy': 0.0, 'idle': 0.0}
+        first_seen = {}
+
+        # Overseer first, then the workers, one second apart.
+        events = [(self.start, 0, None)]
+        events += [(self.start + n + 1, n + 1, status)
+                   for n, status in enumerate(statuses)]
+        heapq.heapify(events)
+        order = len(events)
+        while events:
+            wake, _, status = heapq.heappop(events)
+            if wake >= end:
+                break
+            clock.now = wake
+            if status is None:
+                if scheduler.time_to_refresh_queue():
+                    started = default_timer()
+                    scheduler.schedule()
+                    stats['schedule'] += default_timer() - started
+                    stats['schedules'] += 1
+                    self.flush()
+                heapq.heappush(events, (wake + 1, 0, None))
+                continue
+
+            busy, wait = self._work(scheduler, status, stats, first_seen,
+                                    parse_map, hive_cache)
+            wait = min(wait, end - wake)
+            stats['busy' if busy else 'idle'] += wait
+            order += 1
+            heapq.heappush(events, (wake + wait, order, status))
+
+        # Ground truth: the encounters that appeared after the warmup and
+        # despawned before the end, and when a scan first saw them.
+        delays = []
+        spawns = 0
+        for sp, e in self.fake_map.appearances(self.start + self.warmup, end):
+            if e['despawns'] > end:
+                continue
+            spawns += 1
+            if e['encounter_id'] in first_seen:
+                delays.append(first_seen[e['encounter_id']] - e['appears'])
+
+        ids = [sp['id'] for sp in self.fake_map.spawnpoints]
+        known = SpawnPoint.get_by_ids(ids)
+        tth_found = sum(1 for sp in known.itervalues()
+                        if SpawnPoint.tth_found(sp))
+        worker_time = (stats['busy'] + stats['idle']) or 1
+        return {
+            'scheduler': self.name,
+            'scans': stats['scans'],
+            'spawns': spawns,
+            'reached': len(delays) * 100.0 / (spawns or 1),
+            'delay': sum(delays) / float(len(delays) or 1),
+            'tth': tth_found * 100.0 / (len(ids) or 1),
+            'idle': stats['idle'] * 100.0 / worker_time,
+            'next_item': stats['next_item'] * 1000 / (
+                stats['decisions'] or 1),
+            'schedule': stats['schedule'] * 1000 / (stats['schedules'] or 1),
+        }
+
+    # One pass of the search_worker loop. Returns whether the worker
+    # was scanning, and the seconds until its next pass.
+    def _work(self, scheduler, status, stats, first_seen, parse_map,
+              hive_cache):
+        clock = self.clock
+        if not scheduler.ready:
+            return False, 1
+
+        item = status.pop('early_item', None)
+        if item is None:
+            # next_item blocks on an empty queue until the overseer refills
+            # it, which it checks every second.
+            if (isinstance(scheduler.queues[0], Queue) and
+                    scheduler.queues[0].empty()):
+                return False, 1
+            started = default_timer()
+            item = scheduler.next_item(status)
+            stats['next_item'] += default_timer() - started
+            stats['decisions'] += 1
+            step, step_location, appears, leaves, messages, wait = item
+            if step == -1:
+                return False, wait + scheduler.delay(status['last_scan_date'])
+            if wait:
+                status['early_item'] = item[:5] + (0,)
+                return False, wait
+        step, step_location, appears, leaves, messages, wait = item
+
+        # Too soon? Come back after the 10 second grace period.
+        if appears and clock.now < appears + 10:
+            status['early_item'] = item
+            return False, appears + 10 - clock.now
+
+        # Too late?
+        if leaves and clock.now > (leaves - self.args.min_seconds_left):
+            scheduler.task_done(status)
+            return False, 0
+
+        response, seen = self.fake_map.map_objects(step_location, clock.now)
+        for encounter_id in seen:
+            first_seen.setdefault(encounter_id, clock.now)
+        scan_date = clock.utcnow()
+        status['last_scan_date'] = scan_date
+        status['latitude'] = step_location[0]
+        status['longitude'] = step_location[1]
+        stats['scans'] += 1
+
+        parsed = parse_map(self.args, response, step_location, self.db_queue,
+                           self.wh_queue, None, None, status, scan_date, None,
+                           None, hive_cache)
+        if hive_cache:
+            hive_cache.flush(self.db_queue)
+        self.flush()
+        scheduler.task_done(status, parsed)
+        return True, scheduler.delay(status['last_scan_date'])
@@ -0,0 +1,40 @@
+import unittest
+from pogom import changelog
+
+
+class ChangeLogTest(unittest.TestCase):
+    def setUp(self):
+        self.log = changelog.ChangeLog(4)
+
+    def test_since(self):
+        seq = self.log.current()
+        self.log.append('Pokemon', {'a': {'id': 1}, 'b': {'id': 2}})
+        self.log.append('Pokemon', {'a': {'id': 3}})
+
+        current, changes = self.log.since(seq)
+        self.assertEqual(self.log.current(), current)
+        self.assertEqual({'Pokemon': {'a': {'id': 3}, 'b': {'id': 2}}},
+                         changes)
+
+        # Nothing changed since the last poll.
+        self.assertEqual({}, self.log.since(current)[1])
+
+    def test_fallback(self):
+        seq = self.log.current()
+        self.log.append('Pokemon', dict((i, {}) for i in range(5)))
+
+        # Overwritten by the ring buffer.
+        self.assertIsNone(self.log.since(seq)[1])
+        # Missing, malformed, or from another run.
+        self.assertIsNone(self.log.since(None)[1])
+        self.assertIsNone(self.log.since('garbage')[1])
+        self.assertIsNone(self.log.since('other-1')[1])
+
+    def test_rows_in_viewport(self):
+        rows = [{'latitude': 1.0, 'longitude': 1.0},
+                {'latitude': 5.0, 'longitude': 5.0}]
+        self.assertEqual(rows[:1], changelog.rows_in_viewport(
+            rows, '0.5', '0.5', '1.5', '1.5'))
+        self.assertEqual(rows, changelog.rows_in_viewport(
+            rows, None, None, None, None))
+        self.assertFalse(changelog.any_in_viewport(rows, 2, 2, 3, 3))
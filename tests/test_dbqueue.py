@@ -0,0 +1,91 @@
+import unittest
+from queue import Queue
+
+import fixtures
+from pogom import dbqueue
+
+
+def setUpModule():
+    fixtures.setup()
+
+
+class UpdateBatchTest(unittest.TestCase):
+    def test_merge_keeps_last_write(self):
+        from pogom.models import ScannedLocation, SpawnPoint
+
+        batch = dbqueue.UpdateBatch()
+        batch.add(ScannedLocation, {'a': {'cellid': 'a', 'done': False}})
+        batch.add(SpawnPoint, {'s': {'id': 's', 'kind': 'hhhs'}})
+        batch.add(ScannedLocation, {'a': {'cellid': 'a', 'done': True},
+                                    'b': {'cellid': 'b', 'done': False}})
+        self.assertEqual(3, batch.updates)
+        self.assertEqual(3, len(batch))
+        items = list(batch.items())
+        self.assertEqual([ScannedLocation, SpawnPoint],
+                         [model for model, rows in items])
+        self.assertTrue(items[0][1][('a',)]['done'])
+
+    def test_items_split_by_columns(self):
+        from pogom.models import WorkerStatus
+
+        batch = dbqueue.UpdateBatch()
+        batch.add(WorkerStatus, {'a': {'username': 'a', 'success': 1},
+                                 'b': {'username': 'b'}})
+        self.assertEqual(2, len(list(batch.items())))
+
+    def test_merge_by_primary_key(self):
+        from pogom.models import GymMember, ScannedLocation, WorkerStatus
+
+        q = Queue()
+        # Two scans and two workers queue their single rows as {0: row},
+        # and parse_gyms numbers the members of every call from 0.
+        for n in ('1', '2'):
+            q.put((ScannedLocation, {0: {'cellid': 'cell' + n,
+                                         'done': True}}))
+            q.put((WorkerStatus, {0: {'username': 'worker' + n,
+                                      'success': 1}}))
+            q.put((GymMember, {0: {'gym_id': 'g' + n, 'pokemon_uid': 'a'},
+                               1: {'gym_id': 'g' + n, 'pokemon_uid': 'b'}}))
+        # A later row of the same cell still replaces the earlier one.
+        q.put((ScannedLocation, {5: {'cellid': 'cell1', 'done': False}}))
+        batch = dbqueue.drain(q, 0.01, 100)
+
+        rows = {}
+        for model, data in batch.items():
+            rows.setdefault(model, []).extend(data.values())
+        self.assertEqual({('cell1', False), ('cell2', True)},
+                         set((r['cellid'], r['done'])
+                             for r in rows[ScannedLocation]))
+        self.assertEqual({'worker1', 'worker2'},
+                         set(r['username'] for r in rows[WorkerStatus]))
+        self.assertEqual({('g1', 'a'), ('g1', 'b'), ('g2', 'a'), ('g2', 'b')},
+                         set((r['gym_id'], r['pokemon_uid'])
+                             for r in rows[GymMember]))
+
+
+class DrainTest(unittest.TestCase):
+    def test_drain(self):
+        q = Queue()
+        for i in range(5):
+            q.put(('Pokemon', {i: {'encounter_id': i}}))
+        batch = dbqueue.drain(q, 0.01, 3)
+        self.assertEqual(3, batch.updates)
+        batch = dbqueue.drain(q, 0.01, 100)
+        self.assertEqual(2, batch.updates)
+        self.assertTrue(q.empty())
+
+
+class AdaptiveStepTest(unittest.TestCase):
+    def test_adapts_to_latency(self):
+        steps = dbqueue.AdaptiveStep(100, 10, 400, target=1.0)
+        self.assertEqual(100, steps.get('Pokemon'))
+        # Fast and full statements grow the step.
+        self.assertEqual(200, steps.update('Pokemon', 500, 0.5))
+        self.assertEqual(400, steps.update('Pokemon', 1000, 0.5))
+        self.assertEqual(400, steps.update('Pokemon', 1000, 0.5))
+        # Small batches don't say anything about larger statements.
+        self.assertEqual(400, steps.update('Pokemon', 10, 0.0))
+        # Slow statements shrink it.
+        self.assertEqual(200, steps.update('Pokemon', 400, 2.0))
+        self.assertEqual(200, steps.get('Pokemon'))
+        self.assertEqual(100, steps.get('SpawnPoint'))
@@ -0,0 +1,90 @@
+import logging
+import threading
+import unittest
+from datetime import datetime
+from queue import Queue
+
+import fixtures
+
+db = None
+
+
+def setUpModule():
+    global db
+    app, db = fixtures.init_db()
+
+
+class Broken(object):
+    pass
+
+
+class DbUpdaterTest(unittest.TestCase):
+    def setUp(self):
+        from pogom import models
+
+        write = models.bulk_upsert
+
+        def bulk_upsert(cls, data, db, **kwargs):
+            if cls is Broken:
+                raise ValueError('broken')
+            return write(cls, data, db, **kwargs)
+
+        models.bulk_upsert = bulk_upsert
+        self.addCleanup(setattr, models, 'bulk_upsert', write)
+        logging.getLogger('pogom.models').setLevel(logging.CRITICAL)
+        self.addCleanup(logging.getLogger('pogom.models').setLevel,
+                        logging.NOTSET)
+
+    def test_failing_model(self):
+        from pogom.models import Pokestop, db_updater
+        from pogom.utils import get_args
+
+        q = Queue()
+        t = threading.Thread(target=db_updater, args=(get_args(), q, db))
+        t.daemon = True
+        t.start()
+        q.put((Broken, {'a': {'id': 'a'}}))
+        q.put((Pokestop, {'p': {
+            'pokestop_id': 'p', 'enabled': True, 'latitude': 40.0,
+            'longitude': -73.0, 'last_modified': datetime.utcnow(),
+            'lure_expiration': None, 'active_fort_modifier': None}}))
+
+        # The queue is done with both updates, and the rows of the model
+        # that could be written are stored.
+        joined = threading.Event()
+        waiter = threading.Thread(target=lambda: (q.join(), joined.set()))
+        waiter.daemon = True
+        waiter.start()
+        self.assertTrue(joined.wait(10))
+        self.assertEqual(1, Pokestop.select().where(
+            Pokestop.pokestop_id == 'p').count())
+
+
+# Fails every write, like a database that's gone.
+class FailingUpsert(object):
+    def __init__(self):
+        self.tries = 0
+
+    def write(self, cls, rows, db, step=None):
+        self.tries += 1
+        raise ValueError('server has gone away')
+
+
+class BulkUpsertTest(unittest.TestCase):
+    def test_retries_capped(self):
+        from pogom import models
+
+        failing = FailingUpsert()
+        for name, value in (('sqlite_upsert', failing),
+                            ('mysql_upsert', failing),
+                            ('UPSERT_RETRY_DELAY', 0)):
+            self.addCleanup(setattr, models, name, getattr(models, name))
+            setattr(models, name, value)
+        logging.getLogger('pogom.models').setLevel(logging.CRITICAL)
+        self.addCleanup(logging.getLogger('pogom.models').setLevel,
+                        logging.NOTSET)
+
+        with self.assertRaises(ValueError):
+            models.bulk_upsert(models.Pokestop, {'p': {'pokestop_id': 'p'}},
+                               db)
+        self.assertEqual(models.UPSERT_ATTEMPTS, failing.tries)
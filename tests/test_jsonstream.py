@@ -0,0 +1,141 @@
+import calendar
+import copy
+import json
+import unittest
+import zlib
+from datetime import datetime
+from pogom import jsonstream
+
+import fixtures
+
+app = None
+
+
+def setUpModule():
+    global app
+    app, db = fixtures.init_db()
+
+
+class JSONStreamTest(unittest.TestCase):
+    def setUp(self):
+        self.encoder = json.JSONEncoder(separators=(',', ':'))
+        self.when = datetime(2017, 6, 1, 12, 30, 15, 123456)
+        self.millis = (calendar.timegm(self.when.timetuple()) * 1000 +
+                       self.when.microsecond / 1000)
+
+    def response(self, count):
+        return {
+            'pokemons': [{'id': i, 'disappear_time': self.when}
+                         for i in range(count)],
+            'gyms': dict(('g{}'.format(i), {'id': i}) for i in range(count)),
+            'timestamp': 1,
+            'oSwLat': None
+        }
+
+    def test_epoch_millis(self):
+        self.assertEqual(self.millis, jsonstream.epoch_millis(self.when))
+
+    def test_iter_json(self):
+        # Empty lists, exact and partial chunks.
+        for count in (0, 3, 4, 5):
+            text = ''.join(jsonstream.iter_json(self.response(count),
+                                                self.encoder, 2))
+            d = json.loads(text)
+            self.assertEqual(range(count), [p['id'] for p in d['pokemons']])
+            self.assertEqual(count, len(d['gyms']))
+            self.assertEqual(1, d['timestamp'])
+            self.assertIsNone(d['oSwLat'])
+            if count:
+                self.assertEqual(self.millis,
+                                 d['pokemons'][0]['disappear_time'])
+
+    def test_iterators(self):
+        response = self.response(5)
+        expected = json.loads(''.join(jsonstream.iter_json(
+            copy.deepcopy(response), self.encoder)))
+        response['pokemons'] = iter(response['pokemons'])
+        response['gyms'] = jsonstream.ObjectStream(
+            response['gyms'].iteritems())
+        text = ''.join(jsonstream.iter_json(response, self.encoder, 2))
+        self.assertEqual(expected, json.loads(text))
+
+        d = jsonstream.collect({'pokemons': iter([{'id': 1}]),
+                                'gyms': jsonstream.ObjectStream([('g', {})]),
+                                'scanned': []})
+        self.assertEqual({'pokemons': [{'id': 1}], 'gyms': {'g': {}},
+                          'scanned': []}, d)
+
+    def test_gzip_stream(self):
+        chunks = list(jsonstream.iter_json(self.response(10), self.encoder))
+        data = ''.join(jsonstream.gzip_stream(chunks))
+        self.assertEqual(''.join(chunks),
+                         zlib.decompress(data, 16 + zlib.MAX_WBITS))
+
+
+class RawDataTest(unittest.TestCase):
+    def setUp(self):
+        from pogom import models
+        from pogom.models import (Gym, GymDetails, GymMember, GymPokemon,
+                                  SpawnPointTimeCount, Trainer)
+
+        # Members are read for a couple of Gyms at a time.
+        self.addCleanup(setattr, models, 'GYM_CHUNK', models.GYM_CHUNK)
+        models.GYM_CHUNK = 2
+
+        now = datetime.utcnow()
+        Gym.insert_many([
+            {'gym_id': 'stream-g{}'.format(i), 'team_id': 1,
+             'guard_pokemon_id': 1, 'gym_points': 100, 'enabled': True,
+             'latitude': 10.0 + i / 1000.0, 'longitude': 10.0,
+             'last_modified': datetime(2017, 6, 1)}
+            for i in range(5)]).execute()
+        GymDetails.insert_many([
+            {'gym_id': 'stream-g{}'.format(i), 'name': 'Gym {}'.format(i),
+             'url': ''} for i in range(5)]).execute()
+        Trainer.insert(name='stream-t', team=1, level=20).execute()
+        GymPokemon.insert_many([
+            {'pokemon_uid': 'stream-p{}'.format(i), 'pokemon_id': 1,
+             'cp': 10 * i, 'trainer_name': 'stream-t'}
+            for i in range(5)]).execute()
+        GymMember.insert_many([
+            {'gym_id': 'stream-g{}'.format(i % 4),
+             'pokemon_uid': 'stream-p{}'.format(i), 'last_scanned': now}
+            for i in range(5)]).execute()
+        # Two despawn times for the first spawnpoint.
+        SpawnPointTimeCount.insert_many([
+            {'spawnpoint_id': 'stream-s{}'.format(i % 3), 'latitude': 10.0,
+             'longitude': 10.0 + i / 1000.0, 'time': 60 * i, 'count': i + 1}
+            for i in range(4)]).execute()
+
+    def get(self, stream):
+        from pogom.utils import get_args
+
+        args = get_args()
+        self.addCleanup(setattr, args, 'stream_json', args.stream_json)
+        args.stream_json = stream
+
+        response = app.test_client().get(
+            '/raw_data?swLat=9.9&swLng=9.9&neLat=10.1&neLng=10.1'
+            '&spawnpoints=true&pokemon=false&scanned=false')
+        return json.loads(response.get_data())
+
+    def test_streamed_like_collected(self):
+        streamed = self.get(True)
+        collected = self.get(False)
+        for d in (streamed, collected):
+            del d['timestamp']
+            d['spawnpoints'].sort(key=lambda sp: sp['spawnpoint_id'])
+        self.assertEqual(collected, streamed)
+
+        gyms = streamed['gyms']
+        self.assertEqual(5, len(gyms))
+        self.assertEqual('Gym 4', gyms['stream-g4']['name'])
+        self.assertEqual([0, 40], [p['pokemon_cp']
+                                   for p in gyms['stream-g0']['pokemon']])
+        self.assertEqual([], gyms['stream-g4']['pokemon'])
+        spawnpoints = streamed['spawnpoints']
+        self.assertEqual(['stream-s0', 'stream-s1', 'stream-s2'],
+                         [sp['spawnpoint_id'] for sp in spawnpoints])
+        # The most seen despawn time, for a location seen with two.
+        self.assertTrue(spawnpoints[0]['special'])
+        self.assertEqual((180 + 2700) % 3600, spawnpoints[0]['time'])
@@ -0,0 +1,194 @@
+import itertools
+import threading
+import unittest
+from collections import deque
+from queue import Queue
+
+import fixtures
+
+
+def setUpModule():
+    fixtures.setup()
+
+
+# A hash server with keys of `sizes` RPM, whose periods end `offsets`
+# seconds into the first minute, with what's left of them by then. Counts
+# the requests it throttled, and the ones it throttled while another key
+# still had requests left.
+class SimulatedHashServer(object):
+
+    def __init__(self, sizes, offsets, expirations=None):
+        self.maximum = dict(sizes)
+        self.remaining = dict((key, sizes[key] * offsets[key] // 60)
+                              for key in sizes)
+        self.period = dict(offsets)
+        self.expirations = expirations or {}
+        self.served = dict((key, 0) for key in sizes)
+        self.throttled = 0
+        self.early = 0
+
+    def request(self, key, now):
+        for k in self.period:
+            while now >= self.period[k]:
+                self.period[k] += 60
+                self.remaining[k] = self.maximum[k]
+        if self.remaining[key] > 0:
+            self.remaining[key] -= 1
+            self.served[key] += 1
+        else:
+            self.throttled += 1
+            if any(self.remaining.values()):
+                self.early += 1
+        return {'token': key, 'remaining': self.remaining[key],
+                'maximum': self.maximum[key], 'period': self.period[key],
+                'expiration': self.expirations.get(key, 2000000000)}
+
+
+# Take in the status of a request and give its key back, as the search
+# workers do.
+def report(scheduler):
+    def update(key, status):
+        scheduler.update(key, status)
+        scheduler.done(key)
+    return update
+
+
+# Send `rate` requests per second for `seconds`, picking keys with
+# `next_key`. Reports reach `update` `in_flight` requests late, as they
+# would with that many workers.
+def simulate(server, next_key, update, clock, rate, seconds, in_flight=20):
+    reports = deque()
+    for n in range(int(rate * seconds)):
+        clock[0] = n / float(rate)
+        key = next_key()
+        reports.append((key, server.request(key, clock[0])))
+        if len(reports) > in_flight:
+            update(*reports.popleft())
+    while reports:
+        update(*reports.popleft())
+
+
+SIZES = {'small': 150, 'medium': 400, 'large': 1200, 'huge': 3000}
+OFFSETS = {'small': 10, 'medium': 25, 'large': 40, 'huge': 55}
+CAPACITY = sum(SIZES.values())
+
+
+class KeySchedulerTest(unittest.TestCase):
+    def scheduler(self, clock):
+        from pogom.schedulers import KeyScheduler
+
+        return KeyScheduler(sorted(SIZES), Queue(), clock=lambda: clock[0])
+
+    def test_no_throttling_below_capacity(self):
+        clock = [0]
+        scheduler = self.scheduler(clock)
+        server = SimulatedHashServer(SIZES, OFFSETS)
+        simulate(server, scheduler.next, report(scheduler), clock,
+                 CAPACITY * 0.98 / 60, 300)
+        self.assertEqual(0, server.throttled)
+        utilization = scheduler.utilization()
+        self.assertEqual(sum(server.served.values()),
+                         sum(u['handed'] for u in utilization.values()))
+        self.assertEqual(0, sum(u['pending'] for u in utilization.values()))
+
+        # Round robin runs the small keys out at the same load.
+        clock = [0]
+        server = SimulatedHashServer(SIZES, OFFSETS)
+        cycle = itertools.cycle(sorted(SIZES))
+        simulate(server, cycle.next, lambda key, status: None, clock,
+                 CAPACITY * 0.98 / 60, 300)
+        self.assertGreater(server.early, CAPACITY)
+
+    def test_over_capacity(self):
+        clock = [0]
+        scheduler = self.scheduler(clock)
+        server = SimulatedHashServer(SIZES, OFFSETS)
+        simulate(server, scheduler.next, report(scheduler), clock,
+                 CAPACITY * 1.5 / 60, 300)
+        # Throttled once every key is out of requests, but not before.
+        self.assertGreater(server.throttled, 0)
+        self.assertLess(server.early, CAPACITY * 0.01)
+        self.assertGreater(sum(server.served.values()), CAPACITY * 4.9)
+
+    def test_expired_key(self):
+        clock = [0]
+        scheduler = self.scheduler(clock)
+        server = SimulatedHashServer(SIZES, OFFSETS, {'huge': 30})
+        simulate(server, scheduler.next, report(scheduler), clock, 20, 120)
+        handed = scheduler.utilization()['huge']['handed']
+        server_served = server.served['huge']
+        self.assertEqual(handed, server_served)
+        # Only used until it expired, and the rest picked up the load.
+        self.assertLess(handed, 30 * 20)
+        self.assertEqual(0, server.throttled)
+
+    def test_threads(self):
+        clock = [0]
+        scheduler = self.scheduler(clock)
+        server = SimulatedHashServer(SIZES, OFFSETS)
+        lock = threading.Lock()
+
+        def work():
+            for _ in range(400):
+                key = scheduler.next()
+                with lock:
+                    status = server.request(key, clock[0])
+                scheduler.update(key, status)
+                scheduler.done(key)
+
+        threads = [threading.Thread(target=work) for _ in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        utilization = scheduler.utilization()
+        # All in the first periods, which have 3741 requests left.
+        self.assertEqual(3200, sum(u['handed'] for u in utilization.values()))
+        self.assertEqual(0, sum(u['pending'] for u in utilization.values()))
+        self.assertEqual(0, server.throttled)
+
+    def test_missing_reports(self):
+        clock = [0]
+        scheduler = self.scheduler(clock)
+        server = SimulatedHashServer(SIZES, OFFSETS)
+        count = itertools.count()
+
+        # Every third scan fails before it reports, but still gives its
+        # key back.
+        def update(key, status):
+            if next(count) % 3:
+                scheduler.update(key, status)
+            scheduler.done(key)
+
+        simulate(server, scheduler.next, update, clock,
+                 CAPACITY * 0.95 / 60, 300)
+        self.assertEqual(0, server.throttled)
+        utilization = scheduler.utilization()
+        self.assertEqual(0, sum(u['pending'] for u in utilization.values()))
+
+    def test_misattributed_reports(self):
+        clock = [0]
+        scheduler = self.scheduler(clock)
+        server = SimulatedHashServer(SIZES, OFFSETS)
+        count = itertools.count()
+        last = [None]
+
+        # HashServer.status is shared by the workers, so a scan can find
+        # the status of another worker's request in it: every fourth one
+        # gets the status of the request before.
+        def update(key, status):
+            if next(count) % 4 == 0 and last[0] is not None:
+                status, last[0] = last[0], status
+            else:
+                last[0] = status
+            scheduler.update(key, status)
+            scheduler.done(key)
+
+        simulate(server, scheduler.next, update, clock,
+                 CAPACITY * 0.95 / 60, 300)
+        self.assertEqual(0, server.throttled)
+        utilization = scheduler.utilization()
+        self.assertEqual(0, sum(u['pending'] for u in utilization.values()))
+        # Only statuses of the key were taken in.
+        for key, u in utilization.items():
+            self.assertEqual(SIZES[key], u['maximum'])
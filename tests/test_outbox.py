@@ -0,0 +1,148 @@
+import logging
+import os
+import shutil
+import tempfile
+import unittest
+
+from pogom.outbox import Outbox
+
+
+def message(n):
+    return {'type': 'pokemon', 'message': {'encounter_id': n,
+                                           'padding': 'x' * 100}}
+
+
+def ids(records):
+    return [data['message']['encounter_id'] for _, data in records]
+
+
+def segment_files(path):
+    return sorted(name for name in os.listdir(path) if name.endswith('.seg'))
+
+
+class OutboxTest(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        logging.getLogger('pogom.outbox').setLevel(logging.ERROR)
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_read_commit(self):
+        outbox = Outbox(self.path, segment_bytes=1000)
+        outbox.register(['a', 'b'])
+        for n in range(30):
+            outbox.append(message(n))
+        self.assertGreater(len(segment_files(self.path)), 3)
+
+        # Reads go across segments, and only commits move the cursor.
+        records, offset = outbox.read('a', 20)
+        self.assertEqual(range(20), ids(records))
+        self.assertEqual(range(20), ids(outbox.read('a', 20)[0]))
+        outbox.commit('a', offset)
+        self.assertEqual(range(20, 30), ids(outbox.read('a', 20)[0]))
+        self.assertEqual(range(30), ids(outbox.read('b', 50)[0]))
+        outbox.close()
+
+    def test_restart(self):
+        outbox = Outbox(self.path, segment_bytes=1000)
+        outbox.register(['a'])
+        for n in range(10):
+            outbox.append(message(n))
+        records, offset = outbox.read('a', 4)
+        outbox.commit('a', offset)
+        outbox.close()
+
+        # A record cut short by a crash is dropped.
+        last = os.path.join(self.path, segment_files(self.path)[-1])
+        with open(last, 'ab') as f:
+            f.write('\x00\x00\x01\x00abc')
+
+        outbox = Outbox(self.path, segment_bytes=1000)
+        outbox.register(['a', 'new'])
+        outbox.append(message(10))
+        self.assertEqual(range(4, 11), ids(outbox.read('a', 50)[0]))
+        # New readers start at the end.
+        self.assertEqual([10], ids(outbox.read('new', 50)[0]))
+        outbox.close()
+
+    def test_cursor_past_recovered_end(self):
+        outbox = Outbox(self.path, segment_bytes=10000)
+        outbox.register(['a', 'b'])
+        for n in range(10):
+            outbox.append(message(n))
+        records, offset = outbox.read('a', 8)
+        outbox.commit('a', offset)
+        outbox.close()
+
+        # The segment lost its last records and half of another one, which
+        # 'a' had already read.
+        last = os.path.join(self.path, segment_files(self.path)[-1])
+        size = os.path.getsize(last)
+        with open(last, 'r+b') as f:
+            f.truncate(size * 5 // 10 + 20)
+
+        outbox = Outbox(self.path, segment_bytes=10000)
+        outbox.register(['a', 'b'])
+        self.assertEqual(range(5), ids(outbox.read('b', 50)[0]))
+        self.assertEqual([], outbox.read('a', 50)[0])
+        outbox.append(message(10))
+        self.assertEqual([10], ids(outbox.read('a', 50)[0]))
+        outbox.close()
+
+    def test_cursors_replaced_without_overwriting(self):
+        from pogom import outbox as module
+
+        rename = os.rename
+
+        # Like Windows, which can't rename a file over another.
+        def windows_rename(src, dst):
+            if os.path.exists(dst):
+                raise OSError(17, 'File exists')
+            rename(src, dst)
+
+        self.addCleanup(setattr, module.os, 'rename', rename)
+        module.os.rename = windows_rename
+        outbox = Outbox(self.path, segment_bytes=1000)
+        outbox.register(['a'])
+        for n in range(5):
+            outbox.append(message(n))
+        records, offset = outbox.read('a', 2)
+        outbox.commit('a', offset)
+        outbox.close()
+        module.os.rename = rename
+
+        outbox = Outbox(self.path, segment_bytes=1000)
+        outbox.register(['a'])
+        self.assertEqual(range(2, 5), ids(outbox.read('a', 50)[0]))
+        outbox.close()
+
+    def test_consumed_segments_deleted(self):
+        outbox = Outbox(self.path, segment_bytes=1000)
+        outbox.register(['a', 'b'])
+        for n in range(30):
+            outbox.append(message(n))
+        segments = len(segment_files(self.path))
+        records, offset = outbox.read('a', 30)
+        outbox.commit('a', offset)
+        # 'b' still needs them.
+        self.assertEqual(segments, len(segment_files(self.path)))
+        records, offset = outbox.read('b', 30)
+        outbox.commit('b', offset)
+        self.assertEqual(1, len(segment_files(self.path)))
+        self.assertEqual([], outbox.read('a', 30)[0])
+        outbox.close()
+
+    def test_size_limit(self):
+        outbox = Outbox(self.path, max_bytes=3000, segment_bytes=1000)
+        outbox.register(['a'])
+        for n in range(100):
+            outbox.append(message(n))
+
+        # The oldest messages were dropped, the rest are still there.
+        self.assertLessEqual(len(segment_files(self.path)), 4)
+        records, _ = outbox.read('a', 100)
+        self.assertEqual(range(100 - len(records), 100), ids(records))
+        self.assertEqual(100 - len(records), outbox.take_lost('a'))
+        self.assertEqual(0, outbox.take_lost('a'))
+        outbox.close()
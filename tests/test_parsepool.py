@@ -0,0 +1,67 @@
+import copy
+import logging
+import time
+import unittest
+from queue import Queue
+
+import fixtures
+
+app = db = None
+
+
+def setUpModule():
+    global app, db
+    app, db = fixtures.init_db()
+    logging.getLogger('pogom').setLevel(logging.ERROR)
+
+
+def drain(queue):
+    items = []
+    while not queue.empty():
+        items.append(queue.get())
+    return items
+
+
+class ParsePoolTest(unittest.TestCase):
+    def setUp(self):
+        from pogom import altitude, config
+        from pogom.fakemap import FakeMap
+        from pogom.parsepool import ParsePool
+
+        config['parse_pokemon'] = True
+        config['parse_pokestops'] = True
+        config['parse_gyms'] = True
+        # No altitude lookups.
+        altitude.fallback_altitude = -1
+        self.fake_map = FakeMap((40.0, -73.0), 150, 24, seed=3, pokestops=5,
+                                gyms=3)
+        self.pool = ParsePool(2)
+
+    def tearDown(self):
+        self.pool.close()
+
+    def test_same_as_parse_map(self):
+        from pogom.models import parse_map
+        from pogom.utils import get_args
+
+        args = get_args()
+        loc = (40.0, -73.0, 0)
+        response, _ = self.fake_map.map_objects(loc, time.time())
+        db_queue, wh_queue = Queue(), Queue()
+        parsed = parse_map(args, copy.deepcopy(response), loc, db_queue,
+                           wh_queue, None, None, {}, None, None, None)
+        pool_db_queue, pool_wh_queue = Queue(), Queue()
+        pool_parsed = self.pool.parse(args, response, loc, pool_db_queue,
+                                      pool_wh_queue, None)
+
+        self.assertEqual(parsed, pool_parsed)
+        self.assertTrue(parsed['sp_id_list'])
+        self.assertEqual(drain(db_queue), drain(pool_db_queue))
+        self.assertEqual(drain(wh_queue), drain(pool_wh_queue))
+
+    def test_failure(self):
+        from pogom.utils import get_args
+
+        with self.assertRaisesRegexp(Exception, 'Parse process failed'):
+            self.pool.parse(get_args(), {'responses': {}}, (40.0, -73.0, 0),
+                            Queue(), Queue(), None)
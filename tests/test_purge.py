@@ -0,0 +1,61 @@
+import unittest
+from datetime import datetime, timedelta
+from peewee import SqliteDatabase, Model, CharField, DateTimeField
+from pogom.purge import ChunkedPurge
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 0.0
+        self.slept = []
+
+    def timer(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.slept.append(seconds)
+        self.now += seconds
+
+
+class ChunkedPurgeTest(unittest.TestCase):
+    def setUp(self):
+        self.db = SqliteDatabase(':memory:')
+
+        class Sighting(Model):
+            id = CharField(primary_key=True)
+            seen = DateTimeField(index=True)
+
+            class Meta:
+                database = self.db
+
+        self.Sighting = Sighting
+        self.db.create_table(Sighting)
+        self.now = datetime(2017, 6, 1)
+        with self.db.atomic():
+            for i in range(250):
+                Sighting.create(id='s{}'.format(i),
+                                seen=self.now - timedelta(minutes=i))
+
+    def test_deletes_old_rows_in_chunks(self):
+        clock = FakeClock()
+        purge = ChunkedPurge(self.Sighting, self.Sighting.seen, chunk=30,
+                             sleep=clock.sleep, timer=clock.timer)
+        # Rows 101 to 249 minutes old.
+        rows, more = purge.run(self.now - timedelta(minutes=100))
+        self.assertEqual((149, False), (rows, more))
+        self.assertEqual(101, self.Sighting.select().count())
+        self.assertEqual([], clock.slept)
+        self.assertEqual((0, False), purge.run(self.now - timedelta(
+            minutes=100)))
+
+    def test_rate_and_time_limit(self):
+        clock = FakeClock()
+        purge = ChunkedPurge(self.Sighting, self.Sighting.seen, chunk=50,
+                             rate=100, sleep=clock.sleep, timer=clock.timer)
+        # Each chunk of 50 waits half a second, stops after a second.
+        rows, more = purge.run(self.now, max_seconds=1)
+        self.assertEqual((100, True), (rows, more))
+        self.assertEqual([0.5, 0.5], clock.slept)
+        rows, more = purge.run(self.now)
+        self.assertEqual((149, False), (rows, more))
+        self.assertEqual(1, self.Sighting.select().count())
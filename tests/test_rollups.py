@@ -0,0 +1,179 @@
+import unittest
+from datetime import datetime, timedelta
+from peewee import fn
+from pogom.rollups import Rollups, aggregate, merge
+
+import fixtures
+
+
+def pokemon(encounter_id, pokemon_id, spawnpoint_id, disappear_time):
+    return {'encounter_id': encounter_id, 'pokemon_id': pokemon_id,
+            'spawnpoint_id': spawnpoint_id, 'latitude': 40.0,
+            'longitude': -73.0 - len(encounter_id) / 100.0,
+            'disappear_time': disappear_time}
+
+
+class RollupsTest(unittest.TestCase):
+    def setUp(self):
+        self.now = datetime(2017, 6, 1, 12, 30)
+
+    def test_aggregate_and_merge(self):
+        rows = [pokemon('a', 1, 'sp1', self.now),
+                pokemon('bb', 1, 'sp2', self.now + timedelta(minutes=10)),
+                pokemon('c', 1, 'sp1', self.now + timedelta(hours=6)),
+                pokemon('d', 2, 'sp1', self.now)]
+        seen, appearances, spawn_times = aggregate(rows)
+
+        hour = datetime(2017, 6, 1, 12)
+        self.assertEqual(3, len(seen))
+        self.assertEqual(2, seen[(hour, 1)]['count'])
+        # The location of the latest one.
+        self.assertEqual(-73.02, seen[(hour, 1)]['longitude'])
+        day = datetime(2017, 6, 1)
+        self.assertEqual(2, appearances[(day, 1, 'sp1')]['count'])
+        self.assertEqual(3, len(appearances))
+        # Despawn seconds per spawnpoint location.
+        self.assertEqual(3, spawn_times[('sp1', 40.0, -73.01, 1800)]['count'])
+        self.assertEqual(2, len(spawn_times))
+
+        stored = {(hour, 1): {'count': 5,
+                              'disappear_time': self.now + timedelta(
+                                  minutes=20),
+                              'latitude': 41.0, 'longitude': -74.0},
+                  (hour, 3): {'count': 1}}
+        merge(seen, stored)
+        self.assertEqual(7, seen[(hour, 1)]['count'])
+        self.assertEqual(41.0, seen[(hour, 1)]['latitude'])
+        self.assertNotIn((hour, 3), seen)
+
+    def test_counts_encounters_once(self):
+        written = []
+        stored = set(['old'])
+        rollups = Rollups(lambda ids: [i for i in ids if i in stored],
+                          lambda seen, appearances, times, db: written.append(
+                              sum(r['count'] for r in seen.values())))
+        rows = [pokemon(key, 1, 'sp1', self.now) for key in ('old', 'a', 'b')]
+        self.assertEqual(3, len(rollups.add(rows, None)))
+        self.assertEqual([2], written)
+
+        # Counted again until the write is committed.
+        rollups.add(rows, None)
+        self.assertEqual([2, 2], written)
+        rollups.committed(rows)
+        # Seen again in the next scan.
+        self.assertEqual([], rollups.add(rows, None))
+        self.assertEqual([2, 2], written)
+
+
+class SpawnpointsTest(unittest.TestCase):
+    def test_zero_bounds(self):
+        fixtures.init_db()
+        from pogom.models import Pokemon, SpawnPointTimeCount
+
+        SpawnPointTimeCount.insert_many([
+            {'spawnpoint_id': 'zero-in', 'latitude': 0.5, 'longitude': 0.5,
+             'time': 0, 'count': 1},
+            {'spawnpoint_id': 'zero-out', 'latitude': -0.5,
+             'longitude': -0.5, 'time': 0, 'count': 1}]).execute()
+
+        # A viewport with its south west corner on 0,0 still filters.
+        self.assertEqual(['zero-in'], [
+            sp['spawnpoint_id']
+            for sp in Pokemon.get_spawnpoints(0.0, 0.0, 1.0, 1.0)])
+
+
+# The queries get_seen() and get_appearances() ran on the pokemon table
+# before the rollup tables.
+def direct_seen(timediff):
+    from pogom.models import Pokemon
+
+    timediff = datetime.utcnow() - timediff
+    counts = (Pokemon
+              .select(Pokemon.pokemon_id,
+                      fn.COUNT(Pokemon.pokemon_id).alias('count'),
+                      fn.MAX(Pokemon.disappear_time).alias('lastappeared'))
+              .where(Pokemon.disappear_time > timediff)
+              .group_by(Pokemon.pokemon_id)
+              .alias('counttable'))
+    return (Pokemon
+            .select(Pokemon.pokemon_id, Pokemon.disappear_time,
+                    Pokemon.latitude, Pokemon.longitude, counts.c.count)
+            .join(counts, on=(Pokemon.pokemon_id == counts.c.pokemon_id))
+            .distinct()
+            .where(Pokemon.disappear_time == counts.c.lastappeared)
+            .dicts())
+
+
+def direct_appearances(pokemon_id, timediff):
+    from pogom.models import Pokemon
+
+    timediff = datetime.utcnow() - timediff
+    return (Pokemon
+            .select(Pokemon.latitude, Pokemon.longitude, Pokemon.pokemon_id,
+                    fn.Count(Pokemon.spawnpoint_id).alias('count'),
+                    Pokemon.spawnpoint_id)
+            .where((Pokemon.pokemon_id == pokemon_id) &
+                   (Pokemon.disappear_time > timediff))
+            .group_by(Pokemon.latitude, Pokemon.longitude,
+                      Pokemon.pokemon_id, Pokemon.spawnpoint_id)
+            .dicts())
+
+
+class RollupQueriesTest(unittest.TestCase):
+    species = (201, 202, 203)
+
+    def setUp(self):
+        app, db = fixtures.init_db()
+        from pogom import models
+        from pogom.models import Pokemon, bulk_upsert, pokemon_rollups
+
+        self.addCleanup(models.cache.clear)
+        models.cache.clear()
+
+        # Pokemon over the last three days and a few still active, none
+        # of them close to the cutoffs compared below.
+        now = datetime.utcnow().replace(microsecond=0)
+        rows = {}
+        for i in range(-2, 110):
+            sp = i % 4
+            rows['rq-{}'.format(i)] = {
+                'encounter_id': 'rq-{}'.format(i),
+                'spawnpoint_id': 'rq-sp{}'.format(sp),
+                'pokemon_id': self.species[i % 3],
+                'latitude': 20.0 + sp / 1000.0,
+                'longitude': 20.0 - sp / 1000.0,
+                'disappear_time': now - timedelta(minutes=37 * i, seconds=13),
+                'last_modified': now}
+
+        # Scans overlap, their Pokemon are only counted once.
+        keys = sorted(rows)
+        for batch in (keys[:60], keys[40:], keys[::3]):
+            bulk_upsert(Pokemon, dict((k, dict(rows[k])) for k in batch), db,
+                        rollups=pokemon_rollups)
+
+    def test_matches_pokemon_table(self):
+        from pogom.models import Pokemon
+
+        for timediff in (timedelta(hours=1), timedelta(hours=6),
+                         timedelta(days=1), timedelta(days=7)):
+            seen = dict((p['pokemon_id'], (p['count'], p['disappear_time'],
+                                           p['latitude'], p['longitude']))
+                        for p in Pokemon.get_seen(timediff)['pokemon']
+                        if p['pokemon_id'] in self.species)
+            direct = dict((p['pokemon_id'], (p['count'], p['disappear_time'],
+                                             p['latitude'], p['longitude']))
+                          for p in direct_seen(timediff)
+                          if p['pokemon_id'] in self.species)
+            self.assertTrue(direct)
+            self.assertEqual(direct, seen)
+
+            for pokemon_id in self.species:
+                appearances = sorted(
+                    (p['latitude'], p['longitude'], p['spawnpoint_id'],
+                     int(p['count']))
+                    for p in Pokemon.get_appearances(pokemon_id, timediff))
+                direct = sorted(
+                    (p['latitude'], p['longitude'], p['spawnpoint_id'],
+                     int(p['count']))
+                    for p in direct_appearances(pokemon_id, timediff))
+                self.assertEqual(direct, appearances)
@@ -0,0 +1,138 @@
+import random
+import unittest
+from pogom.scanqueue import ScanQueue
+from pogom.utils import equi_rect_distance
+
+KINDS = ('band', 'TTH', 'spawn')
+
+
+# The linear scan SpeedScan.next_item used to do, without the parking.
+def linear_best(queue, worker_loc, ms, secs_waited, kph):
+    best = {}
+    for i, item in enumerate(queue):
+        if item.get('done', False) or ms > item['end']:
+            continue
+        distance = equi_rect_distance(item['loc'], worker_loc)
+        secs_to_arrival = max(distance / kph * 3600 - secs_waited, 0)
+        if ms + secs_to_arrival < item['start']:
+            continue
+        if ms + secs_to_arrival > item['end']:
+            continue
+        score = 1e12 if item['kind'] == 'band' else (
+            1e6 if item['kind'] == 'TTH' else 1)
+        score = score / (distance + .01)
+        if score > best.get('score', 0):
+            best = {'score': score, 'i': i, 'distance': distance}
+    return best
+
+
+def make_queue(rand, size):
+    queue = []
+    for step in range(size):
+        start = rand.randint(0, 3600)
+        queue.append({
+            'loc': (40.0 + rand.uniform(-0.04, 0.04),
+                    -73.0 + rand.uniform(-0.05, 0.05), 0),
+            'kind': rand.choice(KINDS),
+            'start': start,
+            'end': start + rand.randint(60, 900),
+            'step': step,
+            'sp': 'sp{}'.format(step % 50)})
+    queue.sort(key=lambda item: item['start'])
+    return queue
+
+
+class ScanQueueTest(unittest.TestCase):
+    def test_best_matches_linear_scan(self):
+        rand = random.Random(7)
+        kph = 35
+        for size in (0, 1, 20, 500):
+            queue = make_queue(rand, size)
+            index = ScanQueue(queue)
+            ms = 0
+            for _ in range(200):
+                ms += rand.randint(0, 30)
+                worker_loc = (40.0 + rand.uniform(-0.05, 0.05),
+                              -73.0 + rand.uniform(-0.06, 0.06))
+                secs_waited = rand.randint(0, 60)
+                index.advance(ms, index.horizon(worker_loc, kph))
+                expected = linear_best(queue, worker_loc, ms, secs_waited,
+                                       kph)
+                best = index.best(worker_loc, secs_waited, kph, 'worker')
+                self.assertEqual(bool(expected), bool(best))
+                if best:
+                    self.assertEqual(queue[expected['i']]['kind'],
+                                     best['item']['kind'])
+                    self.assertAlmostEqual(expected['distance'],
+                                           best['distance'])
+                    # Claim it, like next_item does.
+                    best['item']['done'] = 'Scanned'
+
+    def test_advance_marks_missed(self):
+        queue = [{'loc': (40.0, -73.0, 0), 'kind': 'spawn', 'start': 0,
+                  'end': 100, 'step': 0, 'sp': 'a'},
+                 {'loc': (40.0, -73.0, 0), 'kind': 'spawn', 'start': 0,
+                  'end': 100, 'step': 1, 'sp': 'b', 'done': 'Scanned'}]
+        index = ScanQueue(queue)
+        self.assertEqual(0, index.advance(50, 0))
+        self.assertEqual(1, index.advance(150, 0))
+        self.assertEqual('Missed', queue[0]['done'])
+        self.assertEqual('Scanned', queue[1]['done'])
+        self.assertEqual({}, index.best((40.0, -73.0), 0, 35, 'worker'))
+
+    def test_release(self):
+        queue = [{'loc': (40.0, -73.0, 0), 'kind': 'band', 'start': 0,
+                  'end': 600, 'step': 0, 'sp': None}]
+        index = ScanQueue(queue)
+        index.advance(10, 0)
+        best = index.best((40.0, -73.0), 0, 35, 'worker')
+        self.assertEqual(0, best['id'])
+        queue[0]['done'] = 'Scanned'
+        self.assertEqual({}, index.best((40.0, -73.0), 0, 35, 'worker'))
+        index.release(0)
+        index.advance(20, 0)
+        self.assertEqual(0, index.best((40.0, -73.0), 0, 35, 'worker')['id'])
+
+    def test_parked(self):
+        queue = [{'loc': (40.0, -73.0, 0), 'kind': 'TTH', 'start': 0,
+                  'end': 600, 'step': 0, 'sp': 'a'}]
+        index = ScanQueue(queue)
+        index.advance(10, 0)
+        queue[0]['parked_name'] = 'other'
+        self.assertEqual({}, index.best((40.0, -73.0), 0, 35, 'worker'))
+        self.assertEqual(0, index.best((40.0, -73.0), 0, 35, 'other')['id'])
+        self.assertEqual(set([0]), index.items_for_sp('a'))
+
+    def test_merge(self):
+        def item(kind, start, end, sp='a'):
+            return {'loc': (40.0, -73.0, 0), 'kind': kind, 'start': start,
+                    'end': end, 'step': 0, 'sp': sp}
+
+        index = ScanQueue([item('spawn', 100, 400), item('TTH', 200, 300)])
+        spawn = index.get(0)
+        spawn['done'] = 'Scanned'
+
+        # The same items again, one TTH with a narrower window and a new
+        # spawn.
+        added, updated = index.merge([item('spawn', 100, 400),
+                                      item('TTH', 250, 300),
+                                      item('spawn', 3700, 4000)])
+        self.assertEqual((1, 1), (added, updated))
+        self.assertEqual(3, len(index))
+        self.assertIs(spawn, index.get(0))
+        self.assertEqual(250, index.get(1)['start'])
+        self.assertEqual([100, 250, 3700],
+                         [i['start'] for i in index.queue])
+
+        # Nothing ended yet.
+        self.assertEqual([], index.retire(50))
+        # The TTH search is missed, the scanned spawn kept as it was. Both
+        # stay in the index until the grace period is over.
+        ended = index.retire(500, grace=600)
+        self.assertEqual(['Scanned', 'Missed'], [i['done'] for i in ended])
+        self.assertEqual(3, len(index))
+        self.assertEqual([], index.retire(600, grace=600))
+        self.assertEqual(1, len(index.retire(4100, grace=600)))
+        self.assertEqual(1, len(index))
+        self.assertIsNone(index.get(0))
+        self.assertEqual(set([2]), index.items_for_sp('a'))
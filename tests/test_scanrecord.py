@@ -0,0 +1,50 @@
+import os
+import shutil
+import tempfile
+import unittest
+from pogom.fakemap import FakeMap
+from pogom.scanrecord import ScanRecorder, read_scans
+
+
+class ScanRecordTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'scans.json.gz')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_round_trip(self):
+        fake_map = FakeMap((40.0, -73.0), 200, 40, pokestops=5, gyms=5)
+        scans = [fake_map.map_objects((40.0, -73.0, 0), 1496318400 + n * 60)
+                 for n in range(5)]
+        recorder = ScanRecorder(self.path)
+        for response, _ in scans:
+            cells = response['responses']['GET_MAP_OBJECTS']['map_cells']
+            # Fields parse_map doesn't read aren't recorded.
+            cells[0]['s2_cell_id'] = 1
+            recorder.write((40.0, -73.0, 0), response)
+        recorder.close()
+
+        replayed = list(read_scans(self.path))
+        self.assertEqual(5, len(replayed))
+        for (response, _), (loc, replay) in zip(scans, replayed):
+            self.assertEqual((40.0, -73.0, 0), loc)
+            cell = response['responses']['GET_MAP_OBJECTS']['map_cells'][0]
+            del cell['s2_cell_id']
+            self.assertEqual(
+                [cell],
+                replay['responses']['GET_MAP_OBJECTS']['map_cells'])
+
+    def test_truncated_recording(self):
+        recorder = ScanRecorder(self.path)
+        response, _ = FakeMap((40.0, -73.0), 200, 40).map_objects(
+            (40.0, -73.0, 0), 1496318400)
+        for _ in range(3):
+            recorder.write((40.0, -73.0, 0), response)
+        recorder.close()
+        with open(self.path, 'rb') as f:
+            data = f.read()
+        with open(self.path, 'wb') as f:
+            f.write(data[:-20])
+        self.assertLessEqual(len(list(read_scans(self.path))), 3)
@@ -0,0 +1,73 @@
+import logging
+import unittest
+
+import fixtures
+
+app = db = None
+
+
+def setUpModule():
+    global app, db
+    app, db = fixtures.init_db()
+    logging.getLogger('pogom').setLevel(logging.ERROR)
+
+
+def simulate(name, hours=2, workers=1):
+    from pogom.fakemap import FakeMap
+    from pogom.utils import get_args
+    from simulator import Simulation
+
+    # Three spawnpoints of every shape, within the 7 scan circles.
+    fake_map = FakeMap((40.0, -73.0), 150, 24, seed=3)
+    simulation = Simulation(name, fake_map, get_args(), db, workers=workers,
+                            history_hours=2, warmup=1800)
+    result = simulation.run(hours * 3600)
+    # Timings are the only results that change between runs.
+    del result['next_item'], result['schedule']
+    return result
+
+
+class SimulatorTest(unittest.TestCase):
+    def test_fake_map_shapes(self):
+        from pogom.fakemap import FakeMap
+
+        fake_map = FakeMap((40.0, -73.0), 150, 8)
+        kinds = [(sp['shape'], sp['kind'], sp['links'])
+                 for sp in fake_map.spawnpoints]
+        self.assertIn(('1x60', 'ssss', '+++-'), kinds)
+        self.assertIn(('1x60h2', 'shss', '+h+-'), kinds)
+        self.assertIn(('2x15', 'hshs', 'h-h-'), kinds)
+
+        sp = fake_map.spawnpoints[0]
+        start = 1496318400 + 3600 - (1496318400 - sp['start']) % 3600
+        self.assertIsNone(fake_map.encounter(sp, start + 10))
+        e = fake_map.encounter(sp, start + 2700 + 10)
+        self.assertEqual((start + 2700, start + 3600),
+                         (e['appears'], e['despawns']))
+        response, seen = fake_map.map_objects(
+            (sp['latitude'], sp['longitude']), start + 3600 - 30)
+        wild = response['responses']['GET_MAP_OBJECTS']['map_cells'][0][
+            'wild_pokemons']
+        self.assertEqual([30000], [p['time_till_hidden_ms'] for p in wild
+                                   if p['spawn_point_id'] == sp['id']])
+
+    def test_deterministic(self):
+        self.assertEqual(simulate('speedscan', hours=1),
+                         simulate('speedscan', hours=1))
+
+    # Regression bounds for scheduler changes, a few points under what the
+    # schedulers reach now.
+    def test_hexsearch(self):
+        result = simulate('hexsearch')
+        self.assertGreaterEqual(result['reached'], 95)
+        self.assertLessEqual(result['delay'], 60)
+
+    def test_speedscan(self):
+        result = simulate('speedscan')
+        self.assertGreaterEqual(result['reached'], 90)
+        self.assertGreaterEqual(result['tth'], 40)
+        self.assertLessEqual(result['delay'], 240)
+
+    def test_spawnscan(self):
+        result = simulate('spawnscan')
+        self.assertGreaterEqual(result['reached'], 85)
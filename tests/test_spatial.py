@@ -0,0 +1,198 @@
+import math
+import random
+import unittest
+from datetime import datetime, timedelta
+import geopy.distance
+
+import fixtures
+from pogom import spatial
+from pogom.utils import in_radius
+
+
+def setUpModule():
+    fixtures.setup()
+
+
+def make_pokemon(encounter_id, lat, lng, disappear_time, pokemon_id=1,
+                 last_modified=None):
+    return {
+        'encounter_id': encounter_id,
+        'pokemon_id': pokemon_id,
+        'latitude': lat,
+        'longitude': lng,
+        'disappear_time': disappear_time,
+        'last_modified': last_modified
+    }
+
+
+class ActivePokemonIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.now = datetime(2017, 6, 1, 12, 0, 0)
+        self.later = self.now + timedelta(minutes=15)
+        self.index = spatial.ActivePokemonIndex()
+        self.index.add([
+            make_pokemon('a', 40.001, -73.001, self.later, 1),
+            make_pokemon('b', 40.051, -73.051, self.later, 2),
+            make_pokemon('c', 40.201, -73.201, self.later, 3)
+        ], now_date=self.now)
+
+    def query_ids(self, *args, **kwargs):
+        kwargs.setdefault('now_date', self.now)
+        return sorted(p['encounter_id']
+                      for p in self.index.query(*args, **kwargs))
+
+    def test_viewport(self):
+        self.assertEqual(['a', 'b', 'c'],
+                         self.query_ids(None, None, None, None))
+        self.assertEqual(['a', 'b'],
+                         self.query_ids('40.0', '-73.1', '40.1', '-73.0'))
+        self.assertEqual([], self.query_ids(41, -73.1, 41.1, -73.0))
+
+    def test_zoomed_out(self):
+        # More cells in view than occupied, the occupied ones are walked.
+        self.assertEqual(['a', 'b', 'c'],
+                         self.query_ids(-80, -170, 80, 170))
+        self.assertEqual(['a', 'b'],
+                         self.query_ids(-80, -170, 40.1, -73.0))
+
+    def test_old_viewport_excluded(self):
+        self.assertEqual(['b'],
+                         self.query_ids(40.0, -73.1, 40.1, -73.0,
+                                        0, 40.0, -73.01, 40.01, -73.0))
+
+    def test_timestamp(self):
+        self.index.add([make_pokemon('d', 40.002, -73.002, self.later,
+                                     last_modified=self.now +
+                                     timedelta(minutes=1))],
+                       now_date=self.now)
+        timestamp = (self.now - datetime(1970, 1, 1)).total_seconds() * 1000
+        self.assertEqual(['d'],
+                         self.query_ids(40.0, -73.1, 40.1, -73.0, timestamp))
+
+    def test_ids(self):
+        self.assertEqual(['b', 'c'],
+                         self.query_ids(None, None, None, None, ids=[2, 3]))
+
+    def test_expiry(self):
+        self.index.add([make_pokemon('d', 40.002, -73.002,
+                                     self.now + timedelta(minutes=1))],
+                       now_date=self.now)
+        self.assertEqual(4, len(self.index))
+        self.assertEqual(['a', 'b', 'c'],
+                         self.query_ids(None, None, None, None,
+                                        now_date=self.now +
+                                        timedelta(minutes=2)))
+        self.assertEqual(3, len(self.index))
+
+    def test_replace(self):
+        # A rescan moving a Pokemon must not leave it in its old cell.
+        self.index.add([make_pokemon('a', 40.201, -73.201, self.later)],
+                       now_date=self.now)
+        self.assertEqual(3, len(self.index))
+        self.assertEqual(['b'],
+                         self.query_ids(40.0, -73.1, 40.1, -73.0))
+
+    def test_results_are_copies(self):
+        self.index.query(None, None, None, None,
+                         now_date=self.now)[0]['latitude'] = 0
+        self.assertEqual(['a', 'b', 'c'],
+                         self.query_ids(40.0, -73.3, 40.3, -73.0))
+
+
+# The scalar pair loop ScannedLocation.link_spawn_points used to do.
+def link_scalar(scans, spawn_points, distance):
+    links = {}
+    for cell, scan in scans.iteritems():
+        deg_at_lat = 0.0007 / math.cos(math.radians(scan['loc'][0]))
+        for sp in spawn_points:
+            if (abs(sp['latitude'] - scan['loc'][0]) > 0.0008 or
+                    abs(sp['longitude'] - scan['loc'][1]) > deg_at_lat):
+                continue
+            if in_radius((sp['latitude'], sp['longitude']),
+                         scan['loc'], distance):
+                links[cell + sp['id']] = {'spawnpoint': sp['id'],
+                                          'scannedlocation': cell}
+    return links
+
+
+class LinkSpawnPointsTest(unittest.TestCase):
+    def test_bucketed_matches_scalar(self):
+        from pogom.models import ScannedLocation
+
+        rand = random.Random(3)
+        for lat, lng in ((40.0, -73.0), (-33.9, 151.2), (64.1, -21.9),
+                         (0.0005, -0.0005)):
+            scans = {}
+            for n in range(200):
+                loc = (lat + rand.uniform(-0.01, 0.01),
+                       lng + rand.uniform(-0.01, 0.01), 0)
+                scans['scan{}'.format(n)] = {'loc': loc, 'step': n}
+            spawn_points = [{'id': 'sp{}'.format(n),
+                             'latitude': lat + rand.uniform(-0.011, 0.011),
+                             'longitude': lng + rand.uniform(-0.011, 0.011)}
+                            for n in range(2000)]
+            initial = dict((cell, {'done': False}) for cell in scans)
+            links = {}
+            ScannedLocation.link_spawn_points(scans, initial, spawn_points,
+                                              0.07, links)
+            expected = link_scalar(scans, spawn_points, 0.07)
+            self.assertTrue(expected)
+            self.assertEqual(expected, links)
+            # Done cells are skipped.
+            initial = dict((cell, {'done': True}) for cell in scans)
+            links = {}
+            ScannedLocation.link_spawn_points(scans, initial, spawn_points,
+                                              0.07, links)
+            self.assertEqual({}, links)
+
+
+# Spawnpoints around a location, some of them right at `meters` from it.
+def spawn_points_around(rand, lat, lng, meters, count):
+    points = []
+    for n in range(count):
+        if n % 4 == 0:
+            # Just inside or outside of the limit.
+            distance = meters + rand.uniform(-0.5, 0.5)
+            dest = geopy.distance.distance(meters=distance).destination(
+                (lat, lng), rand.uniform(0, 360))
+            point = (dest.latitude, dest.longitude)
+        else:
+            point = (lat + rand.uniform(-0.003, 0.003),
+                     lng + rand.uniform(-0.003, 0.003))
+        points.append({'id': 'sp{}'.format(n), 'latitude': point[0],
+                       'longitude': point[1]})
+    return points
+
+
+class SpatialIndexTest(unittest.TestCase):
+    # What HexSearchSpawnpoint used to check for every location.
+    def geodesic_near(self, loc, points, meters):
+        return set(p['id'] for p in points
+                   if geopy.distance.distance(
+                       loc, (p['latitude'], p['longitude'])).meters <= meters)
+
+    def test_matches_geodesic(self):
+        rand = random.Random(5)
+        for lat, lng in ((40.0, -73.0), (-33.9, 151.2), (64.1, -21.9),
+                         (0.0005, -0.0005)):
+            points = spawn_points_around(rand, lat, lng, 70, 400)
+            index = spatial.SpatialIndex(points)
+            self.assertEqual(400, len(index))
+            for loc in [(lat, lng)] + [
+                    (lat + rand.uniform(-0.002, 0.002),
+                     lng + rand.uniform(-0.002, 0.002)) for _ in range(50)]:
+                expected = self.geodesic_near(loc, points, 70)
+                self.assertEqual(expected, set(
+                    p['id'] for p in index.near(loc, 70)))
+                self.assertEqual(bool(expected), index.any_near(loc, 70))
+
+    def test_within_distance(self):
+        rand = random.Random(6)
+        center = (51.5, -0.1)
+        for meters in (70, 1282.6, 4840):
+            for p in spawn_points_around(rand, center[0], center[1], meters,
+                                         200):
+                loc = (p['latitude'], p['longitude'])
+                self.assertEqual(
+                    geopy.distance.distance(center, loc).meters <= meters,
+                    spatial.within_distance(center, loc, meters))
@@ -0,0 +1,212 @@
+import unittest
+from datetime import datetime
+from peewee import (SqliteDatabase, MySQLDatabase, Model, CharField,
+                    IntegerField, DateTimeField, BooleanField, CompositeKey,
+                    InsertQuery)
+from pymysql.cursors import RE_INSERT_VALUES
+from pogom.upsert import SqliteUpsert, MysqlUpsert
+
+
+def make_model(db):
+    class Row(Model):
+        id = CharField(primary_key=True)
+        count = IntegerField(default=0)
+        seen = DateTimeField()
+        done = BooleanField(default=False)
+        note = CharField(null=True)
+
+        class Meta:
+            database = db
+    return Row
+
+
+class SqliteUpsertTest(unittest.TestCase):
+    def setUp(self):
+        self.when = datetime(2017, 6, 1, 12, 30, 15, 123456)
+        self.rows = [{'id': 'r{}'.format(i), 'seen': self.when,
+                      'done': i % 2 == 0, 'note': None}
+                     for i in range(450)]
+
+    def written(self, write):
+        db = SqliteDatabase(':memory:')
+        Row = make_model(db)
+        db.create_table(Row)
+        with db.atomic():
+            write(Row, db)
+        return [tuple(r) for r in
+                db.execute_sql('SELECT * FROM row ORDER BY id').fetchall()]
+
+    def test_matches_peewee(self):
+        def peewee(Row, db):
+            for i in range(0, len(self.rows), 50):
+                InsertQuery(Row, rows=self.rows[i:i + 50]).upsert().execute()
+
+        # 5 columns per row, 199 rows per statement: 2 full ones and a
+        # partial one.
+        upsert = SqliteUpsert()
+        self.assertEqual(199, upsert.rows_per_statement(5))
+        statements = []
+
+        def fast(Row, db):
+            statements.append(upsert.write(Row, self.rows, db))
+            # Replace some rows.
+            self.rows[0]['note'] = 'changed'
+            upsert.write(Row, self.rows[:1], db)
+
+        expected = self.written(peewee)
+        written = self.written(fast)
+        self.assertEqual([3], statements)
+        self.assertEqual(450, len(written))
+        self.assertEqual(expected[1:], written[1:])
+        self.assertEqual(u'changed', written[0][-1])
+
+    def test_statements_go_through_execute_sql(self):
+        class CountingDatabase(SqliteDatabase):
+            executed = 0
+
+            def execute_sql(self, *args, **kwargs):
+                self.executed += 1
+                return super(CountingDatabase, self).execute_sql(*args,
+                                                                 **kwargs)
+
+        db = CountingDatabase(':memory:')
+        Row = make_model(db)
+        db.create_table(Row)
+        with db.atomic():
+            db.executed = 0
+            statements = SqliteUpsert().write(Row, self.rows, db)
+        self.assertEqual(3, statements)
+        self.assertEqual(statements, db.executed)
+
+    def test_merge(self):
+        db = SqliteDatabase(':memory:')
+
+        class Count(Model):
+            hour = IntegerField()
+            kind = IntegerField()
+            count = IntegerField(default=0)
+            seen = DateTimeField()
+            note = CharField()
+
+            class Meta:
+                database = db
+                primary_key = CompositeKey('hour', 'kind')
+                upsert_merge = {'count': 'add', 'seen': 'max',
+                                'note': 'latest'}
+                upsert_latest_by = 'seen'
+
+        db.create_table(Count)
+        later = datetime(2017, 6, 1, 13)
+        upsert = SqliteUpsert()
+        with db.atomic():
+            upsert.write(Count, [
+                {'hour': 1, 'kind': 1, 'count': 2, 'seen': self.when,
+                 'note': 'a'}], db)
+            # An older row is added to the count but doesn't replace the
+            # rest, a newer one does.
+            upsert.write(Count, [
+                {'hour': 1, 'kind': 1, 'count': 3, 'seen': later,
+                 'note': 'b'},
+                {'hour': 2, 'kind': 1, 'count': 1, 'seen': later,
+                 'note': 'c'}], db)
+            upsert.write(Count, [
+                {'hour': 1, 'kind': 1, 'count': 1, 'seen': self.when,
+                 'note': 'd'}], db)
+        rows = dict(((r.hour, r.kind), r) for r in Count.select())
+        self.assertEqual(6, rows[(1, 1)].count)
+        self.assertEqual(later, rows[(1, 1)].seen)
+        self.assertEqual('b', rows[(1, 1)].note)
+        self.assertEqual(1, rows[(2, 1)].count)
+
+
+# Records what's run instead of talking to a server.
+class FakeCursor(object):
+    def __init__(self):
+        self.calls = []
+
+    def executemany(self, sql, params):
+        self.calls.append((sql, params))
+
+
+class FakeMySQLDatabase(MySQLDatabase):
+    def __init__(self):
+        super(FakeMySQLDatabase, self).__init__('fake')
+        self.cursor = FakeCursor()
+
+    def execute_many(self, sql, param_list):
+        self.cursor.executemany(sql, param_list)
+        return self.cursor
+
+
+class MysqlUpsertTest(unittest.TestCase):
+    def setUp(self):
+        self.db = FakeMySQLDatabase()
+
+    def test_updates_only_upsert_columns(self):
+        class Point(Model):
+            id = CharField(primary_key=True)
+            latitude = IntegerField()
+            seen = IntegerField(default=0)
+
+            class Meta:
+                database = self.db
+                upsert_columns = ('seen',)
+
+        rows = [{'id': 'p{}'.format(i), 'latitude': i} for i in range(5)]
+        upsert = MysqlUpsert()
+        self.assertEqual(3, upsert.write(Point, rows, self.db, 2))
+        sql, params = self.db.cursor.calls[0]
+        self.assertEqual('INSERT INTO `point` (`id`, `latitude`, `seen`) ' +
+                         'VALUES (%s, %s, %s) ON DUPLICATE KEY UPDATE ' +
+                         '`seen` = VALUES(`seen`)', sql)
+        self.assertEqual([['p0', 0, 0], ['p1', 1, 0]], params)
+        self.assertEqual([['p4', 4, 0]], self.db.cursor.calls[2][1])
+        # pymysql turns it into one multi-row statement per call.
+        self.assertTrue(RE_INSERT_VALUES.match(sql))
+
+    def test_default_and_composite_keys(self):
+        class Row(Model):
+            id = CharField(primary_key=True)
+            count = IntegerField()
+            note = CharField()
+
+            class Meta:
+                database = self.db
+
+        class Link(Model):
+            a = CharField()
+            b = CharField()
+
+            class Meta:
+                database = self.db
+                primary_key = CompositeKey('a', 'b')
+
+        upsert = MysqlUpsert()
+        upsert.write(Row, [{'id': 'r', 'count': 1, 'note': 'x'}], self.db, 10)
+        upsert.write(Link, [{'a': 'x', 'b': 'y'}], self.db, 10)
+        self.assertTrue(self.db.cursor.calls[0][0].endswith(
+            'UPDATE `count` = VALUES(`count`), `note` = VALUES(`note`)'))
+        self.assertTrue(self.db.cursor.calls[1][0].endswith(
+            'UPDATE `a` = VALUES(`a`)'))
+
+    def test_merge(self):
+        class Count(Model):
+            hour = IntegerField()
+            count = IntegerField(default=0)
+            seen = IntegerField()
+            note = CharField()
+
+            class Meta:
+                database = self.db
+                primary_key = CompositeKey('hour')
+                upsert_merge = {'count': 'add', 'seen': 'max',
+                                'note': 'latest'}
+                upsert_latest_by = 'seen'
+
+        MysqlUpsert().write(Count, [{'hour': 1, 'count': 1, 'seen': 2,
+                                     'note': 'x'}], self.db, 10)
+        # The note is compared with the stored time before it's updated.
+        self.assertTrue(self.db.cursor.calls[0][0].endswith(
+            'UPDATE `note` = IF(VALUES(`seen`) > `seen`, VALUES(`note`), ' +
+            '`note`), `count` = `count` + VALUES(`count`), ' +
+            '`seen` = GREATEST(`seen`, VALUES(`seen`))'))
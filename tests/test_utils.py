@@ -16,3 +16,17 @@ class UtilsTest(unittest.TestCase):
 
         # Unknown ID raises KeyError
         self.assertRaises(KeyError, utils.get_pokemon_name, 12367)
+
+    def test_get_pokemon_info(self):
+        info = utils.get_pokemon_info(1)
+        self.assertEqual("Bulbasaur", info['pokemon_name'])
+        self.assertEqual(utils.get_pokemon_rarity(1), info['pokemon_rarity'])
+        self.assertEqual(utils.get_pokemon_types(1),
+                         list(info['pokemon_types']))
+        self.assertIs(info, utils.get_pokemon_info("1"))
+
+    def test_get_move_info(self):
+        info = utils.get_move_info(1)
+        self.assertEqual("Thunder Shock", info['name'])
+        self.assertEqual(utils.get_move_type(1), info['type'])
+        self.assertRaises(KeyError, utils.get_move_info, 12367)
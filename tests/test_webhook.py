@@ -0,0 +1,262 @@
+import copy
+import json
+import logging
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from SocketServer import ThreadingMixIn
+
+import fixtures
+
+
+def setUpModule():
+    fixtures.setup()
+
+
+class Receiver(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+# Starts a receiver keeping the bodies posted to it, answering after
+# `delay` seconds. The first `failures` posts get a 503, and bodies
+# `reject` returns True for a 400. Returns (url, bodies).
+def receiver(delay=0, failures=0, reject=None):
+    bodies = []
+    failed = []
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            length = int(self.headers.getheader('content-length', 0))
+            body = json.loads(self.rfile.read(length))
+            if len(failed) < failures:
+                failed.append(body)
+                self.send_response(503)
+                self.end_headers()
+                return
+            if reject and reject(body):
+                self.send_response(400)
+                self.end_headers()
+                return
+            bodies.append(body)
+            time.sleep(delay)
+            self.send_response(200)
+            self.end_headers()
+
+        def log_message(self, *args):
+            pass
+
+    server = Receiver(('127.0.0.1', 0), Handler)
+    t = threading.Thread(target=server.serve_forever)
+    t.daemon = True
+    t.start()
+    return 'http://127.0.0.1:{}/'.format(server.server_address[1]), bodies
+
+
+def batch_args(webhooks, **kwargs):
+    from pogom.utils import get_args
+
+    args = copy.copy(get_args())
+    args.webhooks = webhooks
+    args.wh_batch_size = 10
+    args.wh_batch_time = 0.2
+    args.wh_batch_queue = 100
+    args.wh_concurrency = 1
+    args.wh_retries = 0
+    for name, value in kwargs.iteritems():
+        setattr(args, name, value)
+    return args
+
+
+def message(n):
+    return {'type': 'pokemon', 'message': {'encounter_id': n}}
+
+
+class WebhookBatcherTest(unittest.TestCase):
+    def test_batches(self):
+        from pogom.webhook import WebhookBatcher
+
+        url, bodies = receiver()
+        batcher = WebhookBatcher(batch_args([url]))
+        for n in range(25):
+            batcher.send(message(n))
+        batcher.join()
+
+        # Two full batches, and the rest after wh_batch_time.
+        self.assertEqual([10, 10, 5], [len(body) for body in bodies])
+        self.assertEqual(range(25), [m['message']['encounter_id']
+                                     for body in bodies for m in body])
+        stats = batcher.stats()[url]
+        self.assertEqual((25, 3, 0, 0), (stats['messages'], stats['batches'],
+                                         stats['failed'], stats['drops']))
+
+    def test_slow_endpoint(self):
+        from pogom.webhook import WebhookBatcher
+
+        fast_url, fast_bodies = receiver()
+        slow_url, slow_bodies = receiver(delay=0.5)
+        batcher = WebhookBatcher(batch_args([fast_url, slow_url],
+                                            wh_batch_queue=20, wh_timeout=5))
+        # The slow endpoint's queue overflows, the fast one keeps up.
+        for n in range(100):
+            batcher.send(message(n))
+            time.sleep(0.005)
+        batcher.join()
+
+        self.assertEqual(100, sum(len(body) for body in fast_bodies))
+        stats = batcher.stats()
+        self.assertEqual(0, stats[fast_url]['drops'])
+        self.assertGreater(stats[slow_url]['drops'], 0)
+        self.assertEqual(100, stats[slow_url]['messages'] +
+                         stats[slow_url]['drops'])
+        self.assertGreater(stats[slow_url]['latency'], 0.4)
+
+
+class WebhookOutboxTest(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        logging.getLogger('pogom.webhook').setLevel(logging.ERROR)
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_recovering_endpoint(self):
+        from pogom.webhook import WebhookOutbox
+
+        url, bodies = receiver(failures=1)
+        outbox = WebhookOutbox(batch_args([url], wh_batch_size=0,
+                                          wh_outbox=self.path,
+                                          wh_outbox_size=10, wh_outbox_age=1,
+                                          wh_outbox_rate=100))
+        started = time.time()
+        for n in range(40):
+            outbox.send(message(n))
+        outbox.join()
+
+        # Nothing lost to the failure, in order, and no faster than the
+        # rate.
+        self.assertEqual(range(40), [m['message']['encounter_id']
+                                     for m in bodies])
+        self.assertGreater(time.time() - started, 0.4)
+        stats = outbox.stats()[url]
+        self.assertEqual((40, 1, 0), (stats['messages'], stats['failed'],
+                                      stats['drops']))
+        outbox.close()
+
+    def test_rejected_message(self):
+        from pogom.webhook import OutboxEndpoint, WebhookOutbox
+
+        self.addCleanup(setattr, OutboxEndpoint, 'min_backoff',
+                        OutboxEndpoint.min_backoff)
+        OutboxEndpoint.min_backoff = 0.01
+        url, bodies = receiver(
+            reject=lambda body: body['message']['encounter_id'] == 3)
+        outbox = WebhookOutbox(batch_args([url], wh_batch_size=0,
+                                          wh_outbox=self.path,
+                                          wh_outbox_size=10, wh_outbox_age=1,
+                                          wh_outbox_rate=0))
+        for n in range(10):
+            outbox.send(message(n))
+        outbox.join()
+
+        # Dropped after max_rejections tries, the rest still get through.
+        self.assertEqual([n for n in range(10) if n != 3],
+                         [m['message']['encounter_id'] for m in bodies])
+        stats = outbox.stats()[url]
+        self.assertEqual((9, 3, 1), (stats['messages'], stats['failed'],
+                                     stats['drops']))
+        outbox.close()
+
+    def test_restart(self):
+        from pogom.outbox import Outbox
+        from pogom.webhook import WebhookOutbox
+
+        url, bodies = receiver()
+        # Messages left in the outbox by the previous run.
+        outbox = Outbox(self.path)
+        outbox.register([url])
+        for n in range(25):
+            outbox.append(message(n))
+        outbox.close()
+
+        outbox = WebhookOutbox(batch_args([url], wh_outbox=self.path,
+                                          wh_outbox_size=10, wh_outbox_age=1,
+                                          wh_outbox_rate=0))
+        outbox.send(message(25))
+        outbox.join()
+        self.assertEqual(range(26), [m['message']['encounter_id']
+                                     for body in bodies for m in body])
+        outbox.close()
+
+
+class ShardedLFUCacheTest(unittest.TestCase):
+    def test_update(self):
+        from pogom.webhook import ShardedLFUCache
+
+        cache = ShardedLFUCache(100)
+        self.assertEqual('new', cache.update(1, 10))
+        self.assertIsNone(cache.update(1, 10))
+        self.assertEqual('changed', cache.update(1, 11))
+        self.assertIsNone(cache.update(1, 11))
+        self.assertEqual('changed', cache.update(1, None))
+        self.assertIn(1, cache)
+        self.assertNotIn(2, cache)
+
+    def test_bounded(self):
+        from pogom.webhook import ShardedLFUCache
+
+        cache = ShardedLFUCache(100)
+        for ident in range(1000):
+            cache.update(ident, 0)
+        self.assertLessEqual(len(cache), 100)
+        self.assertGreater(len(cache), 50)
+
+    def test_threads(self):
+        from pogom.webhook import ShardedLFUCache
+
+        cache = ShardedLFUCache(10000)
+        updates = []
+
+        def update():
+            for ident in range(2000):
+                updates.append(cache.update(ident, 0))
+
+        threads = [threading.Thread(target=update) for _ in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        # Every identifier was new to exactly one thread.
+        self.assertEqual(2000, updates.count('new'))
+        self.assertEqual(6000, updates.count(None))
+
+
+class DigestTest(unittest.TestCase):
+    def test_key_fields(self):
+        from pogom.webhook import wh_digest
+
+        gym = {'gym_id': 'a', 'team_id': 1, 'guard_pokemon_id': 3,
+               'gym_points': 100, 'enabled': True, 'latitude': 40.0,
+               'longitude': -73.0, 'last_modified': 1}
+        digest = wh_digest('gym', gym)
+        self.assertIsInstance(digest, (int, long))
+        self.assertEqual(digest, wh_digest('gym', dict(gym,
+                                                       last_modified=2)))
+        self.assertNotEqual(digest, wh_digest('gym', dict(gym,
+                                                          gym_points=101)))
+        self.assertIsNone(wh_digest('captcha', {'account': 'a'}))
+
+    def test_nested(self):
+        from pogom.webhook import wh_digest
+
+        def details(cp, trainer):
+            return {'id': 'a', 'latitude': 40.0, 'longitude': -73.0,
+                    'team': 1, 'pokemon': [{'pokemon_id': 1, 'cp': cp,
+                                            'trainer_name': trainer}]}
+
+        self.assertEqual(wh_digest('gym_details', details(10, 'a')),
+                         wh_digest('gym_details', details(10, 'a')))
+        self.assertNotEqual(wh_digest('gym_details', details(10, 'a')),
+                            wh_digest('gym_details', details(11, 'a')))
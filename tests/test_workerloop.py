@@ -0,0 +1,74 @@
+import time
+import unittest
+from threading import Event
+
+from pogom.workerloop import (BlockingCall, Call, Sleep, WorkerLoop,
+                              run_in_thread)
+
+
+def fail():
+    raise ValueError('no')
+
+
+# Records what it got back from its Calls, then sets `done`.
+def worker(name, results, done, seconds=0.05):
+    yield Sleep(seconds)
+    value = yield Call(lambda a, b=0: a + b, 2, b=3)
+    results.append((name, value))
+    try:
+        yield Call(fail)
+    except ValueError as e:
+        results.append((name, str(e)))
+    yield Sleep(seconds)
+    results.append((name, 'slept'))
+    done.set()
+
+
+class WorkerLoopTest(unittest.TestCase):
+    def test_run_in_thread(self):
+        results = []
+        done = Event()
+        run_in_thread(worker('a', results, done))
+        self.assertTrue(done.is_set())
+        self.assertEqual([('a', 5), ('a', 'no'), ('a', 'slept')], results)
+
+    def test_loop(self):
+        loop = WorkerLoop(2)
+        loop.start()
+        results = []
+        events = []
+        for n in range(50):
+            done = Event()
+            events.append(done)
+            loop.add(worker(n, results, done, seconds=0.05 + n * 0.001))
+        started = time.time()
+        for done in events:
+            self.assertTrue(done.wait(5))
+        # The workers slept at the same time.
+        self.assertLess(time.time() - started, 2)
+        for n in range(50):
+            self.assertEqual([(n, 5), (n, 'no'), (n, 'slept')],
+                             [r for r in results if r[0] == n])
+        # Finished workers are dropped right after they set `done`.
+        for _ in range(100):
+            if not loop.workers:
+                break
+            time.sleep(0.01)
+        self.assertEqual(0, loop.workers)
+
+    def test_blocking_calls(self):
+        loop = WorkerLoop(1)
+        loop.start()
+        release = Event()
+        done = Event()
+
+        def solver():
+            yield BlockingCall(release.wait, 5)
+
+        loop.add(solver())
+        results = []
+        # The pool of Calls is free while the blocking one waits.
+        loop.add(worker('a', results, done, seconds=0))
+        self.assertTrue(done.wait(2))
+        self.assertFalse(release.is_set())
+        release.set()